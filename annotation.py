@@ -0,0 +1,40 @@
+"""
+Parser for the domain annotation matrix.
+
+The first row holds the column names: pathway name, number of domains,
+then one column per domain position. Every other row is one pathway
+with the spec (specificity) label of each domain, or NA.
+"""
+
+def read_annotation(path):
+    """
+    Return (pathways, domain_names, annotation):
+      pathways: pathway -> spec -> list of 'pathway|domain' headers
+      domain_names: the domain column names
+      annotation: pathway -> its spec labels in domain order
+    """
+    pathways = {}
+    domain_names = []
+    annotation = {}
+    with open(path) as a:
+        l = 0  
+        for ln in a.read().splitlines():
+            s = ln.split("\t")
+            if(l==0):
+                domain_names = s[2:]
+            else:
+                if s[0] not in pathways:
+                    pathways[s[0]] = {}
+                d = s[2:]
+                for i, spec in enumerate(d):
+                    if spec == 'NA':
+                        continue
+                    domain = '|'.join([s[0], domain_names[i]])
+                    if s[0] not in annotation:
+                        annotation[s[0]] = []
+                    annotation[s[0]].append(spec)
+                    if spec not in pathways[s[0]]:
+                        pathways[s[0]][spec] = []
+                    pathways[s[0]][spec].append(domain)
+            l += 1
+    return pathways, domain_names, annotation
@@ -0,0 +1,235 @@
+"""
+Benchmarks of the dendrogram pipeline on synthetic inputs.
+
+Writes an annotation matrix and a DIAMOND table of the layout
+generate_dendrogram.py reads for each requested number of pathways,
+then times each stage separately: Munkres.compute and compute_batch,
+calculate_GK, cluster_distance, the hit-table parse,
+generate_distance_matrix and tree construction. The all-pairs stages
+grow quadratically, so they are only run up to --max-all-pairs
+pathways; cluster_distance is timed on a sample of pairs at every size.
+
+    python benchmark.py --sizes 100,1000,20000 --out bench.json
+    python benchmark.py --sizes 100,1000 --baseline bench.json
+
+Results are saved as JSON; with --baseline each stage is printed next
+to its time in an earlier result file.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import numpy as np
+
+import generate_dendrogram as dendrogram
+from annotation import read_annotation
+from hits import read_hits
+from trees import upgma
+from model import compile_model
+
+## DIAMOND's default tabular columns after the first three
+_HIT_COLUMNS = ["100", "0", "0", "1", "100", "1", "100", "1e-20", "200"]
+
+def write_annotation(path, npathways, ndomains=12, nspecs=25, rng=None):
+    """
+    Write a random annotation matrix of npathways pathways with up to
+    ndomains domain columns. Returns the (header, spec) of every domain.
+    """
+    rng = rng or random.Random(0)
+    columns = ["KS%d" % (i + 1) for i in range(ndomains)]
+    specs = ["spec%d" % i for i in range(nspecs)]
+    domains = []
+    with open(path, "w") as f:
+        f.write("\t".join(["pathway", "n"] + columns) + "\n")
+        for p in range(npathways):
+            name = "P%06d" % p
+            k = rng.randint(2, ndomains)
+            ## Skewed spec usage, as a few specificities dominate real data
+            pool = specs[:rng.randint(3, nspecs)]
+            row = []
+            for i in range(ndomains):
+                ## Every pathway keeps its first domain; the script
+                ## assumes each one has at least one annotated domain
+                if i < k and (i == 0 or rng.random() < 0.9):
+                    row.append(rng.choice(pool))
+                    domains.append(("%s|%s" % (name, columns[i]), row[-1]))
+                else:
+                    row.append("NA")
+            f.write("\t".join([name, str(k)] + row) + "\n")
+    return domains
+
+def write_hits(path, domains, hits_per_domain=50, rng=None):
+    """
+    Write a DIAMOND table for domains: a self hit per domain, up to
+    hits_per_domain hits to domains of the same spec, a few to other
+    specs, and now and then a second HSP of the same pair.
+    """
+    rng = rng or random.Random(0)
+    by_spec = {}
+    for header, spec in domains:
+        by_spec.setdefault(spec, []).append(header)
+    headers = [header for header, spec in domains]
+    with open(path, "w") as f:
+        for query, spec in domains:
+            same = by_spec[spec]
+            subjects = rng.sample(same, min(len(same), hits_per_domain))
+            subjects += rng.sample(headers, min(len(headers), max(1, hits_per_domain // 20)))
+            f.write("\t".join([query, query, "100.0"] + _HIT_COLUMNS) + "\n")
+            for subject in subjects:
+                if subject == query:
+                    continue
+                f.write("\t".join([query, subject, "%.1f" % rng.uniform(20, 99)] + _HIT_COLUMNS) + "\n")
+                if rng.random() < 0.05:
+                    f.write("\t".join([query, subject, "%.1f" % rng.uniform(20, 99)] + _HIT_COLUMNS) + "\n")
+
+def timed(func, *args, **kwargs):
+    """(seconds, result) of one call, with the script's chatter silenced."""
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+def sample_pairs(names, count, rng):
+    n = len(names)
+    pairs = []
+    while len(pairs) < count:
+        i, j = rng.randrange(n), rng.randrange(n)
+        if i != j:
+            pairs.append((names[i], names[j]))
+    return pairs
+
+def bench_munkres(count, rng):
+    """
+    Cost matrices of the sizes repeated specs produce, 2x2 to 8x8, one
+    compute() call at a time and all in one compute_batch() call, the
+    way dds_sums solves them.
+    """
+    matrices = []
+    for k in range(count):
+        rows, cols = rng.randint(2, 8), rng.randint(2, 8)
+        matrices.append(np.array([[rng.random() for c in range(cols)] for r in range(rows)]))
+    seconds, _ = timed(lambda: [dendrogram.Munkres().compute(m) for m in matrices])
+    batch_seconds, _ = timed(lambda: dendrogram.Munkres().compute_batch(matrices))
+    return {"seconds": seconds, "calls": count, "per_call": seconds / count,
+            "batch_seconds": batch_seconds, "batch_per_matrix": batch_seconds / count}
+
+def bench_size(npathways, workdir, args, rng):
+    annotation_file = os.path.join(workdir, "annotation.txt")
+    hits_file = os.path.join(workdir, "hits.dbp")
+    domains = write_annotation(annotation_file, npathways, rng=rng)
+    write_hits(hits_file, domains, args.hits_per_domain, rng=rng)
+    result = {"pathways": npathways, "domains": len(domains),
+              "hit_lines": sum(1 for line in open(hits_file))}
+
+    seconds, (pathways, domain_names, annotation) = timed(read_annotation, annotation_file)
+    result["annotation_parse"] = {"seconds": seconds}
+    seconds, dist = timed(read_hits, hits_file)
+    result["hit_parse"] = {"seconds": seconds, "pairs": len(dist)}
+
+    names = list(pathways.keys())
+    pairs = sample_pairs(names, args.sample_pairs, rng)
+    seconds, _ = timed(lambda: [dendrogram.calculate_GK(annotation.get(a, []), annotation.get(b, []), 3)
+                                for a, b in pairs])
+    result["calculate_GK"] = {"seconds": seconds, "calls": len(pairs), "per_call": seconds / len(pairs)}
+    seconds, model = timed(compile_model, pathways, annotation, dist, 3)
+    result["compile_model"] = {"seconds": seconds}
+    seconds, _ = timed(lambda: [dendrogram.cluster_distance(a, b, 3, pathways, dist, annotation, model)
+                                for a, b in pairs])
+    result["cluster_distance"] = {"seconds": seconds, "calls": len(pairs),
+                                  "pairs_per_second": len(pairs) / seconds}
+
+    if npathways <= args.max_all_pairs:
+        seconds, condensed = timed(dendrogram.generate_distance_matrix,
+                                   pathways, domain_names, annotation, dist,
+                                   dendrogram.Jaccardw, dendrogram.GKw, dendrogram.DDSw,
+                                   1, 3, os.path.join(workdir, "distance.txt"),
+                                   workers=args.workers)
+        result["generate_distance_matrix"] = {"seconds": seconds, "workers": args.workers,
+                                              "pairs_per_second": len(condensed) / seconds}
+    else:
+        condensed = None
+    if npathways <= args.max_tree:
+        if condensed is None:
+            ## The tree only needs some metric, not the scored one
+            condensed = np.random.RandomState(rng.randrange(1 << 30)).random_sample(
+                npathways * (npathways - 1) // 2)
+        seconds, _ = timed(upgma, condensed, names)
+        result["tree"] = {"seconds": seconds}
+    return result
+
+def compare(report, baseline):
+    """Print each stage's time next to the baseline's for the same size."""
+    if "munkres" in baseline:
+        print("Munkres.compute: %.1f us -> %.1f us per call"
+              % (baseline["munkres"]["per_call"] * 1e6, report["munkres"]["per_call"] * 1e6))
+        if "batch_per_matrix" in baseline["munkres"]:
+            print("Munkres.compute_batch: %.1f us -> %.1f us per matrix"
+                  % (baseline["munkres"]["batch_per_matrix"] * 1e6,
+                     report["munkres"]["batch_per_matrix"] * 1e6))
+    previous = dict((r["pathways"], r) for r in baseline["results"])
+    for result in report["results"]:
+        old = previous.get(result["pathways"])
+        if old is None:
+            continue
+        print("%d pathways" % result["pathways"])
+        for stage, value in sorted(result.items()):
+            if not isinstance(value, dict) or stage not in old:
+                continue
+            before, after = old[stage]["seconds"], value["seconds"]
+            print("  %-26s %10.4fs %10.4fs  x%.2f" % (stage, before, after,
+                                                    before / after if after else float("inf")))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dendrogram pipeline on synthetic inputs")
+    parser.add_argument("--sizes", default="100,1000,5000,20000",
+                        help="comma-separated numbers of pathways (default: 100,1000,5000,20000)")
+    parser.add_argument("--hits-per-domain", type=int, default=50,
+                        help="same-spec hits per domain in the DIAMOND table (default: 50)")
+    parser.add_argument("--sample-pairs", type=int, default=2000,
+                        help="pathway pairs timed per pair-level stage (default: 2000)")
+    parser.add_argument("--munkres-calls", type=int, default=2000,
+                        help="cost matrices solved by the Munkres benchmark (default: 2000)")
+    parser.add_argument("--max-all-pairs", type=int, default=2000,
+                        help="largest size run through generate_distance_matrix (default: 2000)")
+    parser.add_argument("--max-tree", type=int, default=10000,
+                        help="largest size a tree is built for (default: 10000)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="workers for generate_distance_matrix (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json", help="result file (default: benchmark.json)")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    report = {"python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(), "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "options": vars(args), "munkres": bench_munkres(args.munkres_calls, rng),
+              "results": []}
+    print("Munkres.compute: %.1f us per call, compute_batch: %.1f us per matrix"
+          % (report["munkres"]["per_call"] * 1e6, report["munkres"]["batch_per_matrix"] * 1e6))
+    for npathways in [int(n) for n in args.sizes.split(",")]:
+        workdir = tempfile.mkdtemp(prefix="demo-bench-")
+        try:
+            result = bench_size(npathways, workdir, args, rng)
+        finally:
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            os.rmdir(workdir)
+        report["results"].append(result)
+        print("%d pathways: %s" % (npathways, ", ".join("%s %.3fs" % (stage, value["seconds"])
+                                                      for stage, value in sorted(result.items())
+                                                      if isinstance(value, dict))))
+        ## Saved after every size, so a long run leaves partial results
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
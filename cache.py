@@ -0,0 +1,166 @@
+"""
+On-disk cache of the parsed annotation matrix and hit table.
+
+Each input gets a directory under the cache root holding its parsed
+form as .npy arrays plus a manifest recording the input's size, mtime
+and SHA-1. The manifest is written last, so an interrupted write
+leaves no valid entry behind. An entry is used when size and mtime
+still match, or, after a touch or copy, when the content hash still
+matches; otherwise the input is parsed again and the entry replaced.
+Arrays are memory-mapped on load, so the hit table is usable without
+reading it into memory.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+from annotation import read_annotation
+from hits import HitTable, read_hits
+
+## Bump when the parsed layout or parser semantics change
+CACHE_VERSION = 2
+
+def file_sha1(path, blocksize=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(path, previous=None):
+    """
+    Size, mtime and SHA-1 of a file. The hash is taken from ``previous``
+    when size and mtime are unchanged, so unchanged inputs are not read.
+    """
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if previous and all(previous.get(k) == fp[k] for k in fp):
+        fp["sha1"] = previous["sha1"]
+    else:
+        fp["sha1"] = file_sha1(path)
+    return fp
+
+def _entry_dir(cache_dir, kind, path):
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "%s-%s" % (kind, key))
+
+def _temporary(directory, name):
+    ## A temporary file of its own, so that concurrent runs (shards)
+    ## filling the same entry never write to each other's files
+    fd, tmp = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory)
+    return os.fdopen(fd, "wb"), tmp
+
+def _write_json(path, obj):
+    f, tmp = _temporary(os.path.dirname(path), os.path.basename(path))
+    with f:
+        f.write(json.dumps(obj).encode("utf-8"))
+    os.replace(tmp, path)
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _save_array(entry, name, array):
+    f, tmp = _temporary(entry, name)
+    with f:
+        np.save(f, array)
+    os.replace(tmp, os.path.join(entry, name + ".npy"))
+
+def _load_array(entry, name):
+    return np.load(os.path.join(entry, name + ".npy"), mmap_mode="r")
+
+def _cached(cache_dir, kind, path, options, parse, save, load):
+    """
+    Load the ``kind`` entry for ``path`` if it matches the file and
+    ``options``, otherwise parse the file and store a new entry.
+    Returns (parsed object, input fingerprint).
+    """
+    entry = _entry_dir(cache_dir, kind, path)
+    manifest_path = os.path.join(entry, "manifest.json")
+    manifest = None
+    if os.path.exists(manifest_path):
+        manifest = _read_json(manifest_path)
+        if manifest.get("version") != CACHE_VERSION or manifest.get("options") != options:
+            manifest = None
+    fp = fingerprint(path, manifest and manifest["input"])
+    if manifest and manifest["input"]["sha1"] == fp["sha1"]:
+        if manifest["input"] != fp:
+            ## Touched or copied but unchanged: remember the new mtime
+            manifest["input"] = fp
+            _write_json(manifest_path, manifest)
+        return load(entry, manifest), fp
+    parsed = parse()
+    try:
+        os.remove(manifest_path)
+    except FileNotFoundError:
+        pass
+    os.makedirs(entry, exist_ok=True)
+    manifest = {"version": CACHE_VERSION, "options": options, "input": fp,
+                "source": os.path.abspath(path)}
+    manifest.update(save(entry, parsed))
+    _write_json(manifest_path, manifest)
+    return parsed, fp
+
+def _save_annotation(entry, parsed):
+    pathways, domain_names, annotation = parsed
+    names = list(pathways.keys())
+    specs, domains = {}, {}
+    members = []
+    for p, name in enumerate(names):
+        for spec, headers in pathways[name].items():
+            s = specs.setdefault(spec, len(specs))
+            for header in headers:
+                members.append((p, s, domains.setdefault(header, len(domains))))
+    offsets = [0]
+    sequence = []
+    for name in names:
+        sequence.extend(specs.setdefault(spec, len(specs)) for spec in annotation.get(name, []))
+        offsets.append(len(sequence))
+    _save_array(entry, "members", np.array(members, dtype=np.int32).reshape(-1, 3))
+    _save_array(entry, "sequence", np.array(sequence, dtype=np.int32))
+    _save_array(entry, "offsets", np.array(offsets, dtype=np.int64))
+    _save_array(entry, "annotated", np.array([name in annotation for name in names], dtype=bool))
+    _write_json(os.path.join(entry, "labels.json"),
+                {"pathways": names, "domain_names": domain_names,
+                 "specs": sorted(specs, key=specs.get),
+                 "domains": sorted(domains, key=domains.get)})
+    return {}
+
+def _load_annotation(entry, manifest):
+    labels = _read_json(os.path.join(entry, "labels.json"))
+    names, specs, domains = labels["pathways"], labels["specs"], labels["domains"]
+    pathways = dict((name, {}) for name in names)
+    for p, s, d in _load_array(entry, "members").tolist():
+        pathways[names[p]].setdefault(specs[s], []).append(domains[d])
+    sequence = _load_array(entry, "sequence").tolist()
+    offsets = _load_array(entry, "offsets").tolist()
+    annotated = _load_array(entry, "annotated")
+    annotation = {}
+    for p, name in enumerate(names):
+        if annotated[p]:
+            annotation[name] = [specs[s] for s in sequence[offsets[p]:offsets[p+1]]]
+    return pathways, labels["domain_names"], annotation
+
+def _save_hits(entry, table):
+    _save_array(entry, "keys", table.keys)
+    _save_array(entry, "values", table.values)
+    _write_json(os.path.join(entry, "headers.json"), table.headers)
+    return {"capacity": table.capacity, "npairs": len(table)}
+
+def _load_hits(entry, manifest):
+    return HitTable(_read_json(os.path.join(entry, "headers.json")),
+                    _load_array(entry, "keys"), _load_array(entry, "values"),
+                    manifest["capacity"], manifest["npairs"])
+
+def load_annotation(path, cache_dir):
+    """read_annotation() through the cache; returns (parsed, fingerprint)."""
+    return _cached(cache_dir, "annotation", path, {},
+                   lambda: read_annotation(path), _save_annotation, _load_annotation)
+
+def load_hits(path, cache_dir, duplicates="first"):
+    """read_hits() through the cache; returns (HitTable, fingerprint)."""
+    return _cached(cache_dir, "hits", path, {"duplicates": duplicates},
+                   lambda: read_hits(path, duplicates=duplicates), _save_hits, _load_hits)
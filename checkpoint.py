@@ -0,0 +1,87 @@
+"""
+Checkpoints of a long scoring run, to resume it after it was killed.
+
+The pairs are scored in blocks of whole rows (see condensed.row_blocks).
+A Checkpoint directory holds a manifest of what the run depends on, the
+hashes of its inputs, its weights, its pathway order and its block
+size, with the blocks completed so far, and optionally the data of
+each block. Every file is written under a temporary name and renamed
+into place, and a block is only listed in the manifest once its data
+is on disk, so a run killed at any point leaves a consistent
+checkpoint behind.
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+class CheckpointMismatch(ValueError):
+    """A checkpoint left by a run with other inputs, weights or layout."""
+
+def _replace(path, write):
+    ## write(f) to a temporary file, then rename it over path
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class Checkpoint:
+    """
+    The checkpoint in ``directory`` of a run described by ``manifest``,
+    a JSON-able dict. Opening the checkpoint of an earlier run raises
+    CheckpointMismatch unless that run's manifest was the same.
+    """
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        ## as read back from JSON, tuples as lists
+        self.manifest = json.loads(json.dumps(manifest))
+        manifest = self.manifest
+        self.completed = set()
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["manifest"] != manifest:
+                keys = sorted(k for k in set(saved["manifest"]) | set(manifest)
+                              if saved["manifest"].get(k) != manifest.get(k))
+                raise CheckpointMismatch("%s was left by a run with different %s; remove it to "
+                                         "start over" % (directory, ", ".join(keys)))
+            self.completed = set(tuple(rows) for rows in saved["completed"])
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._write_manifest()
+
+    def _write_manifest(self):
+        state = {"manifest": self.manifest, "completed": sorted(self.completed)}
+        _replace(os.path.join(self.directory, MANIFEST),
+                 lambda f: f.write(json.dumps(state, sort_keys=True).encode("utf-8")))
+
+    def block_path(self, rows):
+        return os.path.join(self.directory, "block-%d-%d.npy" % rows)
+
+    def done(self, rows):
+        return tuple(rows) in self.completed
+
+    def load(self, rows):
+        """The data saved with block rows."""
+        return np.load(self.block_path(rows))
+
+    def save(self, rows, data=None):
+        """
+        Record block rows as completed, after saving its data if given
+        (callers that keep the data elsewhere must have flushed it).
+        """
+        if data is not None:
+            _replace(self.block_path(rows), lambda f: np.save(f, data))
+        self.completed.add(tuple(rows))
+        self._write_manifest()
+
+    def clear(self):
+        """Remove the checkpoint once the run's results are saved."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,178 @@
+"""
+Condensed distance matrices.
+
+A condensed matrix holds the n(n-1)/2 pairwise values of n pathways in
+one flat array, ordered like itertools.combinations(range(n), 2): the
+value of pathways i < j sits at condensed_index(i, j, n).
+"""
+
+import os
+import csv
+import numpy as np
+
+def condensed_size(n):
+    """Number of pairs among n pathways."""
+    return n*(n-1)//2
+
+def condensed_index(i, j, n):
+    """Position of the pair i < j in a condensed matrix of n pathways."""
+    return n*i - i*(i+1)//2 + j - i - 1
+
+def pairs_from_indices(k, n):
+    """
+    The pairs (i, j), i < j, at an array of condensed indices k, in the
+    order of itertools.combinations(range(n), 2); returns arrays (i, j).
+    """
+    k = np.asarray(k, dtype=np.int64)
+    i = n - 2 - (np.floor(np.sqrt(4.0*n*(n-1) - 8*k - 7)).astype(np.int64) - 1) // 2
+    ## Guard against the float square root landing one row off
+    i -= condensed_index(i, i + 1, n) > k
+    i += condensed_index(i + 1, i + 2, n) <= k
+    j = k - condensed_index(i, i + 1, n) + i + 1
+    return i, j
+
+def row_start(i, n):
+    """Condensed index of the first pair of row i, (i, i+1); row_start(n, n) is the size."""
+    return n*i - i*(i+1)//2
+
+def row_blocks(n, block_pairs):
+    """
+    Split the rows of a condensed matrix of n pathways into (start,
+    stop) ranges holding about block_pairs pairs each, and never less
+    than a whole row.
+    """
+    blocks = []
+    start = 0
+    while start < n - 1:
+        stop = start + 1
+        while stop < n - 1 and row_start(stop + 1, n) - row_start(start, n) <= block_pairs:
+            stop += 1
+        blocks.append((start, stop))
+        start = stop
+    return blocks
+
+def lower_rows(condensed, n):
+    """
+    Yield the lower-triangle row of each pathway j: its values against
+    pathways 0..j-1, gathered from the condensed matrix (an array or a
+    memmap) one row at a time.
+    """
+    for j in range(n):
+        yield condensed[condensed_index(np.arange(j), j, n)]
+
+def _format_row(values):
+    ## repr of float64 and str of float32 are the shortest strings that
+    ## read back to the same value, as pandas writes them
+    if values.dtype == np.float64:
+        return [repr(v) for v in values.tolist()]
+    return [str(v) for v in values]
+
+def write_csv(condensed, names, outfile):
+    """
+    Write the labeled lower-triangular matrix as CSV, the layout the
+    tree step and downstream tools read, with zeros on and above the
+    diagonal. Rows are formatted and written one at a time, without the
+    square matrix in memory.
+    """
+    n = len(names)
+    with open(outfile, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow([""] + list(names))
+        for name, values in zip(names, lower_rows(condensed, n)):
+            zeros = ["0.0"] * (n - len(values))
+            writer.writerow([name] + _format_row(values) + zeros)
+
+def write_lower_csv(condensed, names, outfile):
+    """
+    Like write_csv, but row j only holds its j values below the
+    diagonal, for about half the text.
+    """
+    with open(outfile, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow([""] + list(names))
+        for name, values in zip(names, lower_rows(condensed, len(names))):
+            writer.writerow([name] + _format_row(values))
+
+def write_phylip(condensed, names, outfile):
+    """
+    Write the matrix in the lower-triangular PHYLIP distance format:
+    the pathway count, then each name followed by its values below the
+    diagonal. Names are written in full (relaxed PHYLIP) and must not
+    hold whitespace.
+    """
+    with open(outfile, "w") as f:
+        f.write("%d\n" % len(names))
+        for name, values in zip(names, lower_rows(condensed, len(names))):
+            f.write(" ".join([name] + _format_row(values)) + "\n")
+
+def read_csv(path):
+    """
+    Read a matrix written by write_csv or write_lower_csv back into
+    (names, condensed).
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader)[1:]
+        n = len(names)
+        condensed = np.empty(condensed_size(n))
+        for j, row in enumerate(reader):
+            condensed[condensed_index(np.arange(j), j, n)] = [float(v) for v in row[1:j+1]]
+    return names, condensed
+
+def save_components(path, names, components):
+    """Save (3, npairs) Jaccard, DDS and GK component matrices with their labels."""
+    Jaccard, DDS, GK = components
+    np.savez(path, names=np.array(names, dtype=str), jaccard=Jaccard, dds=DDS, gk=GK)
+
+def load_components(path):
+    """Return (names, components) as saved by save_components."""
+    with np.load(path) as f:
+        return [str(name) for name in f["names"]], np.array([f["jaccard"], f["dds"], f["gk"]])
+
+def labels_path(path):
+    """Label file of the binary matrix at path: distance.npy -> distance.labels.txt."""
+    return os.path.splitext(path)[0] + ".labels.txt"
+
+def write_labels(path, names):
+    with open(path, "w") as f:
+        f.write("".join(name + "\n" for name in names))
+
+def save_npy(path, condensed, names):
+    """Save the condensed matrix as float32 .npy, with its names in labels_path(path)."""
+    np.save(path, np.asarray(condensed, dtype=np.float32))
+    write_labels(labels_path(path), names)
+
+def save_npz(path, condensed, names):
+    """Save the condensed matrix as float32, with its names, in one compressed archive."""
+    np.savez_compressed(path, names=np.array(names, dtype=str),
+                        distances=np.asarray(condensed, dtype=np.float32))
+
+def load_matrix(path, mmap=True):
+    """
+    Return (names, condensed) of a matrix written by save_npy (memory
+    mapped unless mmap is False), save_npz, write_csv or write_phylip,
+    going by the file extension (.npy, .npz, .phy, anything else CSV).
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == ".npy":
+        with open(labels_path(path)) as f:
+            names = [line.rstrip("\n") for line in f]
+        return names, np.load(path, mmap_mode="r" if mmap else None)
+    if ext == ".npz":
+        with np.load(path) as f:
+            return [str(name) for name in f["names"]], f["distances"]
+    if ext == ".phy":
+        return read_phylip(path)
+    return read_csv(path)
+
+def read_phylip(path):
+    """Read a lower-triangular matrix written by write_phylip back into (names, condensed)."""
+    with open(path) as f:
+        n = int(f.readline())
+        names = []
+        condensed = np.empty(condensed_size(n))
+        for j in range(n):
+            fields = f.readline().split()
+            names.append(fields[0])
+            condensed[condensed_index(np.arange(j), j, n)] = [float(v) for v in fields[1:]]
+    return names, condensed
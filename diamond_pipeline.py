@@ -0,0 +1,158 @@
+"""
+Run the DIAMOND all-vs-all domain search and parse its output as it is
+produced.
+
+This does what diamond.pl does, without the intermediate table:
+blastp writes its tabular output to a pipe, and read_hits() parses it
+chunk by chunk while the search is still running. The database is
+rebuilt when its .dmnd file is missing or the FASTA's content has
+changed since it was built, as recorded by the SHA-1 that makedb()
+keeps next to it in db.sha1.
+
+cluster_distance only looks up hits between domains that share a spec
+label, so search_spec_hits() can instead split the domains into one
+FASTA file per spec and search each group against itself.
+"""
+
+import os
+import hashlib
+import contextlib
+import subprocess
+
+from hits import read_hits
+
+def file_sha1(path):
+    """Hex SHA-1 of the file's content."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def makedb(fasta, db, diamond="diamond"):
+    """
+    Build the DIAMOND database ``db`` from fasta unless db.dmnd exists
+    and was built from the same content; returns whether it was built.
+    """
+    digest = file_sha1(fasta)
+    stamp = db + ".sha1"
+    if os.path.exists(db + ".dmnd") and os.path.exists(stamp):
+        with open(stamp) as f:
+            if f.read().strip() == digest:
+                return False
+    subprocess.check_call([diamond, "makedb", "--in", fasta, "-d", db])
+    with open(stamp, "w") as f:
+        f.write(digest + "\n")
+    return True
+
+def available_cores():
+    """
+    Cores this process may run on: its CPU affinity where the OS has
+    one, which batch schedulers restrict, else the machine's count.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def blastp_command(query, db, diamond="diamond", threads=None, evalue=1, max_target_seqs=1000000):
+    """diamond blastp arguments writing the tabular hits to stdout."""
+    return [diamond, "blastp", "-q", query, "-d", db, "-e", str(evalue), "-f", "tab",
+            "-p", str(threads or available_cores()), "-k", str(max_target_seqs)]
+
+def _blastp_outputs(searches, diamond="diamond", threads=None, **kwargs):
+    """
+    Run the self-search of each (fasta, db) in turn, yielding the
+    output pipe of one blastp while it runs. Raises
+    subprocess.CalledProcessError once a search exits with an error.
+    """
+    for fasta, db in searches:
+        makedb(fasta, db, diamond)
+        command = blastp_command(fasta, db, diamond, threads, **kwargs)
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+        try:
+            yield proc.stdout
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, command)
+
+def search_hits(fasta, db, diamond="diamond", threads=None, duplicates="first", **kwargs):
+    """
+    Search fasta against itself and return the hits as a HitTable, built
+    while DIAMOND runs. threads defaults to available_cores(); other
+    keyword arguments go to blastp_command(). Raises
+    subprocess.CalledProcessError if either DIAMOND stage fails.
+    """
+    with contextlib.closing(_blastp_outputs([(fasta, db)], diamond, threads, **kwargs)) as outputs:
+        return read_hits(outputs, duplicates=duplicates)
+
+def read_fasta(path):
+    """Yield (header, sequence) records; the header is the first word after '>'."""
+    header, lines = None, []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(lines)
+                words = line[1:].split()
+                header, lines = words[0] if words else "", []
+            elif line:
+                lines.append(line)
+    if header is not None:
+        yield header, "".join(lines)
+
+def spec_groups(pathways):
+    """
+    The 'pathway|domain' headers of every spec label, from the pathway
+    -> spec -> headers mapping of read_annotation().
+    """
+    groups = {}
+    for specs in pathways.values():
+        for spec, headers in specs.items():
+            groups.setdefault(spec, []).extend(headers)
+    return groups
+
+def write_spec_groups(fasta, pathways, workdir):
+    """
+    Write one FASTA file per spec holding two or more domains (a lone
+    domain has nothing to be compared with) and return their (fasta,
+    db) paths. Files are named after the hash of their records, so the
+    FASTA and database of an unchanged group are reused.
+    """
+    sequences = dict(read_fasta(fasta))
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    searches = []
+    for spec, headers in sorted(spec_groups(pathways).items()):
+        headers = sorted(set(h for h in headers if h in sequences))
+        if len(headers) < 2:
+            continue
+        key = hashlib.sha1("".join(">%s\n%s\n" % (h, sequences[h]) for h in headers)
+                           .encode("utf-8")).hexdigest()[:16]
+        db = os.path.join(workdir, "group-" + key)
+        group_fasta = db + ".faa"
+        if not os.path.exists(group_fasta):
+            tmp = group_fasta + ".tmp"
+            with open(tmp, "w") as f:
+                for header in headers:
+                    f.write(">%s\n%s\n" % (header, sequences[header]))
+            os.replace(tmp, group_fasta)
+        searches.append((group_fasta, db))
+    return searches
+
+def search_spec_hits(fasta, pathways, workdir, diamond="diamond", threads=None,
+                     duplicates="first", **kwargs):
+    """
+    Like search_hits(), but with a separate search inside each spec
+    group (see write_spec_groups), keeping only same-spec hits. All
+    groups feed one HitTable.
+    """
+    searches = write_spec_groups(fasta, pathways, workdir)
+    print("Searching %d spec groups" % len(searches))
+    with contextlib.closing(_blastp_outputs(searches, diamond, threads, **kwargs)) as outputs:
+        return read_hits(outputs, duplicates=duplicates)
@@ -1,14 +1,30 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import json
 import math
-import itertools
-import pandas as pd
+import time
+import random
+import hashlib
+import collections
+import argparse
+import multiprocessing
 import numpy as np
-import Bio.Phylo
-from Bio.Phylo.TreeConstruction import _Matrix, _DistanceMatrix
-from Bio.Phylo.TreeConstruction import _Matrix, _DistanceMatrix
-from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
+from condensed import condensed_index, condensed_size, pairs_from_indices
+from condensed import row_blocks, row_start, write_csv, write_lower_csv, write_phylip
+from condensed import save_npy, save_npz, write_labels
+from condensed import load_components, save_components
+from hits import DUPLICATE_POLICIES, read_hits
+from annotation import read_annotation
+from cache import load_annotation, load_hits
+from diamond_pipeline import search_hits, search_spec_hits
+from trees import TREE_METHODS, build_tree, robinson_foulds, upgma
+from shards import find_shards, merge_shards, parse_shard, save_shard, shard_bounds, shard_path
+from minhash import estimate_jaccard, lsh_candidates, lsh_threshold, signatures
+from checkpoint import Checkpoint, CheckpointMismatch
+from profiling import Profile, stage
+from model import compile_model, popcount
 
 class Munkres:
     """
@@ -17,17 +33,29 @@ class Munkres:
     """
     Calculate the Munkres solution to the classical assignment problem.
     See the module documentation for usage.
+
+    The steps work on NumPy arrays holding a stack of equally sized
+    (padded) cost matrices, so ``compute_batch()`` walks many small
+    matrices through the algorithm together. A lone small matrix, or a
+    few of one size, go through the same steps on Python lists instead,
+    where the per-step cost of the array operations would dominate.
+    Either way each matrix takes exactly the steps, and makes exactly
+    the choices, of the original list-of-lists implementation, so
+    pairings and costs are unchanged.
     """
+    ## Matrices up to scalar_size wide are solved on Python lists when
+    ## fewer than scalar_batch of them share a size
+    scalar_size = 16
+    scalar_batch = 48
     def __init__(self):
         """Create a new instance"""
         self.C = None
-        self.row_covered = []
-        self.col_covered = []
+        self.row_covered = None
+        self.col_covered = None
         self.n = 0
-        self.Z0_r = 0
-        self.Z0_c = 0
+        self.Z0_r = None
+        self.Z0_c = None
         self.marked = None
-        self.path = None
     def make_cost_matrix(profit_matrix, inversion_function):
         """
         **DEPRECATED**
@@ -72,11 +100,10 @@ class Munkres:
         columns in the database. Returns a list of (row, column) tuples
         that can be used to traverse the matrix.
         :Parameters:
-            cost_matrix : list of lists
+            cost_matrix : list of lists or 2-D array
                 The cost matrix. If this cost matrix is not square, it
-                will be padded with zeros, via a call to ``pad_matrix()``.
-                (This method does *not* modify the caller's matrix. It
-                operates on a copy of the matrix.)
+                will be padded with zeros. (This method does *not* modify
+                the caller's matrix. It operates on a copy of the matrix.)
 
                 **WARNING**: This code handles square and rectangular
                 matrices. It does *not* handle irregular matrices.
@@ -85,59 +112,160 @@ class Munkres:
         :return: A list of ``(row, column)`` tuples that describe the lowest
                  cost path through the matrix
         """
-        self.C = self.pad_matrix(cost_matrix)
-        self.n = len(self.C)
-        self.original_length = len(cost_matrix)
-        self.original_width = len(cost_matrix[0])
-        self.row_covered = [False for i in range(self.n)]
-        self.col_covered = [False for i in range(self.n)]
-        self.Z0_r = 0
-        self.Z0_c = 0
-        self.path = self.__make_matrix(self.n * 2, 0)
-        self.marked = self.__make_matrix(self.n, 0)
-        done = False
-        step = 1
-        steps = { 1 : self.__step1,
-                  2 : self.__step2,
-                  3 : self.__step3,
+        matrix = np.asarray(cost_matrix, dtype=float)
+        if max(matrix.shape) <= self.scalar_size:
+            return self.__solve_scalar(matrix)
+        return self.compute_batch([matrix])[0]
+    def compute_batch(self, cost_matrices):
+        """
+        Solve several assignment problems in one call.
+        :Parameters:
+            cost_matrices : sequence of cost matrices
+                Each matrix may have its own (rectangular) shape; matrices
+                that pad to the same square size are solved together.
+
+        :rtype: list
+        :return: One ``compute()`` result per matrix, in input order
+        """
+        results = [None] * len(cost_matrices)
+        groups = {}
+        for k, matrix in enumerate(cost_matrices):
+            matrix = np.asarray(matrix, dtype=float)
+            groups.setdefault(max(matrix.shape), []).append((k, matrix))
+        for n, members in groups.items():
+            if n <= self.scalar_size and len(members) < self.scalar_batch:
+                ## Too few for the array steps to pay off
+                for k, matrix in members:
+                    results[k] = self.__solve_scalar(matrix)
+                continue
+            C = np.zeros((len(members), n, n))
+            for b, (k, matrix) in enumerate(members):
+                C[b, :matrix.shape[0], :matrix.shape[1]] = matrix
+            self.__solve(C)
+            for b, (k, matrix) in enumerate(members):
+                starred = self.marked[b, :matrix.shape[0], :matrix.shape[1]] == 1
+                rows, cols = np.nonzero(starred)
+                results[k] = list(zip(rows.tolist(), cols.tolist()))
+        return results
+    def __solve_scalar(self, matrix):
+        """
+        Solve one matrix with the steps of __solve() on Python lists,
+        making the same choices; per step this costs far less than the
+        array operations for small matrices.
+        """
+        rows, cols = matrix.shape
+        n = max(rows, cols)
+        C = [[0.0] * n for i in range(n)]
+        for i, row in enumerate(matrix.tolist()):
+            C[i][:cols] = row
+        marked = [[0] * n for i in range(n)]
+        row_covered = [False] * n
+        col_covered = [False] * n
+        # Step 1
+        for row in C:
+            minval = min(row)
+            for j in range(n):
+                row[j] -= minval
+        # Step 2
+        for i in range(n):
+            for j in range(n):
+                if C[i][j] == 0 and not col_covered[j] and not row_covered[i]:
+                    marked[i][j] = 1
+                    col_covered[j] = True
+                    row_covered[i] = True
+        row_covered = [False] * n
+        col_covered = [False] * n
+        while True:
+            # Step 3
+            count = 0
+            for i in range(n):
+                for j in range(n):
+                    if marked[i][j] == 1:
+                        col_covered[j] = True
+                        count += 1
+            if count >= n:
+                break
+            while True:
+                # Step 4: the last uncovered zero of the first row holding any
+                row = col = -1
+                for i in range(n):
+                    if row_covered[i]:
+                        continue
+                    Ci = C[i]
+                    for j in range(n):
+                        if Ci[j] == 0 and not col_covered[j]:
+                            row, col = i, j
+                    if row >= 0:
+                        break
+                if row < 0:
+                    # Step 6
+                    minval = min(C[i][j] for i in range(n) if not row_covered[i]
+                                 for j in range(n) if not col_covered[j])
+                    for i in range(n):
+                        Ci = C[i]
+                        for j in range(n):
+                            if row_covered[i]:
+                                Ci[j] += minval
+                            if not col_covered[j]:
+                                Ci[j] -= minval
+                    continue
+                marked[row][col] = 2
+                if 1 in marked[row]:
+                    row_covered[row] = True
+                    col_covered[marked[row].index(1)] = False
+                    continue
+                break
+            # Step 5
+            path = [(row, col)]
+            while True:
+                star = [i for i in range(n) if marked[i][col] == 1]
+                if not star:
+                    break
+                row = star[0]
+                path.append((row, col))
+                col = marked[row].index(2)
+                path.append((row, col))
+            for i, j in path:
+                marked[i][j] = 0 if marked[i][j] == 1 else 1
+            for i in range(n):
+                for j in range(n):
+                    if marked[i][j] == 2:
+                        marked[i][j] = 0
+            row_covered = [False] * n
+            col_covered = [False] * n
+        return [(i, j) for i in range(rows) for j in range(cols) if marked[i][j] == 1]
+    def __solve(self, C):
+        """
+        Run the algorithm on a (batch, n, n) stack of square matrices,
+        leaving the starred zeros in ``self.marked``. Every matrix carries
+        its own step number; each pass advances all matrices sitting in a
+        given step at once.
+        """
+        batch, n = C.shape[0], C.shape[1]
+        self.C = C
+        self.n = n
+        self.marked = np.zeros((batch, n, n), dtype=np.int8)
+        self.row_covered = np.zeros((batch, n), dtype=bool)
+        self.col_covered = np.zeros((batch, n), dtype=bool)
+        self.Z0_r = np.zeros(batch, dtype=np.intp)
+        self.Z0_c = np.zeros(batch, dtype=np.intp)
+        self.__step1()
+        step = np.full(batch, self.__step2(), dtype=np.intp)
+        steps = { 3 : self.__step3,
                   4 : self.__step4,
                   5 : self.__step5,
                   6 : self.__step6 }
-        while not done:
-            try:
-                func = steps[step]
-                step = func()
-            except KeyError:
-                done = True
-        # Look for the starred columns
-        results = []
-        for i in range(self.original_length):
-            for j in range(self.original_width):
-                if self.marked[i][j] == 1:
-                    results += [(i, j)]
-        return results
-    def __copy_matrix(self, matrix):
-        """Return an exact copy of the supplied matrix"""
-        return copy.deepcopy(matrix)
-    def __make_matrix(self, n, val):
-        """Create an *n*x*n* matrix, populating it with the specific value."""
-        matrix = []
-        for i in range(n):
-            matrix += [[val for j in range(n)]]
-        return matrix
+        while (step != 7).any():
+            for s, func in steps.items():
+                idx = np.nonzero(step == s)[0]
+                if len(idx):
+                    step[idx] = func(idx)
     def __step1(self):
         """
         For each row of the matrix, find the smallest element and
         subtract it from every element in its row. Go to Step 2.
         """
-        C = self.C
-        n = self.n
-        for i in range(n):
-            minval = min(self.C[i])
-            # Find the minimum value for this row and subtract that minimum
-            # from every element in the row.
-            for j in range(n):
-                self.C[i][j] -= minval
+        self.C -= self.C.min(axis=2, keepdims=True)
         return 2
     def __step2(self):
         """
@@ -145,68 +273,51 @@ class Munkres:
         zero in its row or column, star Z. Repeat for each element in the
         matrix. Go to Step 3.
         """
-        n = self.n
-        for i in range(n):
-            for j in range(n):
-                if (self.C[i][j] == 0) and \
-                   (not self.col_covered[j]) and \
-                   (not self.row_covered[i]):
-                    self.marked[i][j] = 1
-                    self.col_covered[j] = True
-                    self.row_covered[i] = True
-
-        self.__clear_covers()
+        for i in range(self.n):
+            # Only the first free zero of a row can be starred, as starring
+            # it covers the row.
+            free = (self.C[:, i, :] == 0) & ~self.col_covered
+            b = np.nonzero(free.any(axis=1))[0]
+            j = free[b].argmax(axis=1)
+            self.marked[b, i, j] = 1
+            self.col_covered[b, j] = True
+        self.__clear_covers(slice(None))
         return 3
-    def __step3(self):
+    def __step3(self, idx):
         """
         Cover each column containing a starred zero. If K columns are
         covered, the starred zeros describe a complete set of unique
         assignments. In this case, Go to DONE, otherwise, Go to Step 4.
         """
-        n = self.n
-        count = 0
-        for i in range(n):
-            for j in range(n):
-                if self.marked[i][j] == 1:
-                    self.col_covered[j] = True
-                    count += 1
-        if count >= n:
-            step = 7 # done
-        else:
-            step = 4
-        return step
-    def __step4(self):
+        starred = self.marked[idx] == 1
+        self.col_covered[idx] |= starred.any(axis=1)
+        count = starred.sum(axis=(1, 2))
+        return np.where(count >= self.n, 7, 4)
+    def __step4(self, idx):
         """
         Find a noncovered zero and prime it. If there is no starred zero
         in the row containing this primed zero, Go to Step 5. Otherwise,
         cover this row and uncover the column containing the starred
         zero. Continue in this manner until there are no uncovered zeros
         left. Save the smallest uncovered value and Go to Step 6.
+
+        Each call performs one round of the "continue in this manner"
+        loop and returns 4 for matrices that need another round.
         """
-        step = 0
-        done = False
-        row = -1
-        col = -1
-        star_col = -1
-        while not done:
-            (row, col) = self.__find_a_zero()
-            if row < 0:
-                done = True
-                step = 6
-            else:
-                self.marked[row][col] = 2
-                star_col = self.__find_star_in_row(row)
-                if star_col >= 0:
-                    col = star_col
-                    self.row_covered[row] = True
-                    self.col_covered[col] = False
-                else:
-                    done = True
-                    self.Z0_r = row
-                    self.Z0_c = col
-                    step = 5
+        step = np.full(len(idx), 6, dtype=np.intp)
+        (found, row, col) = self.__find_a_zero(idx)
+        b = idx[found]
+        self.marked[b, row, col] = 2
+        stars = self.marked[b, row, :] == 1
+        has_star = stars.any(axis=1)
+        star_col = stars.argmax(axis=1)[has_star]
+        self.row_covered[b[has_star], row[has_star]] = True
+        self.col_covered[b[has_star], star_col] = False
+        self.Z0_r[b[~has_star]] = row[~has_star]
+        self.Z0_c[b[~has_star]] = col[~has_star]
+        step[found] = np.where(has_star, 4, 5)
         return step
-    def __step5(self):
+    def __step5(self, idx):
         """
         Construct a series of alternating primed and starred zeros as
         follows. Let Z0 represent the uncovered primed zero found in Step 4.
@@ -217,126 +328,66 @@ class Munkres:
         of the series, star each primed zero of the series, erase all
         primes and uncover every line in the matrix. Return to Step 3
         """
-        count = 0
-        path = self.path
-        path[count][0] = self.Z0_r
-        path[count][1] = self.Z0_c
-        done = False
-        while not done:
-            row = self.__find_star_in_col(path[count][1])
-            if row >= 0:
-                count += 1
-                path[count][0] = row
-                path[count][1] = path[count-1][1]
-            else:
-                done = True
-            if not done:
-                col = self.__find_prime_in_row(path[count][0])
-                count += 1
-                path[count][0] = path[count-1][0]
-                path[count][1] = col
-        self.__convert_path(path, count)
-        self.__clear_covers()
-        self.__erase_primes()
+        # Zeros on the series are tagged as they are found (3: star to be
+        # removed, 4: prime to be starred) and converted once it ends.
+        # A column holds at most one star and a row at most one prime, so
+        # the tags never change which zero a later search finds.
+        self.marked[idx, self.Z0_r[idx], self.Z0_c[idx]] = 4
+        b = idx
+        col = self.Z0_c[idx]
+        while len(b):
+            stars = self.marked[b, :, col] == 1
+            has_star = stars.any(axis=1)
+            b = b[has_star]
+            col = col[has_star]
+            row = stars.argmax(axis=1)[has_star]
+            self.marked[b, row, col] = 3
+            col = (self.marked[b, row, :] == 2).argmax(axis=1)
+            self.marked[b, row, col] = 4
+        marked = self.marked[idx]
+        self.marked[idx] = (marked == 1) | (marked == 4)
+        self.__clear_covers(idx)
         return 3
-    def __step6(self):
+    def __step6(self, idx):
         """
         Add the value found in Step 4 to every element of each covered
         row, and subtract it from every element of each uncovered column.
         Return to Step 4 without altering any stars, primes, or covered
         lines.
         """
-        minval = self.__find_smallest()
-        for i in range(self.n):
-            for j in range(self.n):
-                if self.row_covered[i]:
-                    self.C[i][j] += minval
-                if not self.col_covered[j]:
-                    self.C[i][j] -= minval
+        minval = self.__find_smallest(idx)[:, None]
+        row_covered = self.row_covered[idx]
+        col_covered = self.col_covered[idx]
+        C = self.C[idx]
+        C += np.where(row_covered, minval, 0)[:, :, None]
+        C -= np.where(col_covered, 0, minval)[:, None, :]
+        self.C[idx] = C
         return 4
-    def __find_smallest(self):
-        """Find the smallest uncovered value in the matrix."""
-        minval = sys.maxint
-        for i in range(self.n):
-            for j in range(self.n):
-                if (not self.row_covered[i]) and (not self.col_covered[j]):
-                    if minval > self.C[i][j]:
-                        minval = self.C[i][j]
-        return minval
-    def __find_a_zero(self):
-        """Find the first uncovered element with value 0"""
-        row = -1
-        col = -1
-        i = 0
-        n = self.n
-        done = False
-        while not done:
-            j = 0
-            while True:
-                if (self.C[i][j] == 0) and \
-                   (not self.row_covered[i]) and \
-                   (not self.col_covered[j]):
-                    row = i
-                    col = j
-                    done = True
-                j += 1
-                if j >= n:
-                    break
-            i += 1
-            if i >= n:
-                done = True
-        return (row, col)
-    def __find_star_in_row(self, row):
-        """
-        Find the first starred element in the specified row. Returns
-        the column index, or -1 if no starred element was found.
-        """
-        col = -1
-        for j in range(self.n):
-            if self.marked[row][j] == 1:
-                col = j
-                break
-
-        return col
-    def __find_star_in_col(self, col):
-        """
-        Find the first starred element in the specified row. Returns
-        the row index, or -1 if no starred element was found.
-        """
-        row = -1
-        for i in range(self.n):
-            if self.marked[i][col] == 1:
-                row = i
-                break
-        return row
-    def __find_prime_in_row(self, row):
+    def __uncovered(self, idx):
+        """Mask of the cells lying in neither a covered row nor column."""
+        return ~self.row_covered[idx][:, :, None] & \
+               ~self.col_covered[idx][:, None, :]
+    def __find_smallest(self, idx):
+        """Find the smallest uncovered value in each matrix."""
+        return np.where(self.__uncovered(idx), self.C[idx], np.inf).min(axis=(1, 2))
+    def __find_a_zero(self, idx):
         """
-        Find the first prime element in the specified row. Returns
-        the column index, or -1 if no starred element was found.
+        Find an uncovered element with value 0: the last one in the first
+        row holding any, which is where the original row-by-row scan
+        settles. Returns a mask of the matrices with such a zero and the
+        row and column of each of those zeros.
         """
-        col = -1
-        for j in range(self.n):
-            if self.marked[row][j] == 2:
-                col = j
-                break
-        return col
-    def __convert_path(self, path, count):
-        for i in range(count+1):
-            if self.marked[path[i][0]][path[i][1]] == 1:
-                self.marked[path[i][0]][path[i][1]] = 0
-            else:
-                self.marked[path[i][0]][path[i][1]] = 1
-    def __clear_covers(self):
+        zeros = (self.C[idx] == 0) & self.__uncovered(idx)
+        in_row = zeros.any(axis=2)
+        found = in_row.any(axis=1)
+        row = in_row.argmax(axis=1)[found]
+        last = zeros[found, row, ::-1].argmax(axis=1)
+        col = self.n - 1 - last
+        return (found, row, col)
+    def __clear_covers(self, idx):
         """Clear all covered matrix cells"""
-        for i in range(self.n):
-            self.row_covered[i] = False
-            self.col_covered[i] = False
-    def __erase_primes(self):
-        """Erase all prime markings"""
-        for i in range(self.n):
-            for j in range(self.n):
-                if self.marked[i][j] == 2:
-                    self.marked[i][j] = 0
+        self.row_covered[idx] = False
+        self.col_covered[idx] = False
 
 def make_cost_matrix(profit_matrix, inversion_function):
     """
@@ -350,7 +401,7 @@ def make_cost_matrix(profit_matrix, inversion_function):
         cost_matrix = Munkres.make_cost_matrix(matrix, inversion_func)
     For example:
     .. python::
-        cost_matrix = Munkres.make_cost_matrix(matrix, lambda x : sys.maxint - x)
+        cost_matrix = Munkres.make_cost_matrix(matrix, lambda x : sys.maxsize - x)
     :Parameters:
         profit_matrix : list of lists
             The matrix to convert from a profit to a cost matrix
@@ -393,119 +444,652 @@ def print_matrix(matrix, msg=None):
         sys.stdout.write(']\n')
 
 
+def neighbourhood_pairs(seq, nbhood):
+    """
+    Encoded (seq[i], seq[j]) pairs for j in the nbhood-1 positions after
+    i, and the same pairs swapped.
+    """
+    pairs = [(seq[i], seq[j]) for i in range(len(seq)-nbhood) for j in range(i+1,i+nbhood)]
+    return (frozenset((a << 32) | b for a, b in pairs),
+            frozenset((b << 32) | a for a, b in pairs))
+
+def gk_index(Ns, Nr):
+    """Goodman-Kruskal index, scaled to [0.5, 1], from Ns concordant and Nr reversed pairs."""
+    if (Nr + Ns) == 0:
+        gamma = 0
+    else:
+        gamma = abs(Nr-Ns) / float(Nr+Ns)
+    return (1+gamma)/2.
+
+def gamma_GK(pairsA, swappedA, pairsB, swappedB):
+    """
+    Goodman-Kruskal index from encoded neighbourhood pairs. A pair found
+    in both sets is concordant (Ns); one found in a single set with its
+    swap in the other is reversed (Nr).
+    """
+    Ns = len(pairsA & pairsB)
+    Nr = len((pairsA & swappedB) - pairsB) + len((pairsB & swappedA) - pairsA)
+    return gk_index(Ns, Nr)
+
 def calculate_GK(A, B, nbhood): #nbhood = 5, can be changed
     # calculate the Goodman-Kruskal gamma index
     GK = 0.
     if len(set(A) & set(B)) > 1:
-        pairsA = set( [(A[i],A[j]) for i in xrange(len(A)-nbhood) for j in xrange(i+1,i+nbhood)] )
-        pairsB = set( [(B[i],B[j]) for i in xrange(len(B)-nbhood) for j in xrange(i+1,i+nbhood)] )
-        allPairs = set(list(pairsA) + list(pairsB))
-        Ns, Nr = 0.,0.
-        for p in allPairs:
-            if p in pairsA and p in pairsB: Ns += 1
-            elif p in pairsA and tuple(p[::-1]) in pairsB: Nr += 1
-            elif tuple(p[::-1]) in pairsA and p in pairsB: Nr += 1
-            else: pass
-        if (Nr + Ns) == 0:
-            gamma = 0
-        else:
-            gamma = abs(Nr-Ns) / (Nr+Ns)
-        GK = (1+gamma)/2.
+        spec_ids = {}
+        pairsA, swappedA = neighbourhood_pairs([spec_ids.setdefault(a, len(spec_ids)) for a in A], nbhood)
+        pairsB, swappedB = neighbourhood_pairs([spec_ids.setdefault(b, len(spec_ids)) for b in B], nbhood)
+        GK = gamma_GK(pairsA, swappedA, pairsB, swappedB)
     return GK
 
-def cluster_distance(A, B, nbhood, pathways, dist, annotation):
-    clusterA = pathways[A]
-    clusterB = pathways[B]
-    try:
-        Jaccard = len(set(clusterA.keys()) & set(clusterB.keys())) / float( len(set(clusterA.keys())) + len(set(clusterB.keys())) - len(set(clusterA.keys()) & set(clusterB.keys())))
-    except ZeroDivisionError:
-        print("Zerodivisionerror during the Jaccard distance calculation. Can only happen when one or more clusters contains no domains.")
-        print("keys of clusterA", A, clusterA.keys())
-        print("keys of clusterB", B, clusterB.keys())
-    intersect = set(clusterA.keys() ).intersection(clusterB.keys()) #shared domains
-    not_intersect = []
-    DDS,S = 0,0
-    SumDistance = 0
-    pair = ""
-    for domain in set(clusterA.keys() + clusterB.keys()):
-        if domain not in intersect:
-            not_intersect.append(domain)
-    for unshared_domain in not_intersect: 
-        dom_set = []
+def masks_GK(A, B):
+    """
+    The GK term of cluster_distance for two compiled pathways (see
+    model.py): the best of B against A read forward and A read in
+    reverse, with the Ns/Nr counts taken as popcounts of bitmasks.
+    """
+    if popcount(A.gk_mask & B.gk_mask) <= 1:
+        return 0.
+    gammas = []
+    for pairsA, swappedA in ((A.forward, A.forward_swapped), (A.reverse, A.reverse_swapped)):
+        Ns = popcount(pairsA & B.forward)
+        Nr = popcount(pairsA & B.forward_swapped & ~B.forward) + popcount(B.forward & swappedA & ~pairsA)
+        gammas.append(gk_index(Ns, Nr))
+    return max(gammas)
+
+def cluster_components(A, B, nbhood, pathways, dist, annotation, model=None, counters=None):
+    """
+    The Jaccard, DDS and GK similarity terms of pathway A against B,
+    before weighting. Pass the compiled model of the run as ``model``
+    when scoring many pairs; otherwise one is built for A and B. With a
+    Counter as ``counters``, also count pairs, missing hits, GK calls
+    and Munkres matrix sizes, and time the Munkres and GK steps (see
+    profiling.py).
+    """
+    if model is None:
+        model = compile_model(pathways, annotation, dist, nbhood, names=[A, B])
+    return pair_components(model[A], model[B], model, counters)
+
+def domain_distances(model, query, subject):
+    """
+    Distances between the domains of two arrays of domain ids, the same
+    whichever side a domain is on: the hit with the lexicographically
+    smaller header as query, else the reverse hit, else 1 (no
+    similarity found). Returns (distances, number of missing hits).
+    """
+    low, high = np.minimum(query, subject), np.maximum(query, subject)
+    hit_ids = model.hit_ids
+    distances = model.dist.lookup(hit_ids[low], hit_ids[high])
+    missing = np.isnan(distances)
+    if missing.any():
+        distances[missing] = model.dist.lookup(hit_ids[high[missing]], hit_ids[low[missing]])
+        missing = np.isnan(distances)
+        distances[missing] = 1.
+    return distances, int(np.count_nonzero(missing))
+
+def dds_sums(model, a, b, counters=None):
+    """
+    The summed domain distance DDS and its normaliser S of each pair of
+    pathways (a[k], b[k]), indices into model.pathways, before the
+    exp(-DDS/S/S) transform.
+
+    Every domain of a spec only one pathway holds adds 1 to both. For a
+    spec both hold, with la domains in a and lb in b, the la x lb matrix
+    of domain_distances() is paired up by Munkres (for a single row or
+    column, its minimum), and the paired distances plus |la - lb| add to
+    DDS and max(la, lb) to S. The sums do not depend on the order of the
+    two pathways. The matrices of all the pairs' shared specs are
+    gathered from the hit store in one lookup.
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    ## Entries of the pathways of a, and their match among those of b
+    first = model.spec_start[a]
+    counts = model.spec_start[a + 1] - first
+    owner = np.repeat(np.arange(len(a)), counts)
+    entry_a = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    nspecs = len(model.spec_names)
+    keys = b[owner] * nspecs + model.entry_keys[entry_a] % nspecs
+    entry_b = np.searchsorted(model.entry_keys, keys)
+    entry_b[entry_b == len(model.entry_keys)] = 0
+    matched = model.entry_keys[entry_b] == keys if len(keys) else np.zeros(0, dtype=bool)
+    owner, entry_a, entry_b = owner[matched], entry_a[matched], entry_b[matched]
+    la, lb = model.entry_count[entry_a], model.entry_count[entry_b]
+    ## One block of la x lb domain pairs per shared spec
+    sizes = la * lb
+    offsets = np.cumsum(sizes) - sizes
+    block = np.repeat(np.arange(len(sizes)), sizes)
+    within = np.arange(sizes.sum()) - offsets[block]
+    row = within // lb[block]
+    col = within - row * lb[block]
+    distances, missing = domain_distances(
+        model, model.entry_domains[model.entry_start[entry_a][block] + row],
+        model.entry_domains[model.entry_start[entry_b][block] + col])
+    paired = np.minimum.reduceat(distances, offsets) if len(sizes) else np.zeros(0)
+    square = np.nonzero((la > 1) & (lb > 1))[0]
+    if len(square):
+        if counters is not None:
+            tic = time.perf_counter()
+        matrices = [distances[offsets[k]:offsets[k] + sizes[k]].reshape(la[k], lb[k]) for k in square]
+        for k, matrix, best in zip(square, matrices, Munkres().compute_batch(matrices)):
+            paired[k] = sum([matrix[r][c] for r, c in best])
+        if counters is not None:
+            counters["munkres seconds"] += time.perf_counter() - tic
+            for k in square:
+                counters["munkres size %dx%d" % (la[k], lb[k])] += 1
+    if counters is not None:
+        counters["missing hits"] += missing
+    unshared = (model.ndomains[a] + model.ndomains[b] -
+                np.bincount(owner, weights=la + lb, minlength=len(a)))
+    DDS = unshared + np.bincount(owner, weights=np.abs(la - lb) + paired, minlength=len(a))
+    S = unshared + np.bincount(owner, weights=np.maximum(la, lb), minlength=len(a))
+    return DDS, S
+
+def batch_components(model, a, b, counters=None):
+    """cluster_components of each pair of pathways (a[k], b[k]), indices into model.pathways."""
+    if counters is not None:
+        tic = time.perf_counter()
+    DDS_sums, S_sums = dds_sums(model, a, b, counters)
+    if counters is not None:
+        counters["dds seconds"] += time.perf_counter() - tic
+    compiled = model.pathways
+    scores = []
+    for k in range(len(a)):
+        A, B = compiled[a[k]], compiled[b[k]]
         try:
-            dom_set = clusterA[unshared_domain]
-        except KeyError:
-            dom_set = clusterB[unshared_domain]
-        DDS += len(dom_set)
-        S += len(dom_set)
-    for shared_domain in intersect:
-        seta = clusterA[shared_domain]
-        setb = clusterB[shared_domain]
-        if len(seta+setb) == 2: #The domain occurs only once in both clusters
-            pair = tuple(sorted([seta[0],setb[0]]))
-            for p in pair:
-                try:
-                    S += max(len(seta),len(setb))
-                    DDS += dist[p[0]][p[1]]
-                except KeyError:
-                    print("KeyError on "+" ".join([str(pair), str(p[0]), str(p[1])]))
-        else: #The domain occurs more than once in both clusters
-            DistanceMatrix = [[1 for col in range(len(setb))] for row in range(len(seta))]
-            for domsa in range(len(seta)):
-                for domsb in range(domsa, len(setb)):
-                    pair = tuple(sorted([seta[domsa], setb[domsb]]))
-                    for p in pair:
-                        try:
-                            DistanceMatrix[domsa][domsb] = dist[p[0]][p[1]]
-                        except KeyError:
-                            print("KeyError on "+str(pair))
-            #Only use the best scoring pairs
-            Hungarian = Munkres()
-            #print "DistanceMatrix", DistanceMatrix
-            BestIndexes = Hungarian.compute(DistanceMatrix)
-            # print "BestIndexes", BestIndexes
-            accumulated_distance = sum([DistanceMatrix[bi[0]][bi[1]] for bi in BestIndexes])
-            # print "accumulated_distance", accumulated_distance
-            SumDistance = (abs(len(seta)-len(setb)) + accumulated_distance)  #diff in abundance + sequence distance
-            # print 'SumDistance2', SumDistance
-            S += max(len(seta),len(setb))
-            DDS += SumDistance
-
-## HERE
-    #  calculate the Goodman-Kruskal gamma index
-    A_pseudo_seq = annotation[A]
-    B_pseudo_seq = annotation[B]
-    Ar = [item for item in A_pseudo_seq]
-    Ar.reverse()
-    GK = max([calculate_GK(A_pseudo_seq, B_pseudo_seq, nbhood = nbhood), calculate_GK(Ar, B_pseudo_seq, nbhood = nbhood)])
-    DDS /= float(S)
-    DDS /= float(S)
-    DDS = math.exp(-DDS) #transform from distance to similarity score
+            shared = popcount(A.mask & B.mask)
+            Jaccard = shared / float(popcount(A.mask) + popcount(B.mask) - shared)
+        except ZeroDivisionError:
+            print("Zerodivisionerror during the Jaccard distance calculation. Can only happen when one or more clusters contains no domains.")
+            print("keys of clusterA", A.name, [model.spec_names[s] for s in A.specs])
+            print("keys of clusterB", B.name, [model.spec_names[s] for s in B.specs])
+        #  calculate the Goodman-Kruskal gamma index
+        if counters is not None:
+            tic = time.perf_counter()
+        GK = masks_GK(A, B)
+        if counters is not None:
+            counters["gk seconds"] += time.perf_counter() - tic
+            counters["gk calls"] += 1
+            counters["pairs"] += 1
+        DDS, S = float(DDS_sums[k]), float(S_sums[k])
+        DDS /= S
+        DDS /= S
+        DDS = math.exp(-DDS) #transform from distance to similarity score
+        scores.append((Jaccard, DDS, GK))
+    return scores
+
+def pair_components(A, B, model, counters=None):
+    """cluster_components of two compiled pathways of model."""
+    return batch_components(model, [model.index[A.name]], [model.index[B.name]], counters)[0]
+
+def cluster_distance(A, B, nbhood, pathways, dist, annotation, model=None):
+    Jaccard, DDS, GK = cluster_components(A, B, nbhood, pathways, dist, annotation, model)
     Distance = 1 - (Jaccardw * Jaccard) - (DDSw * DDS) - (GKw * GK)
     Similarity_score = (Jaccardw * Jaccard) + (DDSw * DDS) + (GKw * GK)
     if Distance < 0:
-        print("\t".join(["negative distance", str(Distance), "DDS", str(DDS), str(pair)]))
+        print("\t".join(["negative distance", str(Distance), "DDS", str(DDS), str((A, B))]))
         print("Probably a rounding issue")
         print("Distance is set to 0 for these clusters")
         Distance = 0
     return Similarity_score
 
+def combine_components(components, Jaccardw, GKw, DDSw, scale):
+    """
+    Condensed distances from the (3, npairs) Jaccard, DDS and GK
+    component matrices, weighted exactly as cluster_distance does.
+    """
+    Jaccard, DDS, GK = components
+    Similarity_score = (Jaccardw * Jaccard) + (DDSw * DDS) + (GKw * GK)
+    negative = np.count_nonzero(1 - (Jaccardw * Jaccard) - (DDSw * DDS) - (GKw * GK) < 0)
+    if negative:
+        print("%d pairs with a negative distance; probably a rounding issue" % negative)
+    return 1 - Similarity_score/scale
+
+## Most pairs in one chunk by default: a chunk's scores are held whole
+## until it is written out, so this bounds the memory of the pair loop
+CHUNK_PAIRS = 1 << 15
+
+def pair_chunks(npairs, workers, chunk_size=None):
+    """
+    Split the pair index range into contiguous (start, stop) chunks of
+    equal size. By default every worker gets at least four chunks,
+    which keeps the pool busy when some chunks hold slower pairs than
+    others, and no chunk more than CHUNK_PAIRS pairs.
+    """
+    if chunk_size is None:
+        chunk_size = max(1, min(-(-npairs // (workers * 4)), CHUNK_PAIRS))
+    return [(start, min(start + chunk_size, npairs))
+            for start in range(0, npairs, chunk_size)]
+
+## Scoring inputs of a pool worker, set once per process by _init_worker
+_worker = {}
+
+def _init_worker(model, profiling=False):
+    _worker.update(model=model, counters=collections.Counter() if profiling else None)
+
+def _score_chunk(task):
+    """Scores of a (start, stop, pair_ids) task, and its counters when profiling."""
+    start, stop, pair_ids = task
+    if pair_ids is not None:
+        start, stop = 0, len(pair_ids)
+    scores = score_pairs(start, stop, _worker["model"], pair_ids, _worker["counters"])
+    counters = _worker["counters"]
+    if counters is None:
+        return scores, None
+    done = dict(counters)
+    counters.clear()
+    return scores, done
+
+def scoring_pool(model, workers, profiling=False):
+    """
+    A pool of workers holding the model, for score_chunks calls on the
+    same model, or None when scoring serially. The model goes to each
+    worker once, at start-up, not with every chunk.
+    """
+    if workers > 1:
+        return multiprocessing.Pool(workers, _init_worker, (model, profiling))
+    return None
+
+def score_pairs(start, stop, model, pair_ids=None, counters=None, batch=4096, report=None):
+    """
+    (3, k) Jaccard, DDS and GK components of pairs start..stop-1 of the
+    model's pathways, or of the pairs at pair_ids[start:stop] when only
+    some condensed pair indices are to be scored. The pairs go through
+    batch_components ``batch`` at a time; ``report``, if given, is
+    called with the number of pairs scored so far after each batch.
+    """
+    n = len(model.names)
+    if pair_ids is None:
+        pair_ids = np.arange(start, stop, dtype=np.int64)
+    else:
+        pair_ids = np.asarray(pair_ids[start:stop], dtype=np.int64)
+    i, j = pairs_from_indices(pair_ids, n)
+    scores = np.empty((3, len(pair_ids)))
+    for k in range(0, len(pair_ids), batch):
+        scores[:, k:k + batch] = np.array(batch_components(model, j[k:k + batch], i[k:k + batch],
+                                                           counters)).T
+        if report:
+            report(min(k + batch, len(pair_ids)))
+    return scores
+
+def score_chunks(model, pair_ids=None, workers=1, chunk_size=None, counters=None, pool=None,
+                 report=None):
+    """
+    Score every pair of the model's pathways, or only the condensed pair
+    indices in pair_ids, yielding ((start, stop), components) chunks in
+    order. Runs on ``pool`` (see scoring_pool) when given, otherwise on
+    a pool of its own when workers > 1. Worker counters are added to
+    ``counters`` as their chunks arrive. ``report`` is called with the
+    number of pairs scored so far, after every batch when scoring
+    serially and every chunk on a pool.
+    """
+    npairs = condensed_size(len(model.names)) if pair_ids is None else len(pair_ids)
+    chunks = pair_chunks(npairs, workers, chunk_size)
+    own_pool = pool is None and workers > 1
+    if own_pool:
+        pool = scoring_pool(model, workers, counters is not None)
+    if pool is not None:
+        tasks = [(start, stop, None if pair_ids is None else pair_ids[start:stop])
+                 for start, stop in chunks]
+        try:
+            for chunk, (scores, done) in zip(chunks, pool.imap(_score_chunk, tasks)):
+                if done:
+                    counters.update(done)
+                if report:
+                    report(chunk[1])
+                yield chunk, scores
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
+    else:
+        for start, stop in chunks:
+            chunk_report = None
+            if report:
+                chunk_report = lambda k, start=start: report(start + k)
+            yield (start, stop), score_pairs(start, stop, model, pair_ids, counters,
+                                             report=chunk_report)
+
+def spec_index(model):
+    """
+    Inverted index of the model: spec id -> sorted array of the
+    pathways holding it. Pathways without any spec are listed under
+    None.
+    """
+    index = {}
+    for p, pathway in enumerate(model.pathways):
+        for spec in pathway.specs or [None]:
+            index.setdefault(spec, []).append(p)
+    return dict((spec, np.array(members, dtype=np.int64)) for spec, members in index.items())
+
+def shared_spec_pairs(model, rows=None, index=None):
+    """
+    Boolean mask of the pathway pairs that share a spec, over the
+    condensed pairs (i, j) of rows start <= i < stop (default: all
+    pairs), found through the inverted spec_index. A pathway without any
+    spec is marked against every other one, so that its pairs keep
+    going through pair_components.
+    """
+    n = len(model.names)
+    start, stop = rows or (0, n)
+    if index is None:
+        index = spec_index(model)
+    empty = index.get(None, np.zeros(0, dtype=np.int64))
+    base = row_start(start, n)
+    shared = np.zeros(row_start(stop, n) - base, dtype=bool)
+    for i in range(start, min(stop, n - 1)):
+        ## pair (i, j) sits at row + j in the mask
+        row = row_start(i, n) - base - i - 1
+        specs = model.pathways[i].specs
+        if not specs:
+            shared[row + i + 1:row + n] = True
+            continue
+        for spec in specs:
+            members = index[spec]
+            shared[row + members[np.searchsorted(members, i, side="right"):]] = True
+        shared[row + empty[empty > i]] = True
+    return shared
+
+def unshared_components(model, pair_ids):
+    """
+    cluster_components of pairs sharing no spec, in bulk. Every spec is
+    unshared, so Jaccard and GK are 0 and DDS and S both add up to the
+    pair's domain count S, leaving DDS = exp(-(S/S)/S). The exponential
+    is taken with math.exp once per distinct S, for the same values as
+    the per-pair code.
+    """
+    ndomains = np.array([pathway.ndomains for pathway in model.pathways], dtype=np.int64)
+    i, j = pairs_from_indices(pair_ids, len(model.names))
+    S, inverse = np.unique(ndomains[i] + ndomains[j], return_inverse=True)
+    DDS = np.array([math.exp(-(float(s)/float(s)/float(s))) for s in S])
+    return np.array([np.zeros(len(inverse)), DDS[inverse], np.zeros(len(inverse))])
+
+def fill_components(components, model, pair_ids, shared, workers=1, chunk_size=None,
+                    profile=None, pool=None, offset=0, report=None):
+    """
+    Score the pairs at the condensed indices pair_ids into components,
+    whose column k holds pair offset + k. ``shared`` tells, for each of
+    pair_ids, whether the pair shares a spec (see shared_spec_pairs).
+    Pairs with no spec in common take the closed form of
+    unshared_components; only the others go through pair_components.
+    ``report`` is called with the number of pair_ids done so far as
+    batches finish (see score_chunks), the closed-form pairs first. By
+    default, with a profile, progress over the scored pairs is printed.
+    """
+    fast = pair_ids[~shared]
+    components[:, fast - offset] = unshared_components(model, fast)
+    todo = pair_ids[shared]
+    counters = profile.counters if profile else None
+    if counters is not None:
+        counters["closed-form pairs"] += len(fast)
+    if report is None and profile:
+        started = time.perf_counter()
+        report = lambda done: profile.progress(done - len(fast), len(todo), started)
+    if report:
+        report(len(fast))
+        scored = lambda done: report(len(fast) + done)
+    else:
+        scored = None
+    for (start, stop), scores in score_chunks(model, pair_ids=todo, workers=workers,
+                                              chunk_size=chunk_size, counters=counters, pool=pool,
+                                              report=scored):
+        components[:, todo[start:stop] - offset] = scores
+
+def generate_components(pathways, annotation, dist, nbhood, workers=1, chunk_size=None,
+                        profile=None):
+    """
+    Score all pathway pairs. Returns a (3, npairs) array holding the
+    condensed Jaccard, DDS and GK matrices over the pathways in
+    ``pathways`` key order. A profiling.Profile gets the pair loop's
+    counters and prints progress as chunks finish.
+    """
+    model = compile_model(pathways, annotation, dist, nbhood)
+    components = np.empty((3, condensed_size(len(model.names))))
+    fill_components(components, model, np.arange(components.shape[1]), shared_spec_pairs(model),
+                    workers, chunk_size, profile)
+    return components
+
+def approximate_components(model, bands, rows, seed=0, gk=False, workers=1, chunk_size=None,
+                           profile=None):
+    """
+    Components scored exactly only for the LSH candidate pairs of the
+    model's MinHash signatures (see minhash.py), which with gk also
+    sketch the GK pairs. Pairs sharing no spec keep their exact closed
+    form. The other pairs get the estimate of their Jaccard index from
+    a sketch of the specs alone, the least GK that estimate allows
+    and the DDS of a pair with no spec in common: below the LSH
+    threshold their terms are small, and the estimate keeps them apart
+    in the tree.
+    """
+    n = len(model.names)
+    sigs = signatures(model, bands * rows, seed)
+    ## GK tokens only help pick candidates: the Jaccard index is over
+    ## specs, and an estimate from a sketch with GK pairs in it is not
+    candidates = lsh_candidates(signatures(model, bands * rows, seed, gk) if gk else sigs, bands, rows)
+    shared = shared_spec_pairs(model)
+    components = np.empty((3, condensed_size(n)))
+    exact = np.nonzero(candidates | ~shared)[0]
+    fill_components(components, model, exact, shared[exact], workers, chunk_size, profile)
+    estimated = np.nonzero(shared & ~candidates)[0]
+    components[:, estimated] = unshared_components(model, estimated)
+    components[0, estimated] = estimate_jaccard(sigs, estimated)
+    ## GK is 0 with at most one spec shared and at least 0.5 otherwise;
+    ## take that floor when the estimate implies two or more shared specs
+    nspecs = np.array([len(pathway.specs) for pathway in model.pathways], dtype=np.int64)
+    i, j = pairs_from_indices(estimated, n)
+    Jaccard = components[0, estimated]
+    components[2, estimated] = np.where(Jaccard * (nspecs[i] + nspecs[j]) / (1 + Jaccard) >= 1.5, 0.5, 0.)
+    print("LSH (%d bands of %d rows, threshold %.2f): %d of %d pairs sharing a spec scored exactly"
+          % (bands, rows, lsh_threshold(bands, rows), np.count_nonzero(shared & candidates),
+             np.count_nonzero(shared)))
+    if profile:
+        profile.counters["estimated pairs"] += len(estimated)
+    return components
+
+def sample_agreement(pathways, annotation, dist, pnames, components, weights, size, seed=0):
+    """
+    Check an approximate run: score a random sample of size pathways
+    exactly and compare its UPGMA tree with the one from the same
+    pathways' rows of components. Returns the Robinson-Foulds distance
+    and its maximum.
+    """
+    n = len(pnames)
+    sample = sorted(random.Random(seed).sample(range(n), min(size, n)))
+    names = [pnames[k] for k in sample]
+    exact = generate_components(dict((name, pathways[name]) for name in names), annotation, dist, 3)
+    i, j = pairs_from_indices(np.arange(condensed_size(len(sample))), len(sample))
+    sample = np.array(sample, dtype=np.int64)
+    approximate = components[:, condensed_index(sample[i], sample[j], n)]
+    trees = [upgma(combine_components(c, *weights, scale=1), names) for c in (exact, approximate)]
+    return robinson_foulds(*trees)
+
+def resumed_blocks(blocks, checkpoint):
+    """The row blocks not yet completed in checkpoint, saying how many were."""
+    todo = [rows for rows in blocks if not checkpoint.done(rows)]
+    if len(todo) < len(blocks):
+        print("Resuming from %s: %d of %d blocks already scored"
+              % (checkpoint.directory, len(blocks) - len(todo), len(blocks)))
+    return todo
+
+def score_blocks(model, blocks, save, workers=1, chunk_size=None, profile=None):
+    """
+    Score the pairs of each row block (see condensed.row_blocks) in
+    turn, with one worker pool for all of them, and pass each to
+    save(rows, start, stop, components) with its (3, stop-start)
+    components as it completes. A profile prints progress over all the
+    model's pairs.
+    """
+    n = len(model.names)
+    npairs = condensed_size(n)
+    index = spec_index(model)
+    pool = scoring_pool(model, workers, profile is not None)
+    started = time.perf_counter()
+    try:
+        for rows in blocks:
+            start, stop = row_start(rows[0], n), row_start(rows[1], n)
+            components = np.empty((3, stop - start))
+            fill_components(components, model, np.arange(start, stop, dtype=np.int64),
+                            shared_spec_pairs(model, rows, index), workers, chunk_size,
+                            profile, pool, offset=start,
+                            report=profile and (lambda done, start=start:
+                                                profile.progress(start + done, npairs, started)))
+            save(rows, start, stop, components)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def checkpointed_components(model, checkpoint, workers=1, chunk_size=None, profile=None,
+                            block_pairs=1 << 22):
+    """
+    generate_components on a compiled model, one block of about
+    block_pairs pairs (whole rows) at a time, saving the components of
+    each block to checkpoint as it completes. Blocks the checkpoint
+    already holds are loaded instead of scored.
+    """
+    n = len(model.names)
+    components = np.empty((3, condensed_size(n)))
+    blocks = row_blocks(n, block_pairs)
+    for rows in blocks:
+        if checkpoint.done(rows):
+            components[:, row_start(rows[0], n):row_start(rows[1], n)] = checkpoint.load(rows)
+    def save(rows, start, stop, block):
+        components[:, start:stop] = block
+        checkpoint.save(rows, block)
+    score_blocks(model, resumed_blocks(blocks, checkpoint), save, workers, chunk_size, profile)
+    return components
+
+def checkpoint_manifest(state, names, weights, block_pairs, kind):
+    """
+    What a checkpoint of ``kind`` ("components" or "distances") depends
+    on: hashes of the run state (scoring parameters and pathway digests)
+    and of the pathway order, the weight settings and the block size.
+    """
+    return {"kind": kind,
+            "inputs": hashlib.sha1(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest(),
+            "pathways": hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest(),
+            "weights": [list(w) for w in weights],
+            "block_pairs": block_pairs}
+
+def write_distance_file(path, model, Jaccardw, GKw, DDSw, scale, workers=1, chunk_size=None,
+                        profile=None, block_pairs=1 << 22, checkpoint=None):
+    """
+    Score all pairs of the model straight into a condensed float32
+    matrix, saved as a .npy file at path, one block of about
+    block_pairs pairs (whole rows) at a time. Only one block's
+    components are ever held in memory. Returns the matrix as a
+    read-only memmap. With a checkpoint.Checkpoint, every block is
+    flushed to the file and recorded as it completes, and the blocks
+    recorded by an earlier run are kept from the file it left.
+    """
+    n = len(model.names)
+    npairs = condensed_size(n)
+    if checkpoint is not None and checkpoint.completed:
+        if not os.path.exists(path):
+            raise CheckpointMismatch("%s lists scored blocks of %s, which is missing; remove it "
+                                     "to start over" % (checkpoint.directory, path))
+        out = np.lib.format.open_memmap(path, mode="r+")
+        if out.shape != (npairs,) or out.dtype != np.float32:
+            raise CheckpointMismatch("%s does not hold the matrix of %s; remove it to start over"
+                                     % (path, checkpoint.directory))
+    else:
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(npairs,))
+    blocks = row_blocks(n, block_pairs)
+    if checkpoint is not None:
+        blocks = resumed_blocks(blocks, checkpoint)
+    def save(rows, start, stop, components):
+        out[start:stop] = combine_components(components, Jaccardw, GKw, DDSw, scale)
+        if checkpoint is not None:
+            out.flush()
+            checkpoint.save(rows)
+    score_blocks(model, blocks, save, workers, chunk_size, profile)
+    out.flush()
+    del out
+    return np.load(path, mmap_mode="r")
+
 def generate_distance_matrix(pathways, domain_names, annotation,
                              dist, Jaccardw, GKw, DDSw,
-                             scale, nbhood, outfile):
-    pnames = pathways.keys()
-    r = len(pnames)
-    c = len(pnames)
-    Dist = [[0 for x in range(r)] for y in range(c)]
-    df = pd.DataFrame(Dist, index=pnames, columns=pnames)
-    pairs = list(itertools.combinations(pnames, 2))
-    for p in pairs:
-        sim_score = cluster_distance(p[1], p[0], nbhood, pathways, dist, annotation)
-        rowname = p[1]
-        colname = p[0]
-        df.ix[rowname, colname] = 1- sim_score/scale
-    df.to_csv(outfile)
-    return df
+                             scale, nbhood, outfile,
+                             workers=1, chunk_size=None):
+    """
+    Score all pathway pairs and write the distance matrix to outfile.
+    Returns the distances as a condensed array over the pathways in
+    ``pathways`` key order.
+    """
+    components = generate_components(pathways, annotation, dist, nbhood,
+                                     workers=workers, chunk_size=chunk_size)
+    Dist = combine_components(components, Jaccardw, GKw, DDSw, scale)
+    write_csv(Dist, list(pathways.keys()), outfile)
+    return Dist
+
+def pathway_digests(pathways, annotation, dist, partners=None):
+    """
+    A digest per pathway of every input its scores depend on: its spec
+    labels, its spec -> domain lists and the hits that have one of its
+    domains as query and one of the ``partners`` pathways' domains as
+    subject (default: the pathways given). A changed hit between two
+    pathways therefore changes the digest of at least one of them,
+    while hits to domains outside the annotation, or to pathways added
+    since (with the earlier run's pathways as partners), change none.
+    Hits are folded in from per-header hashes, independently of order
+    and of the integer ids the hit parser handed out.
+    """
+    pnames = list(pathways.keys())
+    if partners is None:
+        partners = pathways
+    pindex = dict((name, k) for k, name in enumerate(pnames))
+    header_hash = np.array([_stable_hash(h) for h in dist.headers], dtype=np.uint64)
+    owner = np.array([pindex.get(h.rpartition('|')[0], -1) for h in dist.headers], dtype=np.int64)
+    query, subject, distance = dist.pairs()
+    mixed = header_hash[query] * np.uint64(0x9E3779B97F4A7C15)
+    mixed ^= header_hash[subject] * np.uint64(0xC2B2AE3D27D4EB4F)
+    mixed ^= np.ascontiguousarray(distance, dtype=np.float64).view(np.uint64)
+    mixed *= np.uint64(0x165667B19E3779F9)
+    ## owner -1 (a header of no pathway) picks the trailing False
+    partner = np.array([name in partners for name in pnames] + [False], dtype=bool)
+    owned = (owner[query] >= 0) & partner[owner[subject]]
+    hit_digest = np.zeros(len(pnames), dtype=np.uint64)
+    np.add.at(hit_digest, owner[query][owned], mixed[owned])
+    digests = {}
+    for k, name in enumerate(pnames):
+        h = hashlib.sha1(json.dumps([annotation.get(name), pathways[name]], sort_keys=True).encode("utf-8"))
+        h.update(hit_digest[k].tobytes())
+        digests[name] = h.hexdigest()
+    return digests
+
+def _stable_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def update_components(pathways, annotation, dist, nbhood, previous, changed,
+                      workers=1, chunk_size=None, profile=None):
+    """
+    Rebuild the component matrices from previous ones, scoring only the
+    pairs that involve a pathway in ``changed`` (new or modified). All
+    other values are copied from ``previous``, a (names, components)
+    tuple. Pairs whose two pathways swapped order since then are
+    rescored too, as the score is not symmetric in its arguments.
+    Returns components like generate_components.
+    """
+    old_names, old_components = previous
+    old_index = dict((name, k) for k, name in enumerate(old_names))
+    pnames = list(pathways.keys())
+    n, m = len(pnames), len(old_names)
+    pos = np.array([old_index.get(name, -1) for name in pnames], dtype=np.int64)
+    keep = (pos >= 0) & np.array([name not in changed for name in pnames], dtype=bool)
+    components = np.empty((3, condensed_size(n)))
+    todo = []
+    for i in range(n - 1):
+        base = condensed_index(i, i+1, n)
+        j = np.arange(i+1, n)
+        reuse = keep[i] & keep[j] & (pos[i] < pos[j])
+        components[:, base + j[reuse] - i - 1] = \
+            old_components[:, condensed_index(pos[i], pos[j[reuse]], m)]
+        todo.append(base + np.nonzero(~reuse)[0])
+    todo = np.concatenate(todo) if todo else np.zeros(0, dtype=np.int64)
+    print("Scoring %d of %d pairs" % (len(todo), components.shape[1]))
+    model = compile_model(pathways, annotation, dist, nbhood)
+    fill_components(components, model, todo, shared_spec_pairs(model)[todo],
+                    workers, chunk_size, profile)
+    return components
 
 
 """
@@ -521,6 +1105,10 @@ def generate_distance_matrix(pathways, domain_names, annotation,
 
 """
 
+## Bump when the scores of the same inputs change, so that saved
+## components are not reused with --incremental
+SCORING_VERSION = 2
+
 ## Set the weights
 Jaccardw = 0.5
 GKw = 0.25
@@ -529,61 +1117,417 @@ DDSw = 0.25
 ## Define inputs
 annotation_matrix = "./annotateKS_per_pred_transATPKS_mc_manualderep.txt"
 blasttable = "./full.dbp" ## Tab blast
+protein_domain_source = "./src.faa" ## Searched with --diamond instead of reading blasttable
+diamond_db = "full"
+diamond_groups_dir = "spec_groups" ## Per-spec FASTA files and databases of --by-spec
 
 ## Define outputs
 outfile = "distance.txt"
 tree_outfile = "upgmma.nwk"
+components_outfile = "components.npz" ## Jaccard, DDS and GK matrices, for re-weighting
+matrix_outfile = "distance.npy" ## Condensed float32 distances of --out-of-core and --format npy
+matrix_labels = "distance.labels.txt" ## Its pathway names, one per line
+phylip_outfile = "distance.phy"
+archive_outfile = "distance.npz" ## Compressed float32 distances and names
+checkpoint_dir = "checkpoint" ## Default directory of --checkpoint
+
+OUTPUT_FORMATS = ("csv", "lower-csv", "phylip", "npy", "npz")
+
+def write_distances(condensed, pnames, formats):
+    """Write the condensed distances in each of formats (see OUTPUT_FORMATS)."""
+    for fmt in formats:
+        if fmt == "csv":
+            write_csv(condensed, pnames, outfile)
+        elif fmt == "lower-csv":
+            write_lower_csv(condensed, pnames, outfile)
+        elif fmt == "phylip":
+            write_phylip(condensed, pnames, phylip_outfile)
+        elif fmt == "npy":
+            save_npy(matrix_outfile, condensed, pnames)
+        elif fmt == "npz":
+            save_npz(archive_outfile, condensed, pnames)
+
+def tree_path(method, tag=None):
+    """
+    Newick output of a tree method: tree_outfile for UPGMA, METHOD.nwk
+    otherwise, with the weights tag of a sweep before the extension.
+    """
+    path = tree_outfile if method == "upgma" else method + ".nwk"
+    if tag is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return "%s.%s%s" % (root, tag, ext)
+
+def write_trees(condensed, pnames, methods, tag=None, profile=None, scratch=None):
+    """
+    Build and write the tree of each of methods (see TREE_METHODS) and,
+    for more than one, print each tree's Robinson-Foulds distance to the
+    first.
+    """
+    trees = []
+    for method in methods:
+        with stage(profile, "tree %s" % method if len(methods) > 1 else "tree"):
+            tree = build_tree(condensed, pnames, method, scratch=scratch)
+            tree.write(tree_path(method, tag))
+        trees.append(tree)
+    for method, tree in zip(methods[1:], trees[1:]):
+        rf, most = robinson_foulds(trees[0], tree)
+        print("Robinson-Foulds distance %s/%s: %d of %d clusters" % (methods[0], method, rf, most))
 
-## Parse inputs
-pathways = {}
-domain_names = []
-annotation = {}
-with open(annotation_matrix) as a:
-    l = 0  
-    for ln in a.read().splitlines():
-        s = ln.split("\t")
-        if(l==0):
-            domain_names = s[2:]
+def shard_argument(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UPGMA dendrogram of modular biosynthetic pathways")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes scoring pathway pairs (default: 1, no pool)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="pairs per pool task (default: about four tasks per worker, "
+                             "at most %d pairs each)" % CHUNK_PAIRS)
+    parser.add_argument("--duplicate-hits", choices=DUPLICATE_POLICIES, default="first",
+                        help="hit kept when a query/subject pair is listed more than once: "
+                             "first (DIAMOND's best-scoring HSP), last, or the min/max distance "
+                             "(default: first)")
+    parser.add_argument("--cache-dir", default=".demo_cache",
+                        help="directory of parsed input caches (default: .demo_cache)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always parse the inputs and leave the cache alone")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the existing %s, scoring only pairs with new or changed "
+                             "pathways (as recorded in %s.state.json)" % (components_outfile, outfile))
+    parser.add_argument("--weights", action="append", metavar="JACCARD,GK,DDS",
+                        help="weights of the three similarity terms (default: %s,%s,%s); "
+                             "repeat to sweep several settings, writing one tree per setting"
+                             % (Jaccardw, GKw, DDSw))
+    parser.add_argument("--reweight", action="store_true",
+                        help="skip scoring and combine the saved %s with new --weights"
+                             % components_outfile)
+    parser.add_argument("--diamond", nargs="?", const="diamond", metavar="EXECUTABLE",
+                        help="run the DIAMOND search of %s (with EXECUTABLE, default: diamond) "
+                             "and parse its output as it is produced, instead of reading %s"
+                             % (protein_domain_source, blasttable))
+    parser.add_argument("--by-spec", action="store_true",
+                        help="with --diamond, search each spec's domains only against each other, "
+                             "in %s/" % diamond_groups_dir)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="DIAMOND threads with --diamond (default: the cores this process may use)")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="score straight into the memory-mapped float32 matrix %s, one block "
+                             "of rows at a time, and build the tree from it on disk; for pathway "
+                             "sets too large for memory" % matrix_outfile)
+    parser.add_argument("--block-pairs", type=int, default=1 << 22,
+                        help="pairs per block with --out-of-core or --checkpoint (default: 4194304)")
+    parser.add_argument("--checkpoint", nargs="?", const=checkpoint_dir, metavar="DIR",
+                        help="save every block of scored pairs to DIR (default: %s) as it completes, "
+                             "and resume from the blocks already there when rerun on the same "
+                             "inputs and weights; DIR is removed once the run's results are saved"
+                             % checkpoint_dir)
+    parser.add_argument("--csv", action="store_true",
+                        help="with --out-of-core, also write %s (same as --format csv)" % outfile)
+    parser.add_argument("--format", action="append", choices=OUTPUT_FORMATS,
+                        help="distance matrix output; repeat for several: csv, the square %s; "
+                             "lower-csv, the same without the zeros above the diagonal; phylip, "
+                             "lower-triangular %s; npy, condensed float32 %s with names in %s; "
+                             "npz, the compressed archive %s (default: csv, or only npy with "
+                             "--out-of-core)"
+                             % (outfile, phylip_outfile, matrix_outfile, matrix_labels, archive_outfile))
+    parser.add_argument("--tree-method", action="append", choices=TREE_METHODS,
+                        help="tree built from the distances; repeat for several: upgma, written "
+                             "to %s; nj, neighbour joining; single, complete or average linkage, the "
+                             "last weighting clusters by size where upgma averages the two; "
+                             "each but upgma to METHOD.nwk (default: upgma)" % tree_outfile)
+    parser.add_argument("--approximate", action="store_true",
+                        help="score exactly only the candidate pairs found by MinHash/LSH over "
+                             "the pathways' spec sets, and estimate the rest")
+    parser.add_argument("--lsh-bands", type=int, default=16,
+                        help="LSH bands with --approximate; more bands find more pairs (default: 16)")
+    parser.add_argument("--lsh-rows", type=int, default=4,
+                        help="sketch rows per LSH band; more rows keep fewer, closer pairs (default: 4)")
+    parser.add_argument("--minhash-gk", action="store_true",
+                        help="also sketch the GK neighbourhood pairs with --approximate")
+    parser.add_argument("--rf-sample", type=int, default=0, metavar="N",
+                        help="with --approximate, score N random pathways exactly and report the "
+                             "Robinson-Foulds distance between their exact and approximate trees")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the MinHash functions and the --rf-sample draw (default: 0)")
+    parser.add_argument("--shard", type=shard_argument, metavar="I/N",
+                        help="score only shard I of N (1 <= I <= N) of the pairs, about as much work "
+                             "as any other shard, and save it as %s for --merge"
+                             % shard_path(components_outfile, "I", "N"))
+    parser.add_argument("--merge", nargs="*", metavar="SHARD",
+                        help="skip scoring and build the distances and tree from the SHARD files "
+                             "of a --shard run (default: the one complete set of shard files), "
+                             "after checking that they cover every pair once")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="write a JSON report of stage times, pair-loop counters and peak "
+                             "memory to REPORT, and print progress while scoring")
+    parser.add_argument("--progress-interval", type=float, default=60.0,
+                        help="seconds between progress lines with --profile (default: 60)")
+    args = parser.parse_args(argv)
+    weights = [tuple(float(w) for w in setting.split(",")) for setting in args.weights or []]
+    if any(len(w) != 3 for w in weights):
+        parser.error("--weights takes three comma-separated numbers")
+    if not weights:
+        weights = [(Jaccardw, GKw, DDSw)]
+
+    methods = []
+    for method in args.tree_method or ["upgma"]:
+        if method not in methods:
+            methods.append(method)
+
+    formats = args.format or ([] if args.out_of_core else ["csv"])
+    if args.csv:
+        formats.append("csv")
+    if "csv" in formats and "lower-csv" in formats:
+        parser.error("csv and lower-csv are both written to %s; choose one" % outfile)
+
+    if args.approximate and (args.incremental or args.out_of_core):
+        parser.error("--approximate does not combine with --incremental or --out-of-core")
+    if args.out_of_core and (args.reweight or args.incremental or len(weights) > 1):
+        parser.error("--out-of-core scores with a single weight setting; "
+                     "it keeps no components for --reweight or --incremental")
+
+    if args.shard and (args.merge is not None or args.reweight or args.incremental
+                       or args.approximate or args.out_of_core):
+        parser.error("--shard only scores; it does not combine with --merge, --reweight, "
+                     "--incremental, --approximate or --out-of-core")
+    if args.checkpoint and (args.shard or args.merge is not None or args.reweight
+                            or args.incremental or args.approximate):
+        parser.error("--checkpoint only applies to full scoring runs and --out-of-core")
+    if args.merge is not None and (args.reweight or args.incremental or args.out_of_core):
+        parser.error("--merge does not combine with --reweight, --incremental or --out-of-core")
+
+    profile = Profile(args.progress_interval) if args.profile else None
+
+    if args.shard:
+        score_shard(args, profile)
+        if profile:
+            profile.write(args.profile)
+        return
+
+    if args.out_of_core:
+        try:
+            out_of_core(args, weights[0], formats, profile, methods)
+        except CheckpointMismatch as e:
+            parser.error(str(e))
+        if profile:
+            profile.write(args.profile)
+        return
+
+    if args.reweight:
+        with stage(profile, "load components"):
+            pnames, components = load_components(components_outfile)
+    elif args.merge is not None:
+        try:
+            pnames, components = merge_inputs(args.merge, profile)
+        except ValueError as e:
+            parser.error("cannot merge shards: %s" % e)
+    else:
+        try:
+            pnames, components = score_inputs(args, profile, weights)
+        except CheckpointMismatch as e:
+            parser.error(str(e))
+
+    for Jw, Gw, Dw in weights:
+        with stage(profile, "combine"):
+            dist_score_assembly_line = combine_components(components, Jw, Gw, Dw, scale=1)
+        if len(weights) == 1:
+            with stage(profile, "write distances"):
+                write_distances(dist_score_assembly_line, pnames, formats)
+            tag = None
         else:
-            if s[0] not in pathways:
-                pathways[s[0]] = {}
-            d = s[2:]
-            for i, spec in enumerate(d):
-                if spec == 'NA':
-                    continue
-                domain = '|'.join([s[0], domain_names[i]])
-                if s[0] not in annotation:
-                    annotation[s[0]] = []
-                annotation[s[0]].append(spec)
-                if spec not in pathways[s[0]]:
-                    pathways[s[0]][spec] = []
-                    pathways[s[0]][spec].append(domain)
-        l += 1
-dist = {}      
-with open(blasttable) as b:
-      for ln in b.read().splitlines():
-        s = ln.split("\t")
-        if s[0] not in dist:
-            dist[s[0]] = {}
-        dist[s[0]][s[1]] = 1-float(s[2])
-
-## Distance matrix
-dist_score_assembly_line = generate_distance_matrix(pathways, domain_names, annotation,
-                                                    dist, Jaccardw, GKw, DDSw,
-                                                    scale=1, nbhood=3, outfile=outfile)
-
-#-- Plot the tree
-names = pathways.keys()
-score = [s for s in open(outfile, 'r').read().split('\n')[1:] if s != '']
-matrix = []
-for i in range(len(score)):
-    input_i = score[i].split(',')[1:(i+2)]
-    input_i_int = [float(n) for n in input_i]
-    matrix.append(input_i_int)
-m = _DistanceMatrix(names, matrix)
-constructor = DistanceTreeConstructor()
-tree1 = constructor.upgma(m)
-#Bio.Phylo.draw_ascii(tree1)
-Bio.Phylo.write(tree1, tree_outfile, 'newick')
+            tag = "J%g_G%g_D%g" % (Jw, Gw, Dw)
+            print("Weights %g,%g,%g: %s" % (Jw, Gw, Dw, ", ".join(tree_path(method, tag)
+                                                                  for method in methods)))
+        #-- Plot the trees
+        write_trees(dist_score_assembly_line, pnames, methods, tag, profile)
+    if profile:
+        profile.write(args.profile)
+
+def out_of_core(args, weights, formats=(), profile=None, methods=("upgma",)):
+    """
+    Score into matrix_outfile with write_distance_file, write any other
+    of formats from it and build the trees of methods from the file,
+    with their working copy on disk as well.
+    """
+    Jw, Gw, Dw = weights
+    pathways, domain_names, annotation, dist = parse_inputs(args, profile)
+    checkpoint = None
+    if args.checkpoint:
+        with stage(profile, "digests"):
+            state = {"params": scoring_params(args),
+                     "pathways": pathway_digests(pathways, annotation, dist)}
+        checkpoint = Checkpoint(args.checkpoint, checkpoint_manifest(
+            state, list(pathways.keys()), [weights], args.block_pairs, "distances"))
+    with stage(profile, "score"):
+        model = compile_model(pathways, annotation, dist, nbhood=3)
+        dist_score_assembly_line = write_distance_file(matrix_outfile, model, Jw, Gw, Dw, scale=1,
+                                                       workers=args.workers,
+                                                       chunk_size=args.chunk_size,
+                                                       profile=profile,
+                                                       block_pairs=args.block_pairs,
+                                                       checkpoint=checkpoint)
+    pnames = model.names
+    write_labels(matrix_labels, pnames)
+    with stage(profile, "write distances"):
+        write_distances(dist_score_assembly_line, pnames, [fmt for fmt in formats if fmt != "npy"])
+    #-- Plot the tree
+    write_trees(dist_score_assembly_line, pnames, methods, profile=profile,
+                scratch=matrix_outfile + ".work.npy")
+    if checkpoint is not None:
+        checkpoint.clear()
+
+def parse_inputs(args, profile=None):
+    """The (pathways, domain_names, annotation, hit table) of the run."""
+    with stage(profile, "parse annotation"):
+        if args.no_cache:
+            pathways, domain_names, annotation = read_annotation(annotation_matrix)
+        else:
+            (pathways, domain_names, annotation), _ = load_annotation(annotation_matrix, args.cache_dir)
+    with stage(profile, "parse hits"):
+        if args.diamond and args.by_spec:
+            dist = search_spec_hits(protein_domain_source, pathways, diamond_groups_dir,
+                                    diamond=args.diamond, threads=args.threads,
+                                    duplicates=args.duplicate_hits)
+        elif args.diamond:
+            dist = search_hits(protein_domain_source, diamond_db, diamond=args.diamond,
+                               threads=args.threads, duplicates=args.duplicate_hits)
+        elif args.no_cache:
+            dist = read_hits(blasttable, duplicates=args.duplicate_hits)
+        else:
+            dist, _ = load_hits(blasttable, args.cache_dir, duplicates=args.duplicate_hits)
+    return pathways, domain_names, annotation, dist
+
+def scoring_params(args):
+    """Parameters the component matrices depend on; the weights and scale only apply afterwards."""
+    params = {"nbhood": 3, "duplicate_hits": args.duplicate_hits, "version": SCORING_VERSION}
+    if args.approximate:
+        params["approximate"] = {"bands": args.lsh_bands, "rows": args.lsh_rows,
+                                 "gk": args.minhash_gk, "seed": args.seed}
+    return params
+
+def score_inputs(args, profile=None, weights=((Jaccardw, GKw, DDSw),)):
+    """
+    Parse the inputs and score the pathway pairs, all of them or, with
+    --incremental, only those the inputs changed, or, with
+    --approximate, the LSH candidates (checked on a sample under the
+    first of the ``weights`` settings with --rf-sample), or, with
+    --checkpoint, all of them from where an interrupted run stopped.
+    Saves the components and the pathway digests; returns (pathway
+    names, components).
+    """
+    pathways, domain_names, annotation, dist = parse_inputs(args, profile)
+
+    params = scoring_params(args)
+    with stage(profile, "digests"):
+        digests = pathway_digests(pathways, annotation, dist)
+    state_file = outfile + ".state.json"
+    previous = None
+    if args.incremental:
+        if os.path.exists(components_outfile) and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            if state["params"] == params:
+                previous = load_components(components_outfile)
+            else:
+                print("Scoring parameters changed since the last run; rescoring every pair")
+        else:
+            print("No previous components and state to update; scoring every pair")
+    if previous is not None:
+        ## Compare against digests over the same partner pathways as the stored ones
+        current = pathway_digests(pathways, annotation, dist, partners=set(state["pathways"]))
+        changed = set(name for name in pathways
+                      if state["pathways"].get(name) != current[name])
+        print("%d new or changed pathways" % len(changed))
+        with stage(profile, "score"):
+            components = update_components(pathways, annotation, dist, nbhood=3,
+                                           previous=previous, changed=changed,
+                                           workers=args.workers, chunk_size=args.chunk_size,
+                                           profile=profile)
+    elif args.approximate:
+        with stage(profile, "score"):
+            components = approximate_components(compile_model(pathways, annotation, dist, nbhood=3),
+                                                args.lsh_bands, args.lsh_rows, args.seed,
+                                                args.minhash_gk, args.workers, args.chunk_size,
+                                                profile)
+        if args.rf_sample:
+            with stage(profile, "sample check"):
+                rf, most = sample_agreement(pathways, annotation, dist, list(pathways.keys()),
+                                            components, weights[0], args.rf_sample, args.seed)
+            print("Robinson-Foulds distance on %d sampled pathways: %d of %d (%.3f)"
+                  % (min(args.rf_sample, len(pathways)), rf, most, rf / float(most) if most else 0.))
+            if profile:
+                profile.counters["sample RF distance"] = rf
+                profile.counters["sample RF maximum"] = most
+    elif args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, checkpoint_manifest(
+            {"params": params, "pathways": digests}, list(pathways.keys()), weights,
+            args.block_pairs, "components"))
+        with stage(profile, "score"):
+            components = checkpointed_components(compile_model(pathways, annotation, dist, nbhood=3),
+                                                 checkpoint, args.workers, args.chunk_size, profile,
+                                                 args.block_pairs)
+    else:
+        with stage(profile, "score"):
+            components = generate_components(pathways, annotation, dist, nbhood=3,
+                                             workers=args.workers, chunk_size=args.chunk_size,
+                                             profile=profile)
+    pnames = list(pathways.keys())
+    save_state(pnames, components, {"params": params, "pathways": digests}, profile)
+    if args.checkpoint:
+        checkpoint.clear()
+    return pnames, components
+
+def save_state(pnames, components, state, profile=None):
+    """Save the components and the state file that --reweight and --incremental start from."""
+    with stage(profile, "write components"):
+        save_components(components_outfile, pnames, components)
+    with open(outfile + ".state.json", "w") as f:
+        json.dump(state, f)
 
+def score_shard(args, profile=None):
+    """
+    Score shard i of N (--shard i/N) of the pairs and save it next to
+    components_outfile, for --merge. Every shard parses the same inputs
+    and splits the pairs the same way, so the shards of a run tile the
+    pairs whatever node runs them.
+    """
+    i, nshards = args.shard
+    pathways, domain_names, annotation, dist = parse_inputs(args, profile)
+    with stage(profile, "digests"):
+        state = {"params": scoring_params(args),
+                 "pathways": pathway_digests(pathways, annotation, dist)}
+    with stage(profile, "score"):
+        model = compile_model(pathways, annotation, dist, nbhood=3)
+        shared = shared_spec_pairs(model)
+        start, stop = shard_bounds(shared, nshards)[i - 1]
+        print("Shard %d of %d: pairs %d..%d of %d (%d sharing a spec)"
+              % (i, nshards, start, stop - 1, len(shared), np.count_nonzero(shared[start:stop])))
+        components = np.empty((3, stop - start))
+        fill_components(components, model, np.arange(start, stop, dtype=np.int64), shared[start:stop],
+                        args.workers, args.chunk_size, profile, offset=start)
+    path = shard_path(components_outfile, i, nshards)
+    with stage(profile, "write components"):
+        save_shard(path, model.names, (start, stop), (i, nshards), components, state)
+    print("Wrote %s" % path)
+
+def merge_inputs(paths, profile=None):
+    """
+    Merge the shard files at paths (default: the one complete set of
+    shard files of components_outfile, see find_shards) into the
+    components and state of a single run; returns (pathway names,
+    components).
+    """
+    if not paths:
+        paths = find_shards(components_outfile)
+    with stage(profile, "merge shards"):
+        pnames, components, state = merge_shards(paths)
+    print("Merged %d shards of %d pairs" % (len(paths), components.shape[1]))
+    save_state(pnames, components, state, profile)
+    return pnames, components
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Domain-to-domain distances from DIAMOND/BLAST tabular output.
+
+Only the first three columns (query, subject, percent identity) are
+read. Domain headers are mapped to integer ids in order of first
+appearance and each query/subject pair keeps one distance,
+1 - identity, in an open-addressing hash table held in two flat
+arrays, so a lookup costs O(1) whatever the size of the table.
+"""
+
+import os
+import csv
+import mmap
+import numpy as np
+import pandas as pd
+
+## Which line wins when a query/subject pair is reported more than once
+## (one line per HSP). DIAMOND lists the HSPs of a pair best score first.
+DUPLICATE_POLICIES = ("first", "last", "min", "max")
+
+_EMPTY = -1
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+def _pair_keys(query_ids, subject_ids):
+    return (np.asarray(query_ids, dtype=np.int64) << 32) | np.asarray(subject_ids, dtype=np.int64)
+
+def _slots(keys, capacity):
+    """Home slots of keys in a table of ``capacity`` (a power of two) slots."""
+    hashed = keys.astype(np.uint64) * np.uint64(_HASH_MULTIPLIER)
+    return (hashed >> np.uint64(64 - (capacity.bit_length() - 1))).astype(np.int64)
+
+def _resolve_duplicates(keys, distances, duplicates):
+    """
+    Sorted distinct keys and one distance each, picked among the
+    repeats of a key (in line order) according to ``duplicates``.
+    """
+    if duplicates == "first":
+        keys, keep = np.unique(keys, return_index=True)
+    elif duplicates == "last":
+        keys, keep = np.unique(keys[::-1], return_index=True)
+        keep = len(distances) - 1 - keep
+    else:
+        order = np.lexsort((distances if duplicates == "min" else -distances, keys))
+        keys, keep = np.unique(keys[order], return_index=True)
+        keep = order[keep]
+    return keys, distances[keep]
+
+def _merge_pairs(keys, distances, later_keys, later_distances, duplicates):
+    """
+    Merge the resolved pairs of a later chunk into the resolved pairs so
+    far (both sorted and distinct), as if resolved together.
+    """
+    position = np.searchsorted(keys, later_keys)
+    seen = position < len(keys)
+    seen[seen] = keys[position[seen]] == later_keys[seen]
+    if duplicates == "last":
+        distances[position[seen]] = later_distances[seen]
+    elif duplicates == "min":
+        np.minimum.at(distances, position[seen], later_distances[seen])
+    elif duplicates == "max":
+        np.maximum.at(distances, position[seen], later_distances[seen])
+    new = ~seen
+    return (np.insert(keys, position[new], later_keys[new]),
+            np.insert(distances, position[new], later_distances[new]))
+
+def _merge_pending(keys, distances, pending, duplicates):
+    if not pending:
+        return keys, distances
+    later_keys, later_distances = _resolve_duplicates(
+        np.concatenate([k for k, d in pending]), np.concatenate([d for k, d in pending]), duplicates)
+    return _merge_pairs(keys, distances, later_keys, later_distances, duplicates)
+
+class HitTable:
+    """
+    Distances between domains, looked up by header or by integer id.
+
+    ``headers[i]`` is the header of domain id ``i`` and ``ids`` maps
+    headers back to ids. ``table[query][subject]`` works like the nested
+    dict the script used to build and raises KeyError for missing hits.
+    """
+    def __init__(self, headers, keys, values, capacity, npairs=None):
+        self.headers = list(headers)
+        self.ids = dict((h, i) for i, h in enumerate(self.headers))
+        self.keys = keys
+        self.values = values
+        self.capacity = capacity
+        if npairs is None:
+            npairs = int((keys != _EMPTY).sum())
+        self.npairs = npairs
+
+    @classmethod
+    def from_pairs(cls, headers, query_ids, subject_ids, distances, duplicates="first"):
+        """
+        Build a table from parallel arrays of hits, resolving repeated
+        query/subject pairs according to ``duplicates``.
+        """
+        if duplicates not in DUPLICATE_POLICIES:
+            raise ValueError("duplicates must be one of " + ", ".join(DUPLICATE_POLICIES))
+        keys, distances = _resolve_duplicates(_pair_keys(query_ids, subject_ids),
+                                              np.asarray(distances, dtype=np.float64), duplicates)
+        return cls._from_unique(headers, keys, distances)
+
+    @classmethod
+    def _from_unique(cls, headers, keys, distances):
+        """Build a table from sorted, distinct pair keys and their distances."""
+        ## At most half full, so probe sequences stay short
+        capacity = 1 << max(1, (2*len(keys)).bit_length())
+        slots = _slots(keys, capacity)
+        ## Linear probing without wrap-around: taking keys in home slot
+        ## order, each goes to the first free slot at or after its home,
+        ## i.e. max(home, previous position + 1), a running maximum.
+        order = np.argsort(slots)
+        position = slots[order]
+        del slots
+        ## In place: this runs once per distinct pair
+        rank = np.arange(len(keys))
+        position -= rank
+        np.maximum.accumulate(position, out=position)
+        position += rank
+        del rank
+        ## Probes run past the last home slot into an overflow tail that
+        ## always ends in an empty slot
+        size = max(capacity, int(position[-1]) + 1 if len(keys) else 0) + 1
+        table_keys = np.full(size, _EMPTY, dtype=np.int64)
+        table_values = np.zeros(size, dtype=np.float64)
+        table_keys[position] = keys[order]
+        table_values[position] = distances[order]
+        return cls(headers, table_keys, table_values, capacity, len(keys))
+
+    def __reduce__(self):
+        ## Memory-mapped arrays (from the cache) travel to pool workers as
+        ## their file, not their contents, and are mapped again there
+        return (_reopen_table, (self.headers, _mapped_path(self.keys), _mapped_path(self.values),
+                                self.capacity, self.npairs))
+
+    def lookup(self, query_ids, subject_ids, default=np.nan):
+        """
+        Distances of many query/subject id pairs at once; pairs without
+        a hit, or with a negative (unknown) id, get ``default``.
+        """
+        query_ids = np.asarray(query_ids, dtype=np.int64)
+        subject_ids = np.asarray(subject_ids, dtype=np.int64)
+        keys = _pair_keys(query_ids, subject_ids)
+        out = np.full(keys.shape, default, dtype=np.float64)
+        pending = np.nonzero((query_ids >= 0) & (subject_ids >= 0))[0]
+        slots = _slots(keys[pending], self.capacity)
+        while len(pending):
+            found = self.keys[slots]
+            hit = found == keys[pending]
+            out[pending[hit]] = self.values[slots[hit]]
+            probe = ~hit & (found != _EMPTY)
+            pending = pending[probe]
+            slots = slots[probe] + 1
+        return out
+
+    def pairs(self):
+        """Query ids, subject ids and distances of every stored pair."""
+        stored = np.nonzero(self.keys != _EMPTY)[0]
+        keys = self.keys[stored]
+        return (keys >> 32), (keys & 0xFFFFFFFF), self.values[stored]
+
+    def distance(self, query, subject):
+        """Distance between two domain headers; KeyError if there is no hit."""
+        value = self.lookup([self.ids[query]], [self.ids[subject]])[0]
+        if np.isnan(value):
+            raise KeyError(subject)
+        return value
+
+    def get(self, query, subject, default=None):
+        try:
+            return self.distance(query, subject)
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return self.npairs
+
+    def __contains__(self, query):
+        return query in self.ids
+
+    def __getitem__(self, query):
+        return _HitRow(self, self.ids[query])
+
+def _mapped_path(array):
+    """The .npy file behind a whole memory-mapped array, else the array itself."""
+    if isinstance(array, np.memmap) and array.filename and isinstance(array.base, mmap.mmap):
+        return array.filename
+    return array
+
+def _reopen_table(headers, keys, values, capacity, npairs):
+    if isinstance(keys, str):
+        keys = np.load(keys, mmap_mode="r")
+    if isinstance(values, str):
+        values = np.load(values, mmap_mode="r")
+    return HitTable(headers, keys, values, capacity, npairs)
+
+class _HitRow:
+    """The hits of one query, indexed by subject header."""
+    def __init__(self, table, query_id):
+        self.table = table
+        self.query_id = query_id
+
+    def __getitem__(self, subject):
+        value = self.table.lookup([self.query_id], [self.table.ids[subject]])[0]
+        if np.isnan(value):
+            raise KeyError(subject)
+        return value
+
+    def __contains__(self, subject):
+        try:
+            self[subject]
+        except KeyError:
+            return False
+        return True
+
+def read_hits(source, duplicates="first", chunksize=250000, identity_scale=100.0):
+    """
+    Stream a tabular hit table (a path or an open text handle, or a
+    sequence of them read one after the other) in chunks of
+    ``chunksize`` lines and return a HitTable of 1 - identity, with the
+    identity column divided by ``identity_scale`` (DIAMOND and BLAST
+    report percentages). Repeated pairs are resolved chunk by chunk, so
+    memory follows the number of distinct pairs rather than of lines.
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError("duplicates must be one of " + ", ".join(DUPLICATE_POLICIES))
+    if isinstance(source, (str, os.PathLike)) or hasattr(source, "read"):
+        source = [source]
+    headers = []
+    ids = {}
+    keys = np.empty(0, dtype=np.int64)
+    distances = np.empty(0, dtype=np.float64)
+    ## Resolved chunks not merged yet; merging once they hold as many
+    ## pairs as the merged table keeps the number of merges logarithmic
+    pending, npending = [], 0
+    for table in source:
+        try:
+            chunks = pd.read_csv(table, sep="\t", header=None, usecols=[0, 1, 2],
+                                 dtype={0: str, 1: str, 2: np.float64},
+                                 quoting=csv.QUOTE_NONE, chunksize=chunksize)
+            for chunk in chunks:
+                nhits = len(chunk)
+                codes, uniques = pd.factorize(np.concatenate([chunk[0].values, chunk[1].values]))
+                ## Only the headers seen in this chunk go through the dict
+                chunk_ids = np.empty(len(uniques), dtype=np.int32)
+                for k, header in enumerate(uniques):
+                    if header not in ids:
+                        ids[header] = len(headers)
+                        headers.append(header)
+                    chunk_ids[k] = ids[header]
+                codes = chunk_ids[codes]
+                chunk_keys, chunk_distances = _resolve_duplicates(
+                    _pair_keys(codes[:nhits], codes[nhits:]),
+                    1 - chunk[2].values.astype(np.float64) / identity_scale, duplicates)
+                del chunk, codes
+                pending.append((chunk_keys, chunk_distances))
+                npending += len(chunk_keys)
+                if npending >= len(keys):
+                    keys, distances = _merge_pending(keys, distances, pending, duplicates)
+                    pending, npending = [], 0
+        except pd.errors.EmptyDataError:
+            pass
+    keys, distances = _merge_pending(keys, distances, pending, duplicates)
+    return HitTable._from_unique(headers, keys, distances)
@@ -0,0 +1,104 @@
+"""
+MinHash sketches of compiled pathways and LSH candidate pairs.
+
+Each pathway's spec set (optionally with its GK neighbourhood pairs) is
+sketched by the minimum of nhashes random hash functions over its
+tokens. Two sketches agree at a position with probability equal to the
+Jaccard index of the two token sets, so the fraction of agreeing
+positions estimates it. LSH cuts the sketch into ``bands`` bands of
+``rows`` positions and takes as candidates the pairs that agree on a
+whole band at least once: a pair of Jaccard index J becomes a candidate
+with probability 1 - (1 - J**rows)**bands, a step at about
+lsh_threshold(bands, rows). More bands raise recall, more rows cut the
+candidates.
+"""
+
+import numpy as np
+
+from condensed import condensed_index, condensed_size, pairs_from_indices
+
+_EMPTY = np.iinfo(np.uint64).max
+
+def lsh_threshold(bands, rows):
+    """Jaccard index at which a pair is about as likely as not to become a candidate."""
+    return (1.0 / bands) ** (1.0 / rows)
+
+def _bits(x):
+    """Indices of the set bits of a non-negative int."""
+    out = []
+    while x:
+        low = x & -x
+        out.append(low.bit_length() - 1)
+        x ^= low
+    return out
+
+def pathway_tokens(model, gk=False):
+    """
+    (owners, tokens): one entry per token of each pathway of the model,
+    its spec ids and, with gk, its forward GK pairs after them.
+    """
+    nspecs = len(model.spec_names)
+    owners, tokens = [], []
+    for p, pathway in enumerate(model.pathways):
+        items = list(pathway.specs)
+        if gk:
+            items.extend(nspecs + b for b in _bits(pathway.forward))
+        owners.extend([p] * len(items))
+        tokens.extend(items)
+    return np.array(owners, dtype=np.int64), np.array(tokens, dtype=np.uint64)
+
+def _mix(x):
+    ## splitmix64 finaliser; uint64 arithmetic wraps around
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def signatures(model, nhashes, seed=0, gk=False, block=16):
+    """
+    (n, nhashes) uint64 MinHash signatures of the model's pathways,
+    computed ``block`` hash functions at a time. Pathways without any
+    token get the all-ones signature.
+    """
+    n = len(model.names)
+    owners, tokens = pathway_tokens(model, gk)
+    salts = _mix(np.arange(nhashes, dtype=np.uint64) + np.uint64(seed) * np.uint64(nhashes) + np.uint64(1))
+    sigs = np.full((n, nhashes), _EMPTY, dtype=np.uint64)
+    if not len(tokens):
+        return sigs
+    ## reduceat needs contiguous, non-empty segments per owner
+    order = np.argsort(owners, kind="stable")
+    owners, tokens = owners[order], tokens[order]
+    starts = np.nonzero(np.r_[True, owners[1:] != owners[:-1]])[0]
+    for k in range(0, nhashes, block):
+        hashed = _mix(tokens[:, None] ^ salts[None, k:k + block])
+        sigs[owners[starts], k:k + block] = np.minimum.reduceat(hashed, starts, axis=0)
+    return sigs
+
+def lsh_candidates(sigs, bands, rows):
+    """
+    Boolean condensed mask of the pathway pairs whose signatures agree
+    on all rows of at least one band.
+    """
+    n = len(sigs)
+    candidates = np.zeros(condensed_size(n), dtype=bool)
+    weights = _mix(np.arange(1, rows + 1, dtype=np.uint64))
+    for band in range(bands):
+        keys = (sigs[:, band*rows:(band+1)*rows] * weights).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        bounds = np.nonzero(np.r_[True, keys[order][1:] != keys[order][:-1], True])[0]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop - start < 2:
+                continue
+            members = np.sort(order[start:stop])
+            for k in range(len(members) - 1):
+                candidates[condensed_index(members[k], members[k+1:], n)] = True
+    return candidates
+
+def estimate_jaccard(sigs, pair_ids, block=1 << 16):
+    """MinHash estimates of the Jaccard index of the pairs at the condensed pair_ids."""
+    n = len(sigs)
+    estimates = np.empty(len(pair_ids))
+    for start in range(0, len(pair_ids), block):
+        i, j = pairs_from_indices(pair_ids[start:start + block], n)
+        estimates[start:start + block] = (sigs[i] == sigs[j]).mean(axis=1)
+    return estimates
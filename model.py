@@ -0,0 +1,104 @@
+"""
+Compiled pathway model for the scoring loop.
+
+compile_model() interns spec labels and 'pathway|domain' headers as
+integers once per run, so the pair loop works on ints only. Every
+pathway holds its sorted spec ids, the domain ids of each spec and its
+spec set as an int bitmask; the GK neighbourhood pairs are bitmasks
+over interned (spec, spec) pairs. Intersections and their sizes are
+then integer & and popcounts, with no set or string built per pair.
+
+Domain ids follow the sorted order of the headers, so comparing ids
+orders two domains as comparing their headers does.
+
+For the DDS kernel the model also lays the (pathway, spec) entries of
+all pathways out as flat arrays (CSR style): ``entry_keys`` holds
+pathway * nspecs + spec for every entry, in sorted order, so the
+entries two pathways share are found with one searchsorted, and
+``entry_domains[entry_start[e]:entry_start[e] + entry_count[e]]`` are
+the domain ids of entry e. ``hit_ids`` maps domain ids to the ids of
+the HitTable ``dist`` the distances are gathered from.
+"""
+
+import numpy as np
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else: ## Python < 3.10
+    def popcount(x):
+        return bin(x).count("1")
+
+class Pathway:
+    """
+    One pathway of a PathwayModel: ``specs`` its sorted spec ids,
+    ``domains`` spec id -> tuple of domain ids, ``mask`` the bitmask of
+    its specs, ``ndomains`` its domain count, and the GK bitmasks of its
+    annotation sequence read forward and reversed.
+    """
+    __slots__ = ("name", "specs", "domains", "mask", "ndomains", "gk_mask", "forward", "forward_swapped", "reverse", "reverse_swapped")
+
+class PathwayModel:
+    """
+    All pathways of a run, in ``names`` order, with the spec labels and
+    domain headers behind their ids, and the flat entry arrays and hit
+    store of the DDS kernel.
+    """
+    __slots__ = ("names", "index", "pathways", "spec_names", "headers", "dist",
+                 "hit_ids", "ndomains", "spec_start", "entry_keys", "entry_start",
+                 "entry_count", "entry_domains")
+
+    def __getitem__(self, name):
+        return self.pathways[self.index[name]]
+
+def _gk_masks(seq, nbhood, pair_bits):
+    """Bitmasks of the neighbourhood pairs of seq and of the same pairs swapped."""
+    pairs = 0
+    swapped = 0
+    for i in range(len(seq)-nbhood):
+        for j in range(i+1, i+nbhood):
+            pairs |= 1 << pair_bits.setdefault((seq[i], seq[j]), len(pair_bits))
+            swapped |= 1 << pair_bits.setdefault((seq[j], seq[i]), len(pair_bits))
+    return pairs, swapped
+
+def compile_model(pathways, annotation, dist, nbhood, names=None):
+    """
+    Build the PathwayModel of read_annotation()'s pathways and
+    annotation, with distances from the HitTable dist, for the pathways
+    in names (default: all, in ``pathways`` key order).
+    """
+    names = list(pathways.keys()) if names is None else list(names)
+    spec_names = sorted(set(spec for name in names for spec in pathways[name]) |
+                        set(spec for name in names for spec in annotation.get(name, [])))
+    spec_ids = dict((spec, k) for k, spec in enumerate(spec_names))
+    headers = sorted(set(h for name in names for hs in pathways[name].values() for h in hs))
+    domain_ids = dict((h, k) for k, h in enumerate(headers))
+    pair_bits = {}
+    model = PathwayModel()
+    model.names = names
+    model.index = dict((name, k) for k, name in enumerate(names))
+    model.spec_names = spec_names
+    model.headers = headers
+    model.dist = dist
+    model.hit_ids = np.array([dist.ids.get(h, -1) for h in headers], dtype=np.int64)
+    model.pathways = []
+    for name in names:
+        p = Pathway()
+        p.name = name
+        p.domains = dict((spec_ids[spec], tuple(domain_ids[h] for h in hs))
+                         for spec, hs in pathways[name].items())
+        p.specs = tuple(sorted(p.domains))
+        p.mask = sum(1 << s for s in p.specs)
+        p.ndomains = sum(len(ds) for ds in p.domains.values())
+        seq = [spec_ids[spec] for spec in annotation.get(name, [])]
+        p.gk_mask = sum(1 << s for s in set(seq))
+        p.forward, p.forward_swapped = _gk_masks(seq, nbhood, pair_bits)
+        p.reverse, p.reverse_swapped = _gk_masks(seq[::-1], nbhood, pair_bits)
+        model.pathways.append(p)
+    entries = [(k, spec, p.domains[spec]) for k, p in enumerate(model.pathways) for spec in p.specs]
+    model.ndomains = np.array([p.ndomains for p in model.pathways], dtype=np.int64)
+    model.spec_start = np.cumsum([0] + [len(p.specs) for p in model.pathways], dtype=np.int64)
+    model.entry_keys = np.array([k * len(spec_names) + spec for k, spec, ds in entries], dtype=np.int64)
+    model.entry_count = np.array([len(ds) for k, spec, ds in entries], dtype=np.int64)
+    model.entry_start = np.cumsum(model.entry_count) - model.entry_count
+    model.entry_domains = np.array([d for k, spec, ds in entries for d in ds], dtype=np.int64)
+    return model
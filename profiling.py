@@ -0,0 +1,79 @@
+"""
+Opt-in instrumentation of a dendrogram run.
+
+A Profile records the wall time of each stage, counters bumped inside
+the pair loop (passed as a collections.Counter to cluster_components,
+and merged back from pool workers), periodic progress lines and the
+peak resident memory of the run. Counter keys starting with
+"munkres size " form the histogram of Hungarian matrix sizes.
+"""
+
+import sys
+import json
+import time
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError: ## not on Windows
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB."""
+    if resource is None:
+        return None
+    ## ru_maxrss is in kilobytes on Linux, bytes on macOS
+    unit = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+
+def stage(profile, name):
+    """profile.stage(name), or a no-op when not profiling."""
+    return profile.stage(name) if profile else contextlib.nullcontext()
+
+class Profile:
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.last_progress = self.started
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block; repeated stages of the same name add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def progress(self, done, total, started):
+        """Print a progress line if ``interval`` seconds passed since the last one."""
+        now = time.perf_counter()
+        if now - self.last_progress < self.interval and done < total:
+            return
+        self.last_progress = now
+        rate = done / (now - started) if now > started else 0.0
+        eta = (total - done) / rate if rate else float("nan")
+        print("Scored %d of %d pairs (%.1f%%), %.0f pairs/s, %.0f s left, %s missing hits"
+              % (done, total, 100.0 * done / total if total else 100.0, rate, eta,
+                 self.counters["missing hits"]))
+        sys.stdout.flush()
+
+    def report(self):
+        counters = dict((k, v) for k, v in self.counters.items() if not k.startswith("munkres size "))
+        sizes = dict((k[len("munkres size "):], v) for k, v in self.counters.items()
+                     if k.startswith("munkres size "))
+        score = self.stages.get("score")
+        return {"wall_seconds": time.perf_counter() - self.started,
+                "stages": self.stages,
+                "pairs_per_second": counters.get("pairs", 0) / score if score else None,
+                "counters": counters,
+                "munkres_sizes": sizes,
+                "peak_rss_mb": peak_rss_mb()}
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
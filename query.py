@@ -0,0 +1,222 @@
+"""
+Trees of pathway subsets and nearest references of new pathways, from
+the results of an earlier generate_dendrogram.py run.
+
+A subset tree is cut out of a saved matrix (any output of --format, or
+the component matrices, combined under --weights) without scoring any
+pair. A query pathway, present in the annotation matrix and hit table
+but not necessarily in the saved matrix, is scored against every
+reference only, with the pair kernel of cluster_distance; one already
+in the saved matrix is scored in the matrix's pair order, so it gets
+the distances of its row.
+
+    python query.py tree P0001 P0002 P0003 -o subset.nwk
+    python query.py tree --names-file genus.txt --matrix distance.npy
+    python query.py nearest NEW0001 NEW0002 -k 5
+"""
+
+import os
+import argparse
+import numpy as np
+
+import generate_dendrogram as dendrogram
+from annotation import read_annotation
+from hits import DUPLICATE_POLICIES, read_hits
+from cache import load_annotation, load_hits
+from condensed import condensed_index, condensed_size, labels_path, load_components, load_matrix
+from condensed import pairs_from_indices
+from model import compile_model
+from trees import TREE_METHODS, build_tree
+
+def load_distances(path, weights=(dendrogram.Jaccardw, dendrogram.GKw, dendrogram.DDSw)):
+    """
+    (names, condensed distances) saved at path: a components file
+    (combined under weights) or any matrix load_matrix() reads.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            is_components = "jaccard" in f.files
+        if is_components:
+            names, components = load_components(path)
+            return names, dendrogram.combine_components(components, *weights, scale=1)
+    return load_matrix(path)
+
+def saved_names(path):
+    """The pathway names of a file load_distances() reads, without its values."""
+    ext = os.path.splitext(path)[1]
+    if ext == ".npz":
+        with np.load(path) as f:
+            return [str(name) for name in f["names"]]
+    if ext == ".npy":
+        with open(labels_path(path)) as f:
+            return [line.rstrip("\n") for line in f]
+    return load_matrix(path)[0]
+
+def repeated(names):
+    """The names listed more than once, in order of their first repeat."""
+    seen, out = set(), []
+    for name in names:
+        if name in seen and name not in out:
+            out.append(name)
+        seen.add(name)
+    return out
+
+def submatrix(condensed, names, subset):
+    """
+    Condensed distances among the pathways of subset, in its order,
+    gathered from the condensed matrix over names. Raises KeyError for
+    a name not in names and ValueError for a name listed twice.
+    """
+    twice = repeated(subset)
+    if twice:
+        raise ValueError("listed more than once: %s" % ", ".join(twice[:10]))
+    index = dict((name, k) for k, name in enumerate(names))
+    positions = np.array([index[name] for name in subset], dtype=np.int64)
+    i, j = pairs_from_indices(np.arange(condensed_size(len(subset))), len(subset))
+    low, high = np.minimum(positions[i], positions[j]), np.maximum(positions[i], positions[j])
+    return np.asarray(condensed[condensed_index(low, high, len(names))])
+
+def subset_tree(condensed, names, subset, method="upgma"):
+    """Tree (see TREE_METHODS) of the pathways of subset, from the matrix over names."""
+    return build_tree(submatrix(condensed, names, subset), list(subset), method)
+
+def nearest_references(pathways, annotation, dist, queries, references, k=10,
+                       weights=(dendrogram.Jaccardw, dendrogram.GKw, dendrogram.DDSw),
+                       order=None):
+    """
+    Score every query pathway against every reference (pathways of
+    read_annotation(), hits in the HitTable dist) and return, for each
+    query, its k nearest references as (name, distance) pairs, closest
+    first. The references are compiled once for all queries; a query is
+    never its own reference, and a reference listed twice counts once.
+
+    GK depends on which pathway is scored as A. A full run scores the
+    pair of its pathways i < j with A the later one, j; order, the
+    pathway names of that run, makes a query and a reference both in it
+    be scored the same way, so their distance is the run's. A query not
+    in order is scored as A, as if it came after every reference.
+    Raises ValueError for a query listed twice.
+    """
+    queries = list(queries)
+    twice = repeated(queries)
+    if twice:
+        raise ValueError("listed more than once: %s" % ", ".join(twice[:10]))
+    exclude = set(queries)
+    references = [name for name in dict.fromkeys(references) if name not in exclude]
+    missing = [name for name in queries + references if name not in pathways]
+    if missing:
+        raise KeyError("not in the annotation matrix: %s" % ", ".join(missing[:10]))
+    model = compile_model(pathways, annotation, dist, nbhood=3, names=references + queries)
+    refs = np.arange(len(references))
+    position = dict((name, p) for p, name in enumerate(order or []))
+    ref_positions = np.array([position.get(name, -1) for name in references], dtype=np.int64)
+    nearest = {}
+    for q, query in enumerate(queries):
+        ## The query is A unless it comes before the reference in order
+        if query in position:
+            first = ref_positions > position[query]
+        else:
+            first = np.zeros(len(refs), dtype=bool)
+        a = np.where(first, refs, len(references) + q)
+        b = np.where(first, len(references) + q, refs)
+        components = np.array(dendrogram.batch_components(model, a, b)).reshape(-1, 3).T
+        distances = dendrogram.combine_components(components, *weights, scale=1)
+        closest = np.argsort(distances, kind="stable")[:k]
+        nearest[query] = [(references[r], float(distances[r])) for r in closest]
+    return nearest
+
+def read_inputs(args):
+    """The (pathways, annotation, hit table) of generate_dendrogram.py's inputs."""
+    if args.no_cache:
+        pathways, domain_names, annotation = read_annotation(dendrogram.annotation_matrix)
+        dist = read_hits(dendrogram.blasttable, duplicates=args.duplicate_hits)
+    else:
+        (pathways, domain_names, annotation), _ = load_annotation(dendrogram.annotation_matrix,
+                                                                   args.cache_dir)
+        dist, _ = load_hits(dendrogram.blasttable, args.cache_dir, duplicates=args.duplicate_hits)
+    return pathways, annotation, dist
+
+def _names(args):
+    names = list(args.names)
+    if args.names_file:
+        with open(args.names_file) as f:
+            names.extend(line.strip() for line in f if line.strip())
+    return names
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subset trees and nearest references from a saved "
+                                                 "dendrogram run")
+    parser.add_argument("--matrix", default=dendrogram.components_outfile,
+                        help="saved components or distance matrix (default: %s)"
+                             % dendrogram.components_outfile)
+    parser.add_argument("--weights", default="%s,%s,%s" % (dendrogram.Jaccardw, dendrogram.GKw,
+                                                           dendrogram.DDSw),
+                        metavar="JACCARD,GK,DDS",
+                        help="weights of the three similarity terms (default: %(default)s)")
+    parser.add_argument("--cache-dir", default=".demo_cache",
+                        help="directory of parsed input caches (default: .demo_cache)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always parse the inputs and leave the cache alone")
+    parser.add_argument("--duplicate-hits", choices=DUPLICATE_POLICIES, default="first",
+                        help="hit kept when a query/subject pair is listed more than once "
+                             "(default: first)")
+    commands = parser.add_subparsers(dest="command")
+    tree = commands.add_parser("tree", help="tree of named pathways, cut from --matrix")
+    tree.add_argument("names", nargs="*", help="pathways of the subset")
+    tree.add_argument("--names-file", help="file of further pathway names, one per line")
+    tree.add_argument("-o", "--out", default="subset.nwk", help="Newick output (default: subset.nwk)")
+    tree.add_argument("--tree-method", choices=TREE_METHODS, default="upgma",
+                      help="upgma, nj (neighbour joining), or single, complete or average linkage "
+                           "(default: upgma)")
+    near = commands.add_parser("nearest", help="score query pathways against the references and "
+                                               "list the closest")
+    near.add_argument("names", nargs="*", help="query pathways, from the annotation matrix")
+    near.add_argument("--names-file", help="file of further query names, one per line")
+    near.add_argument("-k", type=int, default=10, help="references listed per query (default: 10)")
+    near.add_argument("--references", metavar="FILE",
+                      help="reference names, one per line (default: the pathways of --matrix, or "
+                           "every other pathway when it does not exist)")
+    args = parser.parse_args(argv)
+    weights = tuple(float(w) for w in args.weights.split(","))
+    if len(weights) != 3:
+        parser.error("--weights takes three comma-separated numbers")
+    if args.command is None:
+        parser.error("choose a command: tree or nearest")
+    names = _names(args)
+    if not names:
+        parser.error("no pathway names given")
+    twice = repeated(names)
+    if twice:
+        parser.error("listed more than once: %s" % ", ".join(twice[:10]))
+
+    if args.command == "tree":
+        pnames, condensed = load_distances(args.matrix, weights)
+        unknown = sorted(set(names) - set(pnames))
+        if unknown:
+            parser.error("not in %s: %s" % (args.matrix, ", ".join(unknown[:10])))
+        subset_tree(condensed, pnames, names, args.tree_method).write(args.out)
+        print("Wrote the tree of %d pathways to %s" % (len(names), args.out))
+        return
+
+    pathways, annotation, dist = read_inputs(args)
+    ## The pathways of the run in its order, for queries already in it
+    if os.path.exists(args.matrix):
+        order = saved_names(args.matrix)
+    else:
+        order = list(pathways.keys())
+    if args.references:
+        with open(args.references) as f:
+            references = [line.strip() for line in f if line.strip()]
+    else:
+        references = order
+    try:
+        nearest = nearest_references(pathways, annotation, dist, names, references, args.k, weights,
+                                     order)
+    except KeyError as e:
+        parser.error(e.args[0])
+    for query in names:
+        for rank, (reference, distance) in enumerate(nearest[query], 1):
+            print("%s\t%d\t%s\t%r" % (query, rank, reference, distance))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Split the pair scoring of one run over several independent jobs.
+
+Shard i of N scores one contiguous range of condensed pair indices and
+saves its components, with the range and the run's state (scoring
+parameters and pathway digests), to a partial file. merge_shards()
+checks that the partial files come from the same run and cover every
+pair exactly once, and puts the component matrices back together.
+
+Pairs sharing no spec take a closed form and cost next to nothing, so
+shard_bounds() balances the shards on the pairs that do.
+"""
+
+import os
+import re
+import glob
+import json
+import numpy as np
+
+from condensed import condensed_size
+
+def parse_shard(text):
+    """(i, N) of a 'i/N' shard argument, 1 <= i <= N; raises ValueError."""
+    i, sep, n = text.partition("/")
+    if not sep:
+        raise ValueError("expected i/N, got %r" % text)
+    i, n = int(i), int(n)
+    if not 1 <= i <= n:
+        raise ValueError("shard %d/%d out of range" % (i, n))
+    return i, n
+
+def shard_bounds(shared, nshards):
+    """
+    Split the condensed pairs into nshards contiguous (start, stop)
+    ranges holding about as many spec-sharing pairs each, from the
+    boolean mask ``shared`` of shared_spec_pairs(). Falls back to equal
+    pair counts when no pair shares a spec.
+    """
+    npairs = len(shared)
+    cost = np.cumsum(shared, dtype=np.int64)
+    total = int(cost[-1]) if npairs else 0
+    if total == 0:
+        cuts = [npairs * k // nshards for k in range(nshards + 1)]
+    else:
+        targets = [-(-total * k // nshards) for k in range(1, nshards)]
+        cuts = [0] + [int(np.searchsorted(cost, t)) + 1 for t in targets] + [npairs]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def shard_path(path, i, nshards):
+    """Partial file of shard i of nshards for the components file at path."""
+    root, ext = os.path.splitext(path)
+    return "%s.shard-%s-of-%s%s" % (root, i, nshards, ext)
+
+def find_shards(path):
+    """
+    The partial files of the components file at path, as shard_path()
+    names them, that make up the one complete set 1..N. Raises
+    ValueError when no shard count has a complete set or several do.
+    """
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r"\.shard-(\d+)-of-(\d+)" + re.escape(ext) + "$")
+    groups = {}
+    for name in glob.glob(glob.escape(root) + ".shard-*-of-*" + glob.escape(ext)):
+        match = pattern.match(name)
+        if match:
+            i, nshards = int(match.group(1)), int(match.group(2))
+            groups.setdefault(nshards, {})[i] = name
+    if not groups:
+        raise ValueError("no shard files of %s" % path)
+    complete = sorted(n for n, found in groups.items() if sorted(found) == list(range(1, n + 1)))
+    if not complete:
+        raise ValueError("no complete set of shard files: %s"
+                         % ", ".join("%d of %d" % (len(groups[n]), n) for n in sorted(groups)))
+    if len(complete) > 1:
+        raise ValueError("complete sets of %s shards; name the files to merge"
+                         % " and of ".join(str(n) for n in complete))
+    found = groups[complete[0]]
+    return [found[i] for i in sorted(found)]
+
+def save_shard(path, names, bounds, shard, components, state):
+    """
+    Save the (3, stop-start) components of the pairs in bounds = (start,
+    stop), scored as shard = (i, N), with the run's state.
+    """
+    Jaccard, DDS, GK = components
+    np.savez(path, names=np.array(names, dtype=str), bounds=np.array(bounds, dtype=np.int64),
+             shard=np.array(shard, dtype=np.int64), jaccard=Jaccard, dds=DDS, gk=GK,
+             state=np.array(json.dumps(state, sort_keys=True)))
+
+def load_shard(path):
+    """Return a dict of the names, bounds, shard, components and state saved by save_shard."""
+    with np.load(path) as f:
+        return {"names": [str(name) for name in f["names"]],
+                "bounds": tuple(int(b) for b in f["bounds"]),
+                "shard": tuple(int(s) for s in f["shard"]),
+                "components": np.array([f["jaccard"], f["dds"], f["gk"]]),
+                "state": json.loads(str(f["state"]))}
+
+def merge_shards(paths):
+    """
+    Put the partial files at paths back together. Returns (names,
+    components, state) like a single run's. Raises ValueError when the
+    files come from different inputs, parameters or shard counts, or
+    when the pairs are not covered exactly once.
+    """
+    if not paths:
+        raise ValueError("no shard files to merge")
+    shards = sorted((load_shard(path) for path in paths), key=lambda s: s["bounds"])
+    first = shards[0]
+    nshards = first["shard"][1]
+    for s in shards:
+        if s["names"] != first["names"] or s["state"] != first["state"]:
+            raise ValueError("shards come from different inputs or parameters")
+        if s["shard"][1] != nshards:
+            raise ValueError("shards of %d and of %d parts" % (nshards, s["shard"][1]))
+    seen = sorted(s["shard"][0] for s in shards)
+    if seen != list(range(1, nshards + 1)):
+        missing = sorted(set(range(1, nshards + 1)) - set(seen))
+        raise ValueError("expected shards 1..%d once each; missing %s, got %s" % (nshards, missing, seen))
+    npairs = condensed_size(len(first["names"]))
+    components = np.empty((3, npairs))
+    covered = 0
+    for s in shards:
+        start, stop = s["bounds"]
+        if start != covered:
+            raise ValueError("pairs %d..%d are %s" % (min(start, covered), max(start, covered) - 1,
+                                                      "missing" if start > covered else "in two shards"))
+        components[:, start:stop] = s["components"]
+        covered = stop
+    if covered != npairs:
+        raise ValueError("pairs %d..%d are missing" % (covered, npairs - 1))
+    return first["names"], components, first["state"]
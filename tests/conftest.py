@@ -0,0 +1,40 @@
+import os
+import sys
+import random
+
+import pytest
+
+## The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import generate_dendrogram
+from annotation import read_annotation
+from hits import read_hits
+
+class Inputs:
+    """A synthetic annotation matrix and hit table written to directory, and parsed."""
+    def __init__(self, directory, domains):
+        self.directory = directory
+        self.domains = domains
+        self.annotation_file = os.path.join(directory, generate_dendrogram.annotation_matrix)
+        self.hits_file = os.path.join(directory, generate_dendrogram.blasttable)
+        self.pathways, self.domain_names, self.annotation = read_annotation(self.annotation_file)
+        self.dist = read_hits(self.hits_file)
+
+@pytest.fixture(scope="session")
+def synthetic_inputs():
+    """
+    Writes the benchmark's random inputs of npathways pathways into a
+    directory, under the names generate_dendrogram.py reads, and
+    returns them as Inputs.
+    """
+    def write(directory, npathways, ndomains=12, nspecs=25, hits_per_domain=50, seed=0):
+        directory = str(directory)
+        rng = random.Random(seed)
+        domains = benchmark.write_annotation(os.path.join(directory, generate_dendrogram.annotation_matrix),
+                                             npathways, ndomains, nspecs, rng)
+        benchmark.write_hits(os.path.join(directory, generate_dendrogram.blasttable), domains,
+                             hits_per_domain, rng)
+        return Inputs(directory, domains)
+    return write
@@ -0,0 +1,126 @@
+"""The parsed-input cache: invalidation, memory-mapped hit tables and concurrent fills."""
+
+import os
+import pickle
+import collections
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import cache
+from cache import load_annotation, load_hits
+
+HITS = "".join("D%d\tD%d\t%d\t100\n" % (k % 50, (7 * k) % 50, 20 + k % 80) for k in range(3000))
+
+def write_hits(tmp_path):
+    path = os.path.join(str(tmp_path), "hits.dbp")
+    with open(path, "w") as f:
+        f.write(HITS)
+    return path
+
+def test_mapped_table_pickles_by_path(tmp_path):
+    path = write_hits(tmp_path)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    load_hits(path, cache_dir)
+    table, _ = load_hits(path, cache_dir)
+    assert isinstance(table.keys, np.memmap)
+    data = pickle.dumps(table)
+    assert len(data) < table.keys.nbytes
+    copy = pickle.loads(data)
+    assert isinstance(copy.keys, np.memmap) and copy.keys.filename == table.keys.filename
+    assert isinstance(copy.values, np.memmap)
+    query, subject, distance = table.pairs()
+    assert np.array_equal(copy.lookup(query, subject), distance)
+
+def _mapped_in_worker(table):
+    ## A pickled np.memmap comes back as a memmap of no file, holding a copy
+    return getattr(table.keys, "filename", None), float(table.lookup([0], [0])[0])
+
+def test_spawned_worker_maps_the_cache(tmp_path):
+    path = write_hits(tmp_path)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    load_hits(path, cache_dir)
+    table, _ = load_hits(path, cache_dir)
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        filename, value = pool.apply(_mapped_in_worker, (table,))
+    assert filename == table.keys.filename
+    np.testing.assert_equal(value, table.lookup([0], [0])[0])
+
+def _fill(args):
+    path, cache_dir = args
+    table, _ = load_hits(path, cache_dir)
+    return len(table)
+
+def test_concurrent_fills_of_one_entry(tmp_path):
+    path = write_hits(tmp_path)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        sizes = pool.map(_fill, [(path, cache_dir)] * 8)
+    assert len(set(sizes)) == 1
+    table, _ = load_hits(path, cache_dir)
+    assert len(table) == sizes[0]
+    leftovers = [name for root, dirs, files in os.walk(cache_dir) for name in files
+                 if name.endswith(".tmp")]
+    assert leftovers == []
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Counts of the parses the cache falls back to, by kind."""
+    counts = collections.Counter()
+    def counting(kind, parse):
+        def wrapper(*args, **kwargs):
+            counts[kind] += 1
+            return parse(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(cache, "read_hits", counting("hits", cache.read_hits))
+    monkeypatch.setattr(cache, "read_annotation", counting("annotation", cache.read_annotation))
+    return counts
+
+def test_changed_hits_invalidate_entry(tmp_path, parses):
+    path = write_hits(tmp_path)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    load_hits(path, cache_dir)
+    load_hits(path, cache_dir)
+    assert parses["hits"] == 1
+    ## Touched but unchanged: the content hash still matches
+    os.utime(path, ns=(0, 0))
+    load_hits(path, cache_dir)
+    assert parses["hits"] == 1
+    ## Same size, one identity changed
+    with open(path, "w") as f:
+        f.write(HITS.replace("D0\tD0\t20", "D0\tD0\t21", 1))
+    table, _ = load_hits(path, cache_dir)
+    assert parses["hits"] == 2
+    assert table.distance("D0", "D0") == pytest.approx(0.79)
+    ## Another duplicate policy is another entry's worth of parsing
+    load_hits(path, cache_dir, duplicates="max")
+    assert parses["hits"] == 3
+
+def test_changed_annotation_invalidates_entry(tmp_path, synthetic_inputs, parses):
+    inputs = synthetic_inputs(tmp_path, 20, seed=8)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    (pathways, domain_names, annotation), _ = load_annotation(inputs.annotation_file, cache_dir)
+    load_annotation(inputs.annotation_file, cache_dir)
+    assert parses["annotation"] == 1
+    assert pathways == inputs.pathways and annotation == inputs.annotation
+    with open(inputs.annotation_file) as f:
+        lines = f.readlines()
+    with open(inputs.annotation_file, "w") as f:
+        f.writelines(lines[:-1])
+    (pathways, domain_names, annotation), _ = load_annotation(inputs.annotation_file, cache_dir)
+    assert parses["annotation"] == 2
+    assert len(pathways) == len(inputs.pathways) - 1
+
+def test_version_bump_invalidates_entries(tmp_path, synthetic_inputs, parses, monkeypatch):
+    inputs = synthetic_inputs(tmp_path, 20, seed=8)
+    cache_dir = os.path.join(str(tmp_path), "cache")
+    load_annotation(inputs.annotation_file, cache_dir)
+    load_hits(inputs.hits_file, cache_dir)
+    monkeypatch.setattr(cache, "CACHE_VERSION", cache.CACHE_VERSION + 1)
+    load_annotation(inputs.annotation_file, cache_dir)
+    table, _ = load_hits(inputs.hits_file, cache_dir)
+    assert parses == {"annotation": 2, "hits": 2}
+    assert len(table) == len(inputs.dist)
+    load_hits(inputs.hits_file, cache_dir)
+    assert parses["hits"] == 2
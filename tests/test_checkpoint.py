@@ -0,0 +1,96 @@
+"""Checkpointed runs: resuming after a kill, and refusing another run's checkpoint."""
+
+import os
+import json
+
+import numpy as np
+import pytest
+
+import checkpoint
+import generate_dendrogram
+from checkpoint import Checkpoint
+from condensed import load_components, row_blocks
+
+class Killed(Exception):
+    pass
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path, 30, ndomains=8, nspecs=6, hits_per_domain=10, seed=5)
+    monkeypatch.chdir(tmp_path)
+    return inputs
+
+def run(monkeypatch, argv, kill_after=None):
+    """
+    Run generate_dendrogram.py, killed when it is about to record block
+    kill_after + 1; returns the blocks it recorded.
+    """
+    saved = []
+    save = Checkpoint.save
+    def counted(self, rows, data=None):
+        if len(saved) == kill_after:
+            raise Killed()
+        save(self, rows, data)
+        saved.append(tuple(rows))
+    with monkeypatch.context() as m:
+        m.setattr(Checkpoint, "save", counted)
+        try:
+            generate_dendrogram.main(["--no-cache"] + argv)
+        except Killed:
+            pass
+    return saved
+
+CHECKPOINTED = ["--checkpoint", "--block-pairs", "60"]
+
+def outputs(mode):
+    with open(generate_dendrogram.tree_outfile) as f:
+        tree = f.read()
+    if mode:
+        return tree, np.load(generate_dendrogram.matrix_outfile)
+    return tree, load_components(generate_dendrogram.components_outfile)[1]
+
+@pytest.mark.parametrize("mode", [[], ["--out-of-core"]])
+def test_resume_matches_full_run(run_dir, monkeypatch, capsys, mode):
+    generate_dendrogram.main(["--no-cache"] + mode)
+    expected = outputs(mode)
+    os.remove(generate_dendrogram.tree_outfile)
+    blocks = row_blocks(len(run_dir.pathways), 60)
+    assert run(monkeypatch, CHECKPOINTED + mode, kill_after=3) == blocks[:3]
+    assert not os.path.exists(generate_dendrogram.tree_outfile)
+    capsys.readouterr()
+    ## Only the blocks the killed run did not record are scored again
+    assert run(monkeypatch, CHECKPOINTED + mode) == blocks[3:]
+    assert ("Resuming from %s: 3 of %d blocks already scored"
+            % (generate_dendrogram.checkpoint_dir, len(blocks))) in capsys.readouterr().out
+    tree, data = outputs(mode)
+    assert tree == expected[0] and np.array_equal(data, expected[1])
+    assert not os.path.exists(generate_dendrogram.checkpoint_dir)
+
+def change_hits(run_dir):
+    with open(run_dir.hits_file) as f:
+        lines = f.readlines()
+    fields = lines[0].split("\t")
+    fields[2] = "%.1f" % (100 - float(fields[2]) / 2)
+    lines[0] = "\t".join(fields)
+    with open(run_dir.hits_file, "w") as f:
+        f.writelines(lines)
+
+@pytest.mark.parametrize("first,change,argv,differs", [
+    ([], None, ["--weights", "0.4,0.3,0.3"], "weights"),
+    (["--out-of-core"], None, ["--out-of-core", "--weights", "0.4,0.3,0.3"], "weights"),
+    ([], change_hits, [], "inputs"),
+    (["--out-of-core"], change_hits, ["--out-of-core"], "inputs"),
+    ([], None, ["--out-of-core"], "kind"),
+    (["--out-of-core"], None, [], "kind")])
+def test_other_run_rejected(run_dir, monkeypatch, capsys, first, change, argv, differs):
+    run(monkeypatch, CHECKPOINTED + first, kill_after=2)
+    if change:
+        change(run_dir)
+    capsys.readouterr()
+    with pytest.raises(SystemExit):
+        run(monkeypatch, CHECKPOINTED + argv)
+    assert ("%s was left by a run with different %s; remove it to start over"
+            % (generate_dendrogram.checkpoint_dir, differs)) in capsys.readouterr().err
+    ## and is left as it was
+    with open(os.path.join(generate_dendrogram.checkpoint_dir, checkpoint.MANIFEST)) as f:
+        assert len(json.load(f)["completed"]) == 2
@@ -0,0 +1,69 @@
+"""Condensed matrices: the writers and readers of every output format."""
+
+import numpy as np
+import pytest
+
+import condensed
+from condensed import condensed_size, load_matrix
+
+def matrix(n, dtype=np.float64, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.random(condensed_size(n)).astype(dtype)
+    ## Values whose shortest text is long, or exact
+    values[::3] = (np.arange(len(values[::3])) / 7.).astype(dtype)
+    values[1::5] = 0
+    return values, ["p%d" % k for k in range(n)]
+
+@pytest.mark.parametrize("n", [1, 2, 9])
+@pytest.mark.parametrize("suffix,save", [(".npy", condensed.save_npy), (".npz", condensed.save_npz)])
+def test_binary_round_trip(tmp_path, n, suffix, save):
+    values, names = matrix(n)
+    names[-1] = "p q,é"
+    path = str(tmp_path / ("distance" + suffix))
+    save(path, values, names)
+    for mmap in (True, False):
+        loaded_names, loaded = load_matrix(path, mmap)
+        assert loaded_names == names
+        assert loaded.dtype == np.float32
+        assert np.array_equal(loaded, values.astype(np.float32))
+
+@pytest.mark.parametrize("n", [1, 2, 9])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("suffix,write", [(".csv", condensed.write_csv),
+                                          (".lower.csv", condensed.write_lower_csv),
+                                          (".phy", condensed.write_phylip)])
+def test_text_round_trip(tmp_path, n, dtype, suffix, write):
+    values, names = matrix(n, dtype)
+    if suffix != ".phy":
+        names[-1] = 'p "q", r'
+    path = str(tmp_path / ("distance" + suffix))
+    write(values, names, path)
+    loaded_names, loaded = load_matrix(path)
+    assert loaded_names == names
+    ## Every value is written as the shortest text that reads back to it
+    assert loaded.dtype == np.float64
+    assert np.array_equal(loaded.astype(dtype), values)
+
+def test_text_from_memmap(tmp_path):
+    values, names = matrix(12, np.float32)
+    condensed.save_npy(str(tmp_path / "distance.npy"), values, names)
+    names, mapped = load_matrix(str(tmp_path / "distance.npy"))
+    for suffix, write in [(".csv", condensed.write_csv), (".phy", condensed.write_phylip)]:
+        write(mapped, names, str(tmp_path / ("distance" + suffix)))
+        loaded = load_matrix(str(tmp_path / ("distance" + suffix)))[1]
+        assert np.array_equal(loaded.astype(np.float32), values)
+
+def test_csv_layout(tmp_path):
+    pandas = pytest.importorskip("pandas")
+    values, names = matrix(6)
+    square = np.zeros((6, 6))
+    square[np.triu_indices(6, 1)] = values
+    expected = pandas.DataFrame(square.T, index=names, columns=names).to_csv()
+    condensed.write_csv(values, names, str(tmp_path / "distance.csv"))
+    with open(str(tmp_path / "distance.csv")) as f:
+        assert f.read() == expected
+    condensed.write_lower_csv(values, names, str(tmp_path / "lower.csv"))
+    with open(str(tmp_path / "lower.csv")) as f:
+        lines = f.read().splitlines()
+    assert [len(line.split(",")) for line in lines] == [7] + list(range(1, 7))
+    assert lines[0] == expected.splitlines()[0]
@@ -0,0 +1,128 @@
+"""The DDS kernel: domain distances, their sums and the closed form of unshared pairs."""
+
+import random
+import itertools
+
+import numpy as np
+import pytest
+
+from condensed import condensed_size, pairs_from_indices
+from generate_dendrogram import (Munkres, batch_components, dds_sums, domain_distances,
+                                 shared_spec_pairs, unshared_components)
+from hits import HitTable
+from model import compile_model
+
+def make_model(domains, hits):
+    """
+    Model of pathways given as name -> spec -> number of domains, with
+    headers 'name|spec.k', and hits as (query, subject) -> distance.
+    """
+    pathways, annotation = {}, {}
+    for name, specs in domains.items():
+        pathways[name] = dict((spec, ["%s|%s.%d" % (name, spec, k) for k in range(count)])
+                              for spec, count in specs.items())
+        annotation[name] = sorted(specs)
+    headers = sorted(h for specs in pathways.values() for hs in specs.values() for h in hs)
+    ids = dict((h, k) for k, h in enumerate(headers))
+    pairs = sorted(hits.items())
+    table = HitTable.from_pairs(headers, [ids[q] for (q, s), d in pairs],
+                                [ids[s] for (q, s), d in pairs], [d for (q, s), d in pairs])
+    return pathways, compile_model(pathways, annotation, table, 3)
+
+def ids(model, *headers):
+    return np.array([model.headers.index(h) for h in headers], dtype=np.int64)
+
+def test_domain_distance_prefers_smaller_query():
+    pathways, model = make_model({"A": {"s": 3}, "B": {"s": 1}},
+                                 {("A|s.0", "B|s.0"): 0.2, ("B|s.0", "A|s.0"): 0.7,
+                                  ("B|s.0", "A|s.1"): 0.4})
+    ## Both hits: the one from the smaller header, whichever side it is on
+    for query, subject in (("A|s.0", "B|s.0"), ("B|s.0", "A|s.0")):
+        distances, missing = domain_distances(model, ids(model, query), ids(model, subject))
+        assert distances.tolist() == [0.2] and missing == 0
+    ## Only the reverse hit
+    distances, missing = domain_distances(model, ids(model, "A|s.1"), ids(model, "B|s.0"))
+    assert distances.tolist() == [0.4] and missing == 0
+    ## No hit either way
+    distances, missing = domain_distances(model, ids(model, "A|s.2", "A|s.0"),
+                                          ids(model, "B|s.0", "B|s.0"))
+    assert distances.tolist() == [1., 0.2] and missing == 1
+
+def random_hits(rng, first, second):
+    """One hit per domain pair, in a random direction, or none."""
+    hits = {}
+    for query, subject in itertools.product(first, second):
+        if rng.random() < 0.8:
+            pair = (query, subject) if rng.random() < 0.5 else (subject, query)
+            hits[pair] = round(rng.uniform(0.05, 0.95), 2)
+    return hits
+
+def distance(hits, query, subject):
+    return hits.get((min(query, subject), max(query, subject)),
+                    hits.get((max(query, subject), min(query, subject)), 1.))
+
+@pytest.mark.parametrize("la,lb", [(2, 2), (3, 2), (2, 4), (4, 4)])
+def test_fills_every_domain_pair(la, lb):
+    rng = random.Random(la * 10 + lb)
+    first = ["A|s.%d" % k for k in range(la)]
+    second = ["B|s.%d" % k for k in range(lb)]
+    hits = random_hits(rng, first, second)
+    pathways, model = make_model({"A": {"s": la}, "B": {"s": lb}}, hits)
+    ## Brute force over every way of pairing the smaller side
+    matrix = [[distance(hits, q, s) for s in second] for q in first]
+    if la <= lb:
+        best = min(sum(matrix[r][c] for r, c in enumerate(cols))
+                   for cols in itertools.permutations(range(lb), la))
+    else:
+        best = min(sum(matrix[r][c] for c, r in enumerate(rows))
+                   for rows in itertools.permutations(range(la), lb))
+    DDS, S = dds_sums(model, [0], [1])
+    assert DDS[0] == pytest.approx(best + abs(la - lb))
+    assert S[0] == max(la, lb)
+
+@pytest.mark.parametrize("la,lb", [(1, 1), (1, 5), (5, 1)])
+def test_single_row_or_column_takes_minimum(la, lb):
+    rng = random.Random(la + lb)
+    first = ["A|s.%d" % k for k in range(la)]
+    second = ["B|s.%d" % k for k in range(lb)]
+    hits = random_hits(rng, first, second)
+    pathways, model = make_model({"A": {"s": la}, "B": {"s": lb}}, hits)
+    matrix = [[distance(hits, q, s) for s in second] for q in first]
+    munkres = sum(matrix[r][c] for r, c in Munkres().compute(matrix))
+    assert munkres == min(min(row) for row in matrix)
+    for a, b in ((0, 1), (1, 0)):
+        DDS, S = dds_sums(model, [a], [b])
+        assert DDS[0] == munkres + abs(la - lb)
+        assert S[0] == max(la, lb)
+
+def test_unshared_domains_add_to_both_sums():
+    hits = {("A|s.0", "B|s.0"): 0.3, ("A|s.1", "B|s.0"): 0.6}
+    pathways, model = make_model({"A": {"s": 2, "t": 1}, "B": {"s": 1, "u": 3}}, hits)
+    DDS, S = dds_sums(model, [0], [1])
+    ## t and u's four domains, then the best of s's 2 x 1 matrix and
+    ## its unpaired domain
+    assert DDS[0] == pytest.approx(4 + 0.3 + 1)
+    assert S[0] == 4 + 2
+
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path_factory.mktemp("dds"), 60, ndomains=8, nspecs=12,
+                              hits_per_domain=15, seed=5)
+    return compile_model(inputs.pathways, inputs.annotation, inputs.dist, 3)
+
+def test_sums_symmetric(synthetic):
+    n = len(synthetic.names)
+    i, j = pairs_from_indices(np.arange(condensed_size(n)), n)
+    DDS, S = dds_sums(synthetic, j, i)
+    reversed_DDS, reversed_S = dds_sums(synthetic, i, j)
+    ## Equal up to the order the paired distances are added in
+    assert np.allclose(DDS, reversed_DDS, rtol=1e-12, atol=0)
+    assert np.array_equal(S, reversed_S)
+
+def test_unshared_closed_form_matches_pairs(synthetic):
+    n = len(synthetic.names)
+    unshared = np.nonzero(~shared_spec_pairs(synthetic))[0]
+    assert len(unshared)
+    i, j = pairs_from_indices(unshared, n)
+    expected = np.array(batch_components(synthetic, j, i)).T
+    assert np.array_equal(unshared_components(synthetic, unshared), expected)
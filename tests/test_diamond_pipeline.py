@@ -0,0 +1,96 @@
+"""The DIAMOND pipeline, run against a stub executable that replays a recorded table."""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+import diamond_pipeline
+import generate_dendrogram
+
+## Logs its arguments, touches the database on makedb, and on blastp
+## writes the recorded hits between domains of the query FASTA
+STUB = """#!%s
+import os, sys
+args = sys.argv[1:]
+with open(os.environ["STUB_LOG"], "a") as f:
+    f.write(" ".join(args) + "\\n")
+if args[0] == "makedb":
+    open(args[args.index("-d") + 1] + ".dmnd", "w").close()
+    sys.exit(0)
+query = args[args.index("-q") + 1]
+headers = set(line[1:].split()[0] for line in open(query) if line.startswith(">"))
+for line in open(os.environ["STUB_TABLE"]):
+    fields = line.split("\\t")
+    if fields[0] in headers and fields[1] in headers:
+        sys.stdout.write(line)
+sys.exit(int(os.environ.get("STUB_EXIT", "0")))
+"""
+
+@pytest.fixture
+def run(tmp_path, monkeypatch, synthetic_inputs):
+    """A directory of generate_dendrogram inputs and the stub DIAMOND to search them."""
+    inputs = synthetic_inputs(tmp_path, 15, ndomains=6, nspecs=5, hits_per_domain=8, seed=1)
+    with open(str(tmp_path / generate_dendrogram.protein_domain_source), "w") as f:
+        for header, spec in inputs.domains:
+            f.write(">%s\nMKVLAAGIVG\n" % header)
+    stub = tmp_path / "diamond"
+    stub.write_text(STUB % sys.executable)
+    stub.chmod(0o755)
+    monkeypatch.setenv("STUB_LOG", str(tmp_path / "stub.log"))
+    monkeypatch.setenv("STUB_TABLE", str(tmp_path / generate_dendrogram.blasttable))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def calls(run, command):
+    with open(str(run / "stub.log")) as f:
+        return [line.split() for line in f if line.split()[0] == command]
+
+def test_makedb_skipped_when_database_current(run):
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    assert len(calls(run, "makedb")) == 1
+    assert len(calls(run, "blastp")) == 2
+
+def test_makedb_rebuilt_when_fasta_changes(run):
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    ## Same size and an older timestamp: only the content tells
+    stat = os.stat("src.faa")
+    with open("src.faa") as f:
+        text = f.read()
+    with open("src.faa", "w") as f:
+        f.write(text.replace("MKVLAAGIVG", "MKVLAAGIVA", 1))
+    os.utime("src.faa", (stat.st_atime, stat.st_mtime - 60))
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    assert len(calls(run, "makedb")) == 2
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    assert len(calls(run, "makedb")) == 2
+    ## A database from before the stamp is rebuilt once
+    os.remove("full.sha1")
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    assert len(calls(run, "makedb")) == 3
+
+def test_threads(run):
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"), threads=3)
+    diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+    first, second = calls(run, "blastp")
+    assert first[first.index("-p") + 1] == "3"
+    assert second[second.index("-p") + 1] == str(diamond_pipeline.available_cores())
+
+def test_failed_search_raises(run, monkeypatch):
+    monkeypatch.setenv("STUB_EXIT", "2")
+    with pytest.raises(subprocess.CalledProcessError):
+        diamond_pipeline.search_hits("src.faa", "full", diamond=str(run / "diamond"))
+
+@pytest.mark.parametrize("by_spec", [False, True])
+def test_matches_file_based_run(run, by_spec):
+    generate_dendrogram.main(["--no-cache"])
+    with open(generate_dendrogram.outfile) as f:
+        expected = f.read()
+    os.remove(generate_dendrogram.outfile)
+    argv = ["--no-cache", "--diamond", str(run / "diamond")]
+    generate_dendrogram.main(argv + ["--by-spec"] if by_spec else argv)
+    with open(generate_dendrogram.outfile) as f:
+        assert f.read() == expected
+    assert calls(run, "blastp")
@@ -0,0 +1,50 @@
+"""read_hits() resolving repeated pairs chunk by chunk, as if all at once."""
+
+import io
+import random
+
+import numpy as np
+import pytest
+
+from hits import DUPLICATE_POLICIES, HitTable, read_hits
+
+def hit_lines(count, ndomains, seed=0):
+    rng = random.Random(seed)
+    return ["D%d\tD%d\t%.1f\t100\n" % (rng.randrange(ndomains), rng.randrange(ndomains),
+                                      rng.uniform(20, 100)) for k in range(count)]
+
+def named_pairs(table):
+    query, subject, distance = table.pairs()
+    return sorted((table.headers[q], table.headers[s], d)
+                  for q, s, d in zip(query.tolist(), subject.tolist(), distance.tolist()))
+
+@pytest.mark.parametrize("duplicates", DUPLICATE_POLICIES)
+@pytest.mark.parametrize("chunksize", [3, 40, 500, 100000])
+def test_chunked_parse_matches_one_pass(duplicates, chunksize):
+    lines = hit_lines(2000, 40)
+    headers, ids = [], {}
+    query, subject, distance = [], [], []
+    for line in lines:
+        q, s, identity = line.split("\t")[:3]
+        for header in (q, s):
+            if header not in ids:
+                ids[header] = len(headers)
+                headers.append(header)
+        query.append(ids[q])
+        subject.append(ids[s])
+        distance.append(1 - float(identity) / 100.0)
+    expected = HitTable.from_pairs(headers, query, subject, distance, duplicates)
+    table = read_hits(io.StringIO("".join(lines)), duplicates=duplicates, chunksize=chunksize)
+    assert len(table) == len(expected)
+    assert named_pairs(table) == named_pairs(expected)
+
+def test_lookup_after_chunked_parse():
+    table = read_hits(io.StringIO("a\tb\t90\na\tb\t50\nb\ta\t70\n"), chunksize=1)
+    assert table["a"]["b"] == pytest.approx(0.1)
+    assert table["b"]["a"] == pytest.approx(0.3)
+    assert "c" not in table
+    assert np.isnan(table.lookup([0], [0])[0])
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        read_hits(io.StringIO("a\tb\t90\n"), duplicates="mean")
@@ -0,0 +1,21 @@
+"""Approximate scoring: LSH candidates and the estimates of the other pairs."""
+
+import numpy as np
+
+import generate_dendrogram
+from minhash import estimate_jaccard, signatures
+from model import compile_model
+
+def test_estimates_use_spec_sketch(tmp_path, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path, 120, hits_per_domain=10, seed=2)
+    pathways, annotation, dist = inputs.pathways, inputs.annotation, inputs.dist
+    model = compile_model(pathways, annotation, dist, 3)
+    exact = generate_dendrogram.generate_components(pathways, annotation, dist, 3)
+    sigs = signatures(model, 16 * 4, 0)
+    for gk in (False, True):
+        components = generate_dendrogram.approximate_components(model, 16, 4, gk=gk)
+        estimated = np.nonzero(components[0] != exact[0])[0]
+        assert len(estimated)
+        assert np.array_equal(components[0, estimated], estimate_jaccard(sigs, estimated))
+        ## The GK floor follows the spec-only estimate too
+        assert set(np.unique(components[2, estimated])) <= {0., 0.5}
@@ -0,0 +1,44 @@
+"""query.py: subset matrices and nearest references against a full run."""
+
+import pytest
+
+import generate_dendrogram
+import query
+from condensed import condensed_index
+
+@pytest.fixture(scope="module")
+def run(tmp_path_factory, synthetic_inputs):
+    """Inputs of a small run, and its distances in the order of the full matrix."""
+    inputs = synthetic_inputs(tmp_path_factory.mktemp("query"), 40, ndomains=8, nspecs=6,
+                              hits_per_domain=15, seed=4)
+    pathways, annotation, dist = inputs.pathways, inputs.annotation, inputs.dist
+    components = generate_dendrogram.generate_components(pathways, annotation, dist, 3)
+    condensed = generate_dendrogram.combine_components(
+        components, generate_dendrogram.Jaccardw, generate_dendrogram.GKw,
+        generate_dendrogram.DDSw, scale=1)
+    return pathways, annotation, dist, list(pathways.keys()), condensed
+
+def test_submatrix_rejects_repeated_names(run):
+    pathways, annotation, dist, names, condensed = run
+    with pytest.raises(ValueError):
+        query.submatrix(condensed, names, [names[0], names[3], names[0]])
+
+def test_main_rejects_repeated_names():
+    with pytest.raises(SystemExit):
+        query.main(["tree", "P000001", "P000002", "P000001"])
+
+def test_nearest_of_a_run_pathway_is_its_row(run):
+    pathways, annotation, dist, names, condensed = run
+    n = len(names)
+    for q in (0, n // 2, n - 1):
+        nearest = query.nearest_references(pathways, annotation, dist, [names[q]], names, k=n,
+                                           order=names)[names[q]]
+        assert len(nearest) == n - 1
+        for reference, distance in nearest:
+            r = names.index(reference)
+            assert distance == condensed[condensed_index(min(q, r), max(q, r), n)]
+
+def test_nearest_rejects_repeated_queries(run):
+    pathways, annotation, dist, names, condensed = run
+    with pytest.raises(ValueError):
+        query.nearest_references(pathways, annotation, dist, [names[1], names[1]], names)
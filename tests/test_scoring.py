@@ -0,0 +1,124 @@
+"""The pair loop: chunks, their scores, and the results of whole runs."""
+
+import re
+
+import numpy as np
+import pytest
+
+import generate_dendrogram
+from condensed import condensed_size, load_components, pairs_from_indices
+from model import compile_model
+from profiling import Profile
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path_factory.mktemp("scoring"), 50, ndomains=8, nspecs=10,
+                              hits_per_domain=15, seed=6)
+    return compile_model(inputs.pathways, inputs.annotation, inputs.dist, 3)
+
+def test_chunks_bounded():
+    npairs = 10 * generate_dendrogram.CHUNK_PAIRS + 7
+    for workers in (1, 4):
+        chunks = generate_dendrogram.pair_chunks(npairs, workers)
+        assert chunks[0][0] == 0 and chunks[-1][1] == npairs
+        assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+        assert max(stop - start for start, stop in chunks) <= generate_dendrogram.CHUNK_PAIRS
+    assert len(generate_dendrogram.pair_chunks(100, 2)) == 8
+    assert generate_dendrogram.pair_chunks(100, 1, chunk_size=60) == [(0, 60), (60, 100)]
+
+def test_score_pairs_array(model):
+    n = len(model.names)
+    pair_ids = np.arange(5, condensed_size(n), 3)
+    scores = generate_dendrogram.score_pairs(0, len(pair_ids), model, pair_ids, batch=17)
+    assert scores.shape == (3, len(pair_ids))
+    i, j = pairs_from_indices(pair_ids, n)
+    assert np.array_equal(scores, np.array(generate_dendrogram.batch_components(model, j, i)).T)
+
+@pytest.mark.parametrize("workers,chunk_size", [(1, None), (1, 40), (2, 100)])
+def test_fill_matches_pairs(model, workers, chunk_size):
+    n = len(model.names)
+    components = np.empty((3, condensed_size(n)))
+    generate_dendrogram.fill_components(components, model, np.arange(condensed_size(n)),
+                                        generate_dendrogram.shared_spec_pairs(model),
+                                        workers, chunk_size)
+    i, j = pairs_from_indices(np.arange(condensed_size(n)), n)
+    assert np.array_equal(components, np.array(generate_dendrogram.batch_components(model, j, i)).T)
+
+@pytest.mark.parametrize("interval", [0, 1e9])
+def test_progress_follows_interval(tmp_path, synthetic_inputs, capsys, interval):
+    inputs = synthetic_inputs(tmp_path, 150, ndomains=8, nspecs=6, hits_per_domain=10, seed=7)
+    model = compile_model(inputs.pathways, inputs.annotation, inputs.dist, 3)
+    n = len(model.names)
+    shared = generate_dendrogram.shared_spec_pairs(model)
+    components = np.empty((3, condensed_size(n)))
+    ## One chunk, scored batch by batch
+    generate_dendrogram.fill_components(components, model, np.arange(condensed_size(n)), shared,
+                                        chunk_size=condensed_size(n), profile=Profile(interval))
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Scored")]
+    if interval:
+        assert len(lines) == 1
+    else:
+        assert len(lines) == 1 + -(-np.count_nonzero(shared) // 4096) > 2
+    assert lines[-1].startswith("Scored %d of %d pairs" % ((np.count_nonzero(shared),) * 2))
+
+def incremental_run(capsys, argv=()):
+    """Run generate_dendrogram.py with --incremental; returns (changed, scored) counts."""
+    capsys.readouterr()
+    generate_dendrogram.main(["--no-cache", "--incremental"] + list(argv))
+    out = capsys.readouterr().out
+    changed = re.search(r"(\d+) new or changed pathways", out)
+    scored = re.search(r"Scoring (\d+) of (\d+) pairs", out)
+    return int(changed.group(1)) if changed else None, scored and int(scored.group(1))
+
+def full_components():
+    return load_components(generate_dendrogram.components_outfile)
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path, 30, ndomains=8, nspecs=6, hits_per_domain=10, seed=9)
+    monkeypatch.chdir(tmp_path)
+    return inputs
+
+def test_incremental_unchanged_rescores_nothing(run_dir, capsys):
+    ## Hits to domains outside the annotation, before and after the
+    ## first run, change no pathway
+    with open(run_dir.hits_file, "a") as f:
+        f.write("%s\tUNANNOTATED|KS1\t55.0\n" % run_dir.domains[0][0])
+    incremental_run(capsys)
+    expected = full_components()
+    assert incremental_run(capsys) == (0, 0)
+    with open(run_dir.hits_file, "a") as f:
+        f.write("%s\tUNANNOTATED|KS2\t65.0\n" % run_dir.domains[1][0])
+    assert incremental_run(capsys) == (0, 0)
+    names, components = full_components()
+    assert names == expected[0] and np.array_equal(components, expected[1])
+
+def test_incremental_changed_pathway_rescores_its_pairs(run_dir, capsys):
+    incremental_run(capsys)
+    names = list(run_dir.pathways.keys())
+    ## Change one hit whose query is a domain of the fifth pathway
+    with open(run_dir.hits_file) as f:
+        lines = f.readlines()
+    k = next(k for k, line in enumerate(lines)
+             if line.startswith(names[4] + "|") and line.split("\t")[1].split("|")[0] != names[4])
+    fields = lines[k].split("\t")
+    fields[2] = "%.1f" % (100 - float(fields[2]) / 2)
+    lines[k] = "\t".join(fields)
+    with open(run_dir.hits_file, "w") as f:
+        f.writelines(lines)
+    assert incremental_run(capsys) == (1, len(names) - 1)
+    incremental = full_components()
+    generate_dendrogram.main(["--no-cache"])
+    assert np.array_equal(incremental[1], full_components()[1])
+
+def test_incremental_added_pathways(run_dir, capsys):
+    ## The hit table already covers the pathways added later
+    with open(run_dir.annotation_file) as f:
+        lines = f.readlines()
+    with open(run_dir.annotation_file, "w") as f:
+        f.writelines(lines[:-5])
+    incremental_run(capsys)
+    with open(run_dir.annotation_file, "w") as f:
+        f.writelines(lines)
+    n = len(run_dir.pathways)
+    assert incremental_run(capsys) == (5, condensed_size(n) - condensed_size(n - 5))
@@ -0,0 +1,106 @@
+"""Shard runs: merging their partial files back into a single run's output."""
+
+import os
+
+import numpy as np
+import pytest
+
+import generate_dendrogram
+import shards
+from condensed import condensed_size, load_components
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch, synthetic_inputs):
+    inputs = synthetic_inputs(tmp_path, 25, ndomains=8, nspecs=6, hits_per_domain=10, seed=4)
+    monkeypatch.chdir(tmp_path)
+    return inputs
+
+def outputs():
+    with open(generate_dendrogram.outfile) as f, open(generate_dendrogram.tree_outfile) as g:
+        return f.read(), g.read(), load_components(generate_dendrogram.components_outfile)[1]
+
+def score_shards(nshards, which=None):
+    for i in which or range(1, nshards + 1):
+        generate_dendrogram.main(["--no-cache", "--shard", "%d/%d" % (i, nshards)])
+
+@pytest.mark.parametrize("nshards", [1, 3])
+def test_merge_matches_full_run(run_dir, nshards):
+    generate_dendrogram.main(["--no-cache"])
+    expected = outputs()
+    for path in (generate_dendrogram.outfile, generate_dendrogram.tree_outfile,
+                 generate_dendrogram.components_outfile):
+        os.remove(path)
+    score_shards(nshards)
+    generate_dendrogram.main(["--no-cache", "--merge"])
+    distances, tree, components = outputs()
+    assert distances == expected[0] and tree == expected[1]
+    assert np.array_equal(components, expected[2])
+
+def test_default_merge_takes_the_complete_set(run_dir):
+    ## Left over from an unfinished run of another shard count
+    score_shards(4, [1, 3])
+    score_shards(2)
+    assert shards.find_shards(generate_dendrogram.components_outfile) == [
+        shards.shard_path(generate_dendrogram.components_outfile, i, 2) for i in (1, 2)]
+    generate_dendrogram.main(["--no-cache", "--merge"])
+    assert os.path.exists(generate_dendrogram.outfile)
+
+def test_default_merge_needs_one_complete_set(run_dir, capsys):
+    with pytest.raises(ValueError, match="no shard files"):
+        shards.find_shards(generate_dendrogram.components_outfile)
+    score_shards(3, [1, 2])
+    with pytest.raises(ValueError, match="2 of 3"):
+        shards.find_shards(generate_dendrogram.components_outfile)
+    score_shards(1)
+    score_shards(2)
+    with pytest.raises(SystemExit):
+        generate_dendrogram.main(["--no-cache", "--merge"])
+    assert "complete sets of 1 and of 2 shards" in capsys.readouterr().err
+
+def saved_shards(tmp_path, cuts, first=1, nshards=None, prefix="part"):
+    """
+    Shard files over the pairs of 6 pathways, split at cuts and numbered
+    from first, of nshards (default: as many as the ranges).
+    """
+    names = ["p%d" % k for k in range(6)]
+    bounds = list(zip(cuts[:-1], cuts[1:]))
+    paths = []
+    for k, (start, stop) in enumerate(bounds):
+        path = str(tmp_path / ("%s%d.npz" % (prefix, k)))
+        components = np.tile(np.arange(start, stop, dtype=float), (3, 1))
+        shards.save_shard(path, names, (start, stop), (first + k, nshards or len(bounds)),
+                          components, {"nbhood": 3})
+        paths.append(path)
+    return paths
+
+def test_merge_shards(tmp_path):
+    npairs = condensed_size(6)
+    paths = saved_shards(tmp_path, [0, 4, 9, npairs])
+    names, components, state = shards.merge_shards(paths[::-1])
+    assert names == ["p%d" % k for k in range(6)] and state == {"nbhood": 3}
+    assert np.array_equal(components, np.tile(np.arange(npairs, dtype=float), (3, 1)))
+
+def test_merge_shards_gap(tmp_path):
+    paths = saved_shards(tmp_path, [0, 4, 9, condensed_size(6)])
+    ## Shard 2 scored pairs 4..8, shard 3 starts at 10
+    paths[2] = saved_shards(tmp_path, [10, condensed_size(6)], 3, 3, "late")[0]
+    with pytest.raises(ValueError, match="pairs 9..9 are missing"):
+        shards.merge_shards(paths)
+    with pytest.raises(ValueError, match="pairs 9..%d are missing" % (condensed_size(6) - 1)):
+        shards.merge_shards(saved_shards(tmp_path, [0, 4, 9]))
+
+def test_merge_shards_overlap(tmp_path):
+    paths = saved_shards(tmp_path, [0, 4, 9, condensed_size(6)])
+    paths[2] = saved_shards(tmp_path, [7, condensed_size(6)], 3, 3, "early")[0]
+    with pytest.raises(ValueError, match="pairs 7..8 are in two shards"):
+        shards.merge_shards(paths)
+
+def test_merge_shards_mismatch(tmp_path):
+    paths = saved_shards(tmp_path, [0, 4, 9, condensed_size(6)])
+    with pytest.raises(ValueError, match="missing \\[2\\]"):
+        shards.merge_shards([paths[0], paths[2]])
+    other = str(tmp_path / "other.npz")
+    shards.save_shard(other, ["p%d" % k for k in range(6)], (4, 9), (2, 3),
+                      np.zeros((3, 5)), {"nbhood": 4})
+    with pytest.raises(ValueError, match="different inputs or parameters"):
+        shards.merge_shards([paths[0], other, paths[2]])
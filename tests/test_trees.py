@@ -0,0 +1,159 @@
+"""Trees against Bio.Phylo's DistanceTreeConstructor and brute-force agglomeration."""
+
+import io
+
+import numpy as np
+import pytest
+
+import trees
+import generate_dendrogram
+
+Phylo = pytest.importorskip("Bio.Phylo")
+from Bio.Phylo.TreeConstruction import DistanceMatrix, DistanceTreeConstructor
+
+def bio_newick(condensed, names, method):
+    """Newick of Bio.Phylo's tree of method (upgma or nj) for the condensed matrix."""
+    n = len(names)
+    matrix = [[0.0] * (i + 1) for i in range(n)]
+    k = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            matrix[j][i] = float(condensed[k])
+            k += 1
+    tree = getattr(DistanceTreeConstructor(), method)(DistanceMatrix(list(names), matrix))
+    out = io.StringIO()
+    Phylo.write(tree, out, "newick")
+    return out.getvalue().strip()
+
+def random_matrix(seed, size=(2, 40), decimals=None):
+    """
+    A random condensed matrix; with decimals, rounded so that ties
+    abound, as with the few distinct scores of real runs.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(*size))
+    condensed = rng.random(n * (n - 1) // 2)
+    if decimals is not None:
+        condensed = np.round(condensed, decimals)
+    return condensed, ["p%d" % k for k in range(n)]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_upgma_matches_bio(seed):
+    condensed, names = random_matrix(seed)
+    assert len(np.unique(condensed)) == len(condensed)
+    assert trees.upgma(condensed, names).newick() == bio_newick(condensed, names, "upgma")
+
+@pytest.mark.parametrize("seed,decimals", [(seed, seed % 3) for seed in range(20)])
+def test_upgma_matches_bio_on_ties(seed, decimals):
+    condensed, names = random_matrix(seed, (3, 40), decimals)
+    assert trees.upgma(condensed, names).newick() == bio_newick(condensed, names, "upgma")
+
+def test_upgma_quoted_labels():
+    condensed, names = random_matrix(3, (6, 7))
+    names = ["a b", "c'd", "e:f", "g", "h(i)", "j,k"][:len(names)]
+    assert trees.upgma(condensed, names).newick() == bio_newick(condensed, names, "upgma")
+
+@pytest.fixture(scope="module")
+def scored(tmp_path_factory, synthetic_inputs):
+    """Distances of generate_dendrogram's default weighting over synthetic inputs."""
+    inputs = synthetic_inputs(tmp_path_factory.mktemp("trees"), 60, ndomains=4, nspecs=3,
+                              hits_per_domain=6, seed=2)
+    components = generate_dendrogram.generate_components(inputs.pathways, inputs.annotation,
+                                                         inputs.dist, 3)
+    condensed = generate_dendrogram.combine_components(components, generate_dendrogram.Jaccardw,
+                                                       generate_dendrogram.GKw,
+                                                       generate_dendrogram.DDSw, 1)
+    return condensed, list(inputs.pathways)
+
+@pytest.mark.parametrize("method", ["upgma", "nj"])
+def test_matches_bio_on_scores(scored, method):
+    condensed, names = scored
+    assert len(np.unique(condensed)) < len(condensed) / 2
+    assert trees.build_tree(condensed, names, method).newick() == bio_newick(condensed, names, method)
+
+def test_upgma_on_disk(tmp_path):
+    condensed, names = random_matrix(4, decimals=1)
+    scratch = str(tmp_path / "work.npy")
+    assert trees.upgma(condensed, names, scratch).newick() == trees.upgma(condensed, names).newick()
+
+@pytest.mark.parametrize("seed,decimals", [(seed, (None, 1, 0)[seed % 3]) for seed in range(30)])
+def test_nj_matches_bio(seed, decimals):
+    condensed, names = random_matrix(seed, (3, 40), decimals)
+    assert trees.nj(condensed, names).newick() == bio_newick(condensed, names, "nj")
+
+def test_nj_small():
+    assert trees.nj(np.array([]), ["a"]).newick() == "a:0;"
+    assert trees.nj(np.array([0.5]), ["a", "b"]).newick() == bio_newick(np.array([0.5]), ["a", "b"], "nj")
+
+@pytest.mark.parametrize("decimals", [None, 1])
+def test_nj_joins_batches(decimals):
+    ## Rows one at a time, and every row at once, join the same pairs
+    condensed, names = random_matrix(5, (35, 36), decimals)
+    expected = trees._nj_joins(condensed.copy(), len(names))
+    for batch, block in [(1, 1), (len(names), 1 << 22)]:
+        assert trees._nj_joins(condensed.copy(), len(names), batch, block) == expected
+
+def leaf_matrix(condensed, n):
+    square = np.zeros((n, n))
+    square[np.triu_indices(n, 1)] = condensed
+    return square + square.T
+
+def cluster_distance(square, a, b, method):
+    d = square[np.ix_(sorted(a), sorted(b))]
+    return {"single": d.min, "complete": d.max, "average": d.mean}[method]()
+
+def brute_linkage(condensed, n, method):
+    """Clusters of a global-minimum agglomeration, mapped to their merge distances."""
+    square = leaf_matrix(condensed, n)
+    current = [frozenset([k]) for k in range(n)]
+    merged = {}
+    while len(current) > 1:
+        d, a, b = min((cluster_distance(square, a, b, method), a, b)
+                      for k, a in enumerate(current) for b in current[k + 1:])
+        current = [c for c in current if c not in (a, b)] + [a | b]
+        merged[a | b] = d
+    return merged
+
+def merge_distances(tree):
+    """Leaf set below each inner node mapped to twice its height, in node order."""
+    n = len(tree.names)
+    below = [frozenset([k]) for k in range(n)]
+    height = [0.0] * n
+    merged = []
+    for children in tree.children:
+        below.append(frozenset().union(*[below[c] for c in children]))
+        height.append(height[children[0]] + tree.branch_lengths[children[0]])
+        merged.append((below[-1], [below[c] for c in children], 2 * height[-1]))
+    return merged
+
+@pytest.mark.parametrize("method", ["single", "complete", "average"])
+@pytest.mark.parametrize("seed", range(8))
+def test_linkage_matches_brute_force(method, seed):
+    condensed, names = random_matrix(seed, (2, 30))
+    expected = brute_linkage(condensed, len(names), method)
+    merged = merge_distances(trees.linkage(condensed, names, method))
+    assert set(cluster for cluster, _, _ in merged) == set(expected)
+    for cluster, _, d in merged:
+        assert d == pytest.approx(expected[cluster])
+
+@pytest.mark.parametrize("method", ["single", "complete", "average"])
+@pytest.mark.parametrize("seed,decimals", [(seed, seed % 2) for seed in range(6)] + [("scored", None)])
+def test_linkage_tied_merges_are_minimal(scored, method, seed, decimals):
+    ## On ties the chain may merge in another order than a global-minimum
+    ## search, but in order of height every merge is at the minimum
+    ## distance between the clusters left
+    if seed == "scored":
+        condensed, names = scored
+    else:
+        condensed, names = random_matrix(seed, (20, 40), decimals)
+    square = leaf_matrix(condensed, len(names))
+    current = set(frozenset([k]) for k in range(len(names)))
+    for cluster, children, d in merge_distances(trees.linkage(condensed, names, method)):
+        assert all(c in current for c in children)
+        assert d == pytest.approx(cluster_distance(square, children[0], children[1], method))
+        clusters = sorted(current, key=min)
+        best = min(cluster_distance(square, a, b, method)
+                   for k, a in enumerate(clusters) for b in clusters[k + 1:])
+        assert d == pytest.approx(best)
+        current -= set(children)
+        current.add(cluster)
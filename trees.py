@@ -0,0 +1,461 @@
+"""
+Dendrograms built directly from a condensed distance matrix.
+
+upgma() reproduces the tree Bio.Phylo's DistanceTreeConstructor.upgma
+writes for the same matrix, tied merges included: it makes the same
+global-minimum merge as Bio.Phylo at every step, but finds it from the
+minimum of each row, kept up to date as clusters merge, instead of
+Bio.Phylo's cubic search. linkage() builds single, complete and
+average (size-weighted) linkage trees in O(n^2) time with the
+nearest-neighbour chain algorithm, which on ties may merge in another
+order than a global-minimum search.
+
+nj() reproduces Bio.Phylo's DistanceTreeConstructor.nj, up to rounding
+on near ties, with a pruned search for the pair to join: a lower
+bound on the best Q-value of each row, kept from its last computed
+minimum, rules most rows out without computing them.
+"""
+
+import os
+import re
+import numpy as np
+
+## Bio.Phylo's Newick writer quotes any label that is not one of these
+_UNQUOTED_LABEL = re.compile(r"[^\s\(\)\[\]\'\:\;\,]+$")
+
+class Tree:
+    """
+    A rooted tree over n named leaves. Nodes 0..n-1 are the leaves and
+    nodes n.. the inner nodes; ``children[k]`` lists the children of
+    inner node n+k and the last inner node is the root.
+    """
+    def __init__(self, names, children, branch_lengths, labels):
+        self.names = list(names)
+        self.children = children
+        self.branch_lengths = branch_lengths
+        self.labels = labels
+
+    def label(self, node):
+        n = len(self.names)
+        return self.names[node] if node < n else self.labels[node - n]
+
+    def newick(self):
+        """The tree in Newick format as Bio.Phylo writes it."""
+        n = len(self.names)
+        root = n + len(self.children) - 1 if self.children else 0
+        out = []
+        ## Walk the tree with an explicit stack; deep trees would exhaust
+        ## the recursion limit
+        stack = [(root, False)]
+        while stack:
+            node, closing = stack.pop()
+            if node is None:
+                out.append(",")
+                continue
+            if node >= n and not closing:
+                out.append("(")
+                stack.append((node, True))
+                children = self.children[node - n]
+                for k in range(len(children) - 1, -1, -1):
+                    stack.append((children[k], False))
+                    if k:
+                        stack.append((None, False))
+                continue
+            if closing:
+                out.append(")")
+            label = self.label(node)
+            if label and not _UNQUOTED_LABEL.match(label):
+                label = "'%s'" % label.replace("'", "''")
+            out.append(label + ":%1.8g" % (self.branch_lengths[node] or 0.0))
+        return "".join(out) + ";"
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.newick() + "\n")
+
+def _row_offsets(n):
+    """offsets[k] + j is the condensed index of pair k < j."""
+    k = np.arange(n, dtype=np.int64)
+    return n*k - k*(k+1)//2 - k - 1
+
+def _row_index(x, offsets, slots):
+    """Condensed indices of the pairs between slot x and each of slots."""
+    return np.where(slots < x, offsets[slots] + x, offsets[x] + slots)
+
+def nn_chain(condensed, n, update):
+    """
+    Agglomerate n clusters with the nearest-neighbour chain algorithm.
+    Valid for any reducible linkage, whose new distances are given by
+    update(d_a, d_b, size_a, size_b) for the rows of the two merged
+    clusters. The distances are updated in place, so pass a copy.
+
+    Returns the merges as (slot_a, slot_b, distance) in the order they
+    were made; the merged cluster keeps slot_b.
+    """
+    D = condensed
+    offsets = _row_offsets(n)
+    size = np.ones(n, dtype=np.int64)
+    active = np.ones(n, dtype=bool)
+    merges = []
+    chain = []
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        top = chain[-1]
+        others = np.nonzero(active)[0]
+        others = others[others != top]
+        d = D[_row_index(top, offsets, others)]
+        nearest = int(others[np.argmin(d)])
+        dmin = d.min()
+        ## On ties keep walking back down the chain, so that it terminates
+        if len(chain) > 1 and D[_row_index(top, offsets, np.array([chain[-2]]))][0] <= dmin:
+            nearest = chain[-2]
+        if len(chain) > 1 and nearest == chain[-2]:
+            chain.pop()
+            chain.pop()
+            a, b = top, nearest
+            if a > b:
+                a, b = b, a
+            rest = others[others != b]
+            row_a = _row_index(a, offsets, rest)
+            row_b = _row_index(b, offsets, rest)
+            merges.append((a, b, D[_row_index(a, offsets, np.array([b]))][0]))
+            D[row_b] = update(D[row_a], D[row_b], size[a], size[b])
+            size[b] += size[a]
+            active[a] = False
+        else:
+            chain.append(nearest)
+    return merges
+
+def _lower_minimum(D, offsets, active, row):
+    """
+    The smallest distance of slot row to an active slot before it, and
+    the last such slot: Bio.Phylo's scan keeps the last minimum.
+    """
+    cols = np.nonzero(active[:row])[0]
+    if not len(cols):
+        return np.inf, -1
+    d = D[offsets[cols] + row]
+    last = len(d) - 1 - int(np.argmin(d[::-1]))
+    return d[last], int(cols[last])
+
+def wpgma_merges(condensed, n):
+    """
+    Agglomerate n clusters as Bio.Phylo's upgma does: merge the closest
+    pair, the last in its row-by-row scan of the lower triangle on ties,
+    into the earlier slot, whose new distances are the plain means of
+    the two rows. The distances are updated in place, so pass a copy.
+
+    Every row keeps its minimum over the slots before it. A merge only
+    changes the merged row, which is recomputed, and one column of the
+    later rows, which is compared with their minimum; rows whose
+    minimum was in either merged column are recomputed.
+
+    Returns the merges as (slot_a, slot_b, distance) in the order they
+    were made, slot_a > slot_b; the merged cluster keeps slot_b.
+    """
+    D = condensed
+    offsets = _row_offsets(n)
+    active = np.ones(n, dtype=bool)
+    low = np.full(n, np.inf)
+    column = np.full(n, -1, dtype=np.int64)
+    for row in range(1, n):
+        low[row], column[row] = _lower_minimum(D, offsets, active, row)
+    merges = []
+    while len(merges) < n - 1:
+        dmin = low.min()
+        a = int(np.nonzero(low == dmin)[0][-1])
+        b = int(column[a])
+        merges.append((a, b, dmin))
+        active[a] = False
+        low[a] = np.inf
+        rest = np.nonzero(active)[0]
+        rest = rest[rest != b]
+        row_b = _row_index(b, offsets, rest)
+        D[row_b] = (D[_row_index(a, offsets, rest)] + D[row_b]) / 2
+        low[b], column[b] = _lower_minimum(D, offsets, active, b)
+        later = rest[rest > b]
+        d = D[offsets[b] + later]
+        stale = (column[later] == a) | (column[later] == b)
+        better = ~stale & ((d < low[later]) | ((d == low[later]) & (b > column[later])))
+        low[later[better]] = d[better]
+        column[later[better]] = b
+        for row in later[stale].tolist():
+            low[row], column[row] = _lower_minimum(D, offsets, active, row)
+    return merges
+
+def _single_update(d_a, d_b, size_a, size_b):
+    return np.minimum(d_a, d_b)
+
+def _complete_update(d_a, d_b, size_a, size_b):
+    return np.maximum(d_a, d_b)
+
+def _average_update(d_a, d_b, size_a, size_b):
+    return (size_a * d_a + size_b * d_b) / float(size_a + size_b)
+
+_LINKAGE_UPDATES = {"single": _single_update, "complete": _complete_update,
+                    "average": _average_update}
+
+## Methods of build_tree()
+TREE_METHODS = ("upgma", "nj", "single", "complete", "average")
+
+def working_copy(condensed, scratch=None, block=1 << 22):
+    """
+    A float64 copy of condensed for nn_chain to update. With a scratch
+    path the copy is a memory-mapped file there, filled block by block,
+    so neither it nor a memmapped condensed is ever read whole into
+    memory; remove the file when done.
+    """
+    if scratch is None:
+        return np.array(condensed, dtype=np.float64)
+    work = np.lib.format.open_memmap(scratch, mode="w+", dtype=np.float64, shape=(len(condensed),))
+    for start in range(0, len(condensed), block):
+        work[start:start + block] = condensed[start:start + block]
+    return work
+
+def upgma(condensed, names, scratch=None):
+    """
+    Tree of the pathways in names from their condensed distances, the
+    one Bio.Phylo's upgma builds (see wpgma_merges): InnerK is the K-th
+    merge, the child in the later slot comes first and branch lengths
+    are half the merge distance less the child's height. See
+    working_copy for scratch.
+    """
+    n = len(names)
+    work = working_copy(condensed, scratch)
+    try:
+        merges = wpgma_merges(work, n)
+    finally:
+        if scratch is not None:
+            del work
+            os.remove(scratch)
+    return _tree_from_merges(names, merges)
+
+def linkage(condensed, names, method, scratch=None):
+    """
+    Single, complete or average linkage tree (see TREE_METHODS) of the
+    pathways in names, laid out like upgma()'s: InnerK is the K-th merge
+    in order of height, the child holding the later first leaf comes
+    first and branch lengths are half the merge distance less the
+    child's height. See working_copy for scratch.
+    """
+    n = len(names)
+    work = working_copy(condensed, scratch)
+    try:
+        merges = nn_chain(work, n, _LINKAGE_UPDATES[method])
+    finally:
+        if scratch is not None:
+            del work
+            os.remove(scratch)
+    return _tree_from_merges(names, merges)
+
+def _nj_pick(D, offsets, slots, hi, lo):
+    """
+    The (i, j) slots Bio.Phylo's nj joins next, among the candidate
+    pairs (hi[k], lo[k]), hi > lo, with its exact arithmetic: row sums
+    added up in slot order, q = d(i, j) - u_i - u_j with i the later
+    slot, and the first smallest q in row order. On ties, as at the last
+    few joins, only rounding decides.
+    """
+    nodes = np.unique(np.concatenate([hi, lo]))
+    r = len(slots)
+    node_dist = dict((x, sum(D[_row_index(x, offsets, slots[slots != x])].tolist(), 0) / (r - 2))
+                     for x in nodes.tolist())
+    d = D[_row_index(hi, offsets, lo)].tolist()
+    best = None
+    for a, b, dab in zip(hi.tolist(), lo.tolist(), d):
+        candidate = (dab - node_dist[a] - node_dist[b], a, b)
+        if best is None or candidate < best:
+            best = candidate
+    i, j = best[1], best[2]
+    if (i, j) == (slots[1], slots[0]):
+        ## Bio.Phylo starts its search from (i, j) = (0, 1), so the
+        ## first pair, if never beaten, joins the other way round
+        i, j = j, i
+    return i, j
+
+def _nj_joins(D, n, batch=8, block=1 << 22, tolerance=1e-9):
+    """
+    Neighbour-joining on the condensed matrix D of n leaves, updated in
+    place. Returns the joins as (slot_i, slot_j, length_i, length_j) in
+    order, the new node taking slot_j, and the last two slots with
+    their distance.
+
+    The joined pair minimises q = d(i, j) - u_i - u_j, u = R / (r - 2).
+    Every row keeps the smallest d(i, j) - u_j it had when last
+    computed, and ``drift`` adds up the largest rise of any u per join
+    since, so no pair of row i beats that minimum less the drift of its
+    row, less u_i. Rows are computed in order of that bound, ``batch``
+    and then twice as many at a time, until the bound of the next one
+    is above the best q found. The pairs within ``tolerance`` of the
+    best, where the running row sums R could round differently from
+    Bio.Phylo's, go to _nj_pick.
+    """
+    offsets = _row_offsets(n)
+    active = np.ones(n, dtype=bool)
+    slots = np.arange(n)
+    R = np.empty(n)
+    for x in range(n):
+        R[x] = D[_row_index(x, offsets, slots[slots != x])].sum()
+    u = R / max(n - 2, 1)
+    ## best_row[x] - (drift - stamp[x]) <= d(x, y) - u_y for every active y
+    best_row = np.empty(n)
+    for x in range(n):
+        others = slots[slots != x]
+        best_row[x] = (D[_row_index(x, offsets, others)] - u[others]).min()
+    stamp = np.zeros(n)
+    drift = 0.0
+    joins = []
+    r = n
+    while r > 2:
+        slots = np.nonzero(active)[0]
+        node_dist = u[slots]
+        bound = best_row[slots] - (drift - stamp[slots]) - node_dist
+        order = np.argsort(bound, kind="stable")
+        best = np.inf
+        found = []
+        pos, size = 0, batch
+        while pos < r and bound[order[pos]] <= best + tolerance * (1 + abs(best)):
+            rows = order[pos:pos + size]
+            pos += len(rows)
+            size = min(2 * size, max(1, block // r))
+            x = slots[rows][:, None]
+            d = D[_row_index(x, offsets, slots[None, :])] - node_dist[None, :]
+            d[x == slots[None, :]] = np.inf
+            best_row[slots[rows]] = d.min(axis=1)
+            stamp[slots[rows]] = drift
+            q = d - node_dist[rows][:, None]
+            best = min(best, q.min())
+            rr, cc = np.nonzero(q <= best + tolerance * (1 + abs(best)))
+            found.append((q[rr, cc], slots[rows[rr]], slots[cc]))
+        q, a, b = [np.concatenate(column) for column in zip(*found)]
+        near = q <= best + tolerance * (1 + abs(best))
+        i, j = _nj_pick(D, offsets, slots, np.maximum(a, b)[near], np.minimum(a, b)[near])
+        dij = D[_row_index(i, offsets, np.array([j]))][0]
+        ## Branch lengths from row sums added up in slot order, as
+        ## Bio.Phylo does, rather than the running R
+        dist_i, dist_j = [sum(D[_row_index(x, offsets, slots[slots != x])].tolist()) / (r - 2)
+                          for x in (i, j)]
+        length_i = (dij + dist_i - dist_j) / 2.0
+        joins.append((i, j, length_i, dij - length_i))
+        others = slots[(slots != i) & (slots != j)]
+        row_i = _row_index(i, offsets, others)
+        row_j = _row_index(j, offsets, others)
+        d_i, d_j = D[row_i], D[row_j]
+        new = (d_i + d_j - dij) / 2.0
+        D[row_j] = new
+        R[others] += new - d_i - d_j
+        R[j] = new.sum()
+        active[i] = False
+        r -= 1
+        if r > 2:
+            previous = u[others]
+            u[others] = R[others] / (r - 2)
+            u[j] = R[j] / (r - 2)
+            drift += float((u[others] - previous).max())
+            ## The new node's column, and its own row
+            best_row[others] = np.minimum(best_row[others], new - u[j] + (drift - stamp[others]))
+            best_row[j] = (new - u[others]).min()
+            stamp[j] = drift
+    a, b = np.nonzero(active)[0]
+    return joins, (a, b, D[_row_index(a, offsets, np.array([b]))][0])
+
+def nj(condensed, names, scratch=None):
+    """
+    Neighbour-joining tree of the pathways in names, laid out like
+    Bio.Phylo's nj: InnerK is the K-th join, its children the two
+    joined nodes, and the last node joined is the root, with the one
+    node left over as a third child. See working_copy for scratch.
+    """
+    n = len(names)
+    if n == 1:
+        return Tree(names, [], [0.0], [])
+    if n == 2:
+        d = float(condensed[0])
+        return Tree(names, [(1, 0)], [d - d / 2.0, d / 2.0, 0.0], ["Inner"])
+    work = working_copy(condensed, scratch)
+    try:
+        joins, (a, b, dab) = _nj_joins(work, n)
+    finally:
+        if scratch is not None:
+            del work
+            os.remove(scratch)
+    node = list(range(n))
+    children = []
+    branch_lengths = [0.0] * (2 * n - 2)
+    for k, (i, j, length_i, length_j) in enumerate(joins):
+        children.append((node[i], node[j]))
+        branch_lengths[node[i]] = length_i
+        branch_lengths[node[j]] = length_j
+        node[j] = n + k
+    ## The last join holds one of the two slots left
+    root, other = (a, b) if node[a] == n + len(joins) - 1 else (b, a)
+    children[-1] = children[-1] + (node[other],)
+    branch_lengths[node[other]] = dab
+    labels = ["Inner" + str(k + 1) for k in range(len(joins))]
+    return Tree(names, children, branch_lengths, labels)
+
+def build_tree(condensed, names, method="upgma", scratch=None):
+    """The tree of one of TREE_METHODS; see upgma(), nj() and linkage()."""
+    if method == "upgma":
+        return upgma(condensed, names, scratch)
+    if method == "nj":
+        return nj(condensed, names, scratch)
+    if method in _LINKAGE_UPDATES:
+        return linkage(condensed, names, method, scratch)
+    raise ValueError("tree method must be one of " + ", ".join(TREE_METHODS))
+
+def _tree_from_merges(names, merges):
+    n = len(names)
+    m = len(merges)
+    ## Sorted by height, the merges of a monotone linkage come in the
+    ## order a global-minimum search makes them; the stable sort keeps
+    ## children ahead of parents on ties
+    order = sorted(range(m), key=lambda k: merges[k][2])
+    rank = [0] * m
+    for r, k in enumerate(order):
+        rank[k] = r
+    node = list(range(n))        # slot -> node it currently holds
+    first_leaf = list(range(n))  # slot -> smallest leaf index below it
+    children = [None] * m
+    heights = [None] * m
+    for k, (a, b, dist) in enumerate(merges):
+        if first_leaf[a] > first_leaf[b]:
+            children[rank[k]] = (node[a], node[b])
+        else:
+            children[rank[k]] = (node[b], node[a])
+        heights[rank[k]] = dist
+        node[b] = n + rank[k]
+        first_leaf[b] = min(first_leaf[a], first_leaf[b])
+    branch_lengths = [0.0] * (n + m)
+    height = [0] * (n + m)
+    for k in range(m):
+        for c in children[k]:
+            branch_lengths[c] = heights[k] * 1.0 / 2 - height[c]
+        height[n + k] = max(height[c] + branch_lengths[c] for c in children[k])
+    if m:
+        branch_lengths[-1] = 0
+    labels = ["Inner" + str(k + 1) for k in range(m)]
+    return Tree(names, children, branch_lengths, labels)
+
+def clusters(tree):
+    """
+    The leaf sets below the inner nodes of a tree, as frozensets of leaf
+    indices; the root's, which holds every leaf, is left out.
+    """
+    n = len(tree.names)
+    below = [frozenset([k]) for k in range(n)]
+    for children in tree.children:
+        below.append(frozenset().union(*[below[c] for c in children]))
+    return set(below[n:-1])
+
+def robinson_foulds(a, b):
+    """
+    Rooted Robinson-Foulds distance between two trees over the same
+    names in the same order: the number of clusters found in only one
+    of them. Returns (distance, largest possible distance).
+    """
+    if list(a.names) != list(b.names):
+        raise ValueError("trees must have the same leaves in the same order")
+    ca, cb = clusters(a), clusters(b)
+    return len(ca ^ cb), len(ca) + len(cb)